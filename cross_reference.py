@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""PDFから抽出したFAX番号（pdf_to_text.py）とウェブから収集したFAX番号（fax_scraper_cli.py など）の突き合わせ
+
+PDFの結果（page,fax_number,context）は番号で引くdictと、周辺テキストから名簿のクリニック名を
+引く索引（name_matcher.NameIndex）で施設に対応付け、ウェブの結果（クリニック名, FAX番号）と
+行ごとに比べる。結果は次のstatusでCSVに出力する。
+
+- confirmed: ウェブとPDFの番号が一致
+- conflict: ウェブとPDFで番号が異なる（ウェブの番号がPDFでは別の施設のものになっている場合も含む）
+- web_only: ウェブでだけ見つかった
+- pdf_only: PDFでだけ見つかった（--fill でウェブ側の入力に書き込むと、次回のスクレイピングで飛ばせる）
+- missing: どちらにもない
+
+    python cross_reference.py clinics.csv 厚生局_fax_numbers.csv [他のPDFの結果...] -o crossref.csv
+    python cross_reference.py --benchmark 200000
+    python cross_reference.py --check        # --fill が名簿のほかの列を変えずに書き出すかを確かめる
+"""
+
+import argparse
+import csv
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from name_matcher import TITLE_ACCEPT_THRESHOLD, NameIndex, normalize_name, weighted_containment
+from phone_normalizer import normalize_phone, phone_digits, to_halfwidth
+from row_pipeline import read_csv_strings
+
+# PDFの周辺テキストを施設に対応付ける点数
+CONTEXT_THRESHOLD = TITLE_ACCEPT_THRESHOLD
+# 1つの周辺テキストに含まれうる施設名の数（前後の行の施設も含めて同点を比べる）
+MAX_NAMES_PER_CONTEXT = 5
+STATUSES = ('confirmed', 'conflict', 'web_only', 'pdf_only', 'missing')
+OUTPUT_COLUMNS = ('status', 'web_fax', 'pdf_fax', 'name_score', 'pdf_file', 'pdf_page', 'pdf_context')
+
+
+def load_pdf_results(paths):
+    """pdf_to_text.pyの出力CSVを読み込み、レコード(dict)のリストを返す
+
+    番号の先頭の0が消えないよう、pandasではなくcsvモジュールで文字列のまま読む。
+    """
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                digits = phone_digits(row.get('fax_number'))
+                if digits is None:
+                    continue
+                records.append({
+                    'digits': digits,
+                    'context': row.get('context') or '',
+                    'page': row.get('page') or '',
+                    # アーカイブから抽出した結果は、中のどのPDFかがfile列に入っている
+                    'file': row.get('file') or os.path.basename(path),
+                })
+    return records
+
+
+def preceding_text(context, digits):
+    """周辺テキストのうち、番号が書かれている行までの部分（見つからなければ周辺テキスト全体）"""
+    lines = context.split('\n')
+    for i, line in enumerate(lines):
+        if digits in re.sub(r'\D', '', to_halfwidth(line)):
+            return '\n'.join(lines[:i + 1])
+    return context
+
+
+class CrossReference:
+    """PDFの結果を番号と施設名で引けるようにした索引
+
+    PDFのレコードごとに周辺テキストに最もよく一致する名簿の名前を探し、名前ごとに最も一致する
+    レコードを1件持つ。ウェブで同じ番号が見つかっている名前（web_numbers: 番号 → 名前）があれば、
+    まずその名前だけを確かめる（一致すれば名簿全体から探さない）。周辺テキストには前後の行の施設名も入るため、同点なら番号の行までに
+    書かれていて、番号により近い方を選ぶ（名簿では施設名の後に番号が書かれる）。
+    """
+
+    def __init__(self, names, pdf_records, web_numbers=None, threshold=CONTEXT_THRESHOLD):
+        self.threshold = threshold
+        self.name_index = NameIndex(names)
+        self.web_numbers = web_numbers or {}
+        self.records = pdf_records
+        self.by_number = {}
+        self.by_name = {}
+        for record in pdf_records:
+            self.by_number.setdefault(record['digits'], record)
+            self.add_record(record)
+
+    def add_record(self, record):
+        name = self.web_numbers.get(record['digits'])
+        score = self.name_index.score(name, record['context']) if name is not None else 0.0
+        if score < self.threshold:
+            matches = self.name_index.best_matches(record['context'], limit=MAX_NAMES_PER_CONTEXT,
+                                                   min_score=self.threshold)
+            if not matches:
+                return
+            name, score = matches[0]
+            tied = [match for match in matches if match[1] == score]
+            if len(tied) > 1:
+                name = max(tied, key=lambda match: self.proximity(match[0], record))[0]
+
+        current = self.by_name.get(name)
+        if current is None:
+            self.by_name[name] = (score, record)
+            return
+        current_score, current_record = current
+        if score > current_score or (
+                score == current_score
+                and self.proximity(name, record) > self.proximity(name, current_record)):
+            self.by_name[name] = (score, record)
+
+    def proximity(self, name, record):
+        """名前が番号の行までにどれだけ含まれるかの点数と、番号にどれだけ近いか（大きいほど近い）"""
+        before = record.get('preceding')
+        if before is None:
+            before = record['preceding'] = normalize_name(preceding_text(record['context'], record['digits']))
+        weights = self.name_index.weights(name)
+        return weighted_containment(weights, before), max(before.rfind(gram) for gram in weights)
+
+    def unmatched(self):
+        """名簿のどの名前にも対応付かなかった（同じ名前でより一致するレコードがあった場合も含む）レコード"""
+        matched = {id(record) for _, record in self.by_name.values()}
+        return [record for record in self.records if id(record) not in matched]
+
+    def lookup(self, name):
+        """名前に対応付けたPDFのレコードと点数を返す（なければ(None, 0.0)）"""
+        found = self.by_name.get(name)
+        if found is None:
+            return None, 0.0
+        return found[1], found[0]
+
+    def resolve(self, name, web_fax):
+        """1件のクリニックを照合し、出力する行(dict)を返す"""
+        web_digits = phone_digits(web_fax) if web_fax else None
+        record, score = self.lookup(name)
+        if record is None and web_digits is not None:
+            # 名前では対応付かなかったが、同じ番号がPDFにある
+            record = self.by_number.get(web_digits)
+            if record is not None:
+                score = self.name_index.score(name, record['context'])
+
+        if web_digits is None:
+            status = 'pdf_only' if record is not None else 'missing'
+        elif record is None:
+            status = 'web_only'
+        elif record['digits'] == web_digits and score >= self.threshold:
+            status = 'confirmed'
+        else:
+            status = 'conflict'
+
+        return {
+            'status': status,
+            'web_fax': normalize_phone(web_digits) if web_digits else '',
+            'pdf_fax': normalize_phone(record['digits']) if record else '',
+            'name_score': round(score, 2) if record else '',
+            'pdf_file': record['file'] if record else '',
+            'pdf_page': record['page'] if record else '',
+            'pdf_context': record['context'].replace('\n', ' / ') if record else '',
+        }
+
+
+def cross_reference(web_df, pdf_records, log=print):
+    """ウェブの結果（最初の列がクリニック名、FAX番号列）とPDFのレコードを照合する
+
+    (結果のDataFrame, CrossReference)を返す。
+    """
+    name_column = web_df.columns[0]
+    names = web_df[name_column].fillna('').astype(str).tolist()
+    web_faxes = web_df['FAX番号'].tolist() if 'FAX番号' in web_df.columns else [None] * len(names)
+
+    start = time.perf_counter()
+    web_numbers = {}
+    for name, web_fax in zip(names, web_faxes):
+        digits = phone_digits(web_fax) if name and not pd.isna(web_fax) else None
+        if digits is not None:
+            web_numbers.setdefault(digits, name)
+    index = CrossReference([name for name in names if name], pdf_records, web_numbers)
+    indexed = time.perf_counter()
+    rows = []
+    for name, web_fax in zip(names, web_faxes):
+        row = index.resolve(name, None if pd.isna(web_fax) else str(web_fax))
+        row[name_column] = name
+        rows.append(row)
+    resolved = time.perf_counter()
+    log(f"索引の作成: {indexed - start:.2f}秒（PDF {len(pdf_records)}件、名簿 {len(names)}件）, "
+        f"照合: {resolved - indexed:.2f}秒, PDFで名簿に対応付かなかった番号: {len(index.unmatched())}件")
+    return pd.DataFrame(rows, columns=[name_column, *OUTPUT_COLUMNS]), index
+
+
+def fill_from_pdf(web_df, result):
+    """pdf_onlyの行のFAX番号をPDFの番号で埋めたウェブ側の入力を返す（スクレイパーはFAX番号のある行を飛ばす）"""
+    filled = web_df.copy()
+    if 'FAX番号' not in filled.columns:
+        filled['FAX番号'] = pd.Series(None, index=filled.index, dtype='object')
+    mask = (result['status'] == 'pdf_only').to_numpy()
+    filled.loc[mask, 'FAX番号'] = result.loc[mask, 'pdf_fax'].to_numpy()
+    if 'エラー詳細' in filled.columns:
+        filled.loc[mask, 'エラー詳細'] = None
+    return filled
+
+
+def print_summary(result):
+    counts = result['status'].value_counts()
+    print(f"{'status':<10}{'count':>8}")
+    for status in STATUSES:
+        print(f"{status:<10}{int(counts.get(status, 0)):>8}")
+
+
+def _benchmark(count):
+    """合成した名簿とPDFの結果で照合の速度と正解率を計測する
+
+    PDFの周辺テキストには次の施設名の行も入れ、ウェブの結果は6割をPDFと同じ番号、1割を別の番号、
+    残りを空欄にする。
+    """
+    rng = random.Random(0)
+    kana = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわ'
+    kanji = ('山田中川本村松井森林石原小野高橋佐藤鈴木伊東西北南寺尾岡崎谷口上下大内吉清水池宮沢渡辺加藤'
+             '斎藤近坂長谷部浜島永福桜青葉緑若竹梅春秋新旧駅前通丘台坂町市区和平安幸光明星')
+    suffixes = ['クリニック', '内科', '医院', '内科クリニック', 'こどもクリニック', '整形外科', '眼科', '皮膚科']
+    names = set()
+    while len(names) < count:
+        head = ''.join(rng.choice(kanji) for _ in range(2)) + ''.join(rng.choice(kana) for _ in range(2))
+        names.add(head + rng.choice(suffixes))
+    names = sorted(names)
+    rng.shuffle(names)
+
+    pdf_records = []
+    web_faxes = []
+    expected = []
+    for i, name in enumerate(names):
+        digits = f"045{i:07d}"
+        neighbor = names[(i + 1) % len(names)]
+        pdf_records.append({
+            'digits': digits, 'page': str(i // 40 + 1), 'file': 'benchmark.csv',
+            'context': f"{i} 医療法人 {name}\n〒230-0051 横浜市鶴見区 ({digits[:3]}-{digits[3:6]}-{digits[6:]})\n"
+                       f"{i + 1} {neighbor}",
+        })
+        roll = rng.random()
+        if roll < 0.6:
+            web_faxes.append(digits)
+            expected.append('confirmed')
+        elif roll < 0.7:
+            web_faxes.append(f"046{i:07d}")
+            expected.append('conflict')
+        else:
+            web_faxes.append(None)
+            expected.append('pdf_only')
+    web_df = pd.DataFrame({'クリニック名': names, 'FAX番号': web_faxes})
+
+    start = time.perf_counter()
+    result, _ = cross_reference(web_df, pdf_records)
+    elapsed = time.perf_counter() - start
+    correct = int((result['status'] == pd.Series(expected)).sum())
+    print(f"{count}件: {elapsed:.2f}秒（{count / elapsed:.0f}件/秒）, 正解: {correct}/{count}")
+    print_summary(result)
+
+
+def _check_fill(log=print):
+    """先頭が0の列や「NA」という名前を含む名簿を--fillに通し、PDFの番号を書いた列以外が変わらないことを確かめる
+
+    --fillの出力は次のスクレイピングの入力になるため、郵便番号や電話番号の先頭の0が落ちたり、
+    名前が欠損になったりしてはいけない。
+    """
+    roster = ("クリニック名,郵便番号,電話番号,FAX番号,エラー詳細\n"
+              "NA,0230001,0451112222,,\n"
+              "みなと内科クリニック,0600042,0112223333,045-111-2222,\n")
+    pdf = ("page,fax_number,context\n"
+           "3,019-654-3210,\"12 NA\n〒023-0001 奥州市 (019-654-3210)\"\n"
+           "4,045-111-2222,\"13 みなと内科クリニック\n〒060-0042 札幌市 (045-111-2222)\"\n")
+    with tempfile.TemporaryDirectory() as work_dir:
+        paths = {}
+        for name, text in (('roster.csv', roster), ('pdf_fax_numbers.csv', pdf)):
+            paths[name] = os.path.join(work_dir, name)
+            with open(paths[name], 'w', encoding='utf-8') as f:
+                f.write(text)
+        filled_path = os.path.join(work_dir, 'filled.csv')
+        main([paths['roster.csv'], paths['pdf_fax_numbers.csv'], '-o', os.path.join(work_dir, 'crossref.csv'),
+              '--fill', filled_path])
+        with open(filled_path, encoding='utf-8') as f:
+            filled = f.read()
+    expected = roster.replace("NA,0230001,0451112222,,", "NA,0230001,0451112222,019-654-3210,")
+    ok = filled == expected
+    log(f"--fillの出力: {'OK' if ok else 'NG'}")
+    if not ok:
+        log(f"期待:\n{expected}実際:\n{filled}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDFとウェブで集めたFAX番号の突き合わせ")
+    parser.add_argument("web_csv", nargs="?", help="スクレイパーの出力CSV（最初の列がクリニック名、FAX番号列）")
+    parser.add_argument("pdf_csvs", nargs="*", help="pdf_to_text.pyの出力CSV（*_fax_numbers.csv、複数指定可）")
+    parser.add_argument("-o", "--output", help="照合結果のCSV（省略時は <ウェブのCSV名>_crossref.csv）")
+    parser.add_argument("--fill", metavar="CSV",
+                        help="PDFでだけ見つかった番号をFAX番号列に書き込んだウェブ側のCSVを出力する")
+    parser.add_argument("--unmatched", metavar="CSV", help="名簿のどの施設にも対応付かなかったPDFの番号を出力する")
+    parser.add_argument("--benchmark", type=int, metavar="N", help="N件の合成データで照合の速度を計測する")
+    parser.add_argument("--check", action="store_true",
+                        help="先頭が0の列を含む名簿で、--fill がほかの列を変えずに書き出すかを確かめる")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        _benchmark(args.benchmark)
+        return 0
+    if args.check:
+        return 0 if _check_fill() else 1
+    if not args.web_csv or not args.pdf_csvs:
+        parser.error("ウェブの結果のCSVとPDFの結果のCSVを指定してください")
+
+    # --fillの出力は次のスクレイピングの入力になるため、名簿の値は文字列のまま読む
+    web_df = read_csv_strings(args.web_csv)
+    pdf_records = load_pdf_results(args.pdf_csvs)
+    result, index = cross_reference(web_df, pdf_records)
+
+    output_path = args.output or f"{os.path.splitext(args.web_csv)[0]}_crossref.csv"
+    result.to_csv(output_path, index=False, encoding='utf-8-sig')
+    print(f"照合結果を保存しました: {output_path}")
+    print_summary(result)
+
+    if args.fill:
+        fill_from_pdf(web_df, result).to_csv(args.fill, index=False)
+        print(f"PDFの番号を書き込んだCSVを保存しました: {args.fill}")
+    if args.unmatched:
+        unmatched = index.unmatched()
+        pd.DataFrame(unmatched, columns=['digits', 'page', 'file', 'context']).to_csv(
+            args.unmatched, index=False, encoding='utf-8-sig')
+        print(f"対応付かなかったPDFの番号（{len(unmatched)}件）を保存しました: {args.unmatched}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
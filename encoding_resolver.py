@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""日本語サイト（Shift_JIS / EUC-JP / UTF-8）の文字コードを速く決める
+
+response.apparent_encoding は本文全体に文字コード判定をかけるため、ページごとのCPU時間の
+かなりの部分を占める。ここでは次の順に決め、判定は先頭の一部だけに行う。
+
+1. HTTPヘッダーの charset
+2. BOM / 先頭部分の <meta charset> / <meta http-equiv="Content-Type">
+3. 同じホストで前回判定した結果
+4. 最初の非ASCIIバイトからの一部だけを使った判定（UTF-8として読めるか → 判定ライブラリ）
+
+インラインの<script>や<style>が長いページは先頭がASCIIだけで、どの文字コードとしても読めてしまう。
+そのため判定とホストの記録の確認は日本語が現れる位置から行い、ASCIIだけのページの結果は記録しない。
+
+    python encoding_resolver.py --benchmark [HTMLのディレクトリ]
+"""
+
+import argparse
+import codecs
+import os
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+# <meta charset> を探す範囲（HTMLの仕様では先頭1024バイト以内に書くことになっている）
+META_SCAN_BYTES = 4096
+# 判定ライブラリに渡す先頭部分の大きさ
+DETECT_BYTES = 16 * 1024
+
+CHARSET_HEADER_RE = re.compile(r'charset\s*=\s*["\']?([\w\-]+)', re.I)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w\-]+)', re.I)
+NON_ASCII_RE = re.compile(rb'[\x80-\xff]')
+
+# 文字コード名の正規化（Shift_JISは機種依存文字も読めるcp932として扱う）
+ENCODING_ALIASES = {
+    'shift_jis': 'cp932',
+    'shift-jis': 'cp932',
+    'sjis': 'cp932',
+    'x-sjis': 'cp932',
+    'ms_kanji': 'cp932',
+    'windows-31j': 'cp932',
+    'cp932': 'cp932',
+    'euc-jp': 'euc_jp',
+    'euc_jp': 'euc_jp',
+    'x-euc-jp': 'euc_jp',
+    'utf-8': 'utf-8',
+    'utf8': 'utf-8',
+    'iso-2022-jp': 'iso2022_jp',
+}
+
+# 判定できなかった場合の既定値
+FALLBACK_ENCODING = 'cp932'
+
+
+def normalize_encoding(name):
+    """文字コード名を正規化する。Pythonで扱えない名前ならNone"""
+    if not name:
+        return None
+    name = name.strip().lower()
+    if name in ENCODING_ALIASES:
+        return ENCODING_ALIASES[name]
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def charset_from_content_type(content_type):
+    """Content-Typeヘッダーのcharsetを返す"""
+    if not content_type:
+        return None
+    match = CHARSET_HEADER_RE.search(content_type)
+    return normalize_encoding(match.group(1)) if match else None
+
+
+def charset_from_meta(content):
+    """BOMか先頭部分の<meta>で宣言された文字コードを返す"""
+    if content.startswith(codecs.BOM_UTF8):
+        return 'utf-8'
+    match = META_CHARSET_RE.search(content[:META_SCAN_BYTES])
+    return normalize_encoding(match.group(1).decode('ascii', 'ignore')) if match else None
+
+
+def _detect_with_library(sample):
+    """requestsと同じ判定ライブラリ（charset_normalizerかchardet）で判定する"""
+    try:
+        from charset_normalizer import from_bytes
+        best = from_bytes(sample).best()
+        return best.encoding if best else None
+    except ImportError:
+        pass
+    try:
+        import chardet
+        return chardet.detect(sample)['encoding']
+    except ImportError:
+        return None
+
+
+def non_ascii_sample(content, limit=DETECT_BYTES):
+    """最初の非ASCIIバイトからlimitバイトまでを返す（ASCIIだけのページならNone）
+
+    途中で切った場合は、末尾で多バイト文字が切れている可能性があるため最後の数バイトを除く。
+    """
+    match = NON_ASCII_RE.search(content)
+    if match is None:
+        return None
+    sample = content[match.start():match.start() + limit]
+    return sample[:-3] if len(sample) == limit else sample
+
+
+def _decodes(sample, encoding):
+    """sampleがencodingとしてエラーなく読めるか"""
+    try:
+        sample.decode(encoding)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_prefix(content, limit=DETECT_BYTES):
+    """最初の非ASCIIバイトからのlimitバイトだけで文字コードを判定する（ASCIIだけのページならNone）"""
+    sample = non_ascii_sample(content, limit)
+    if sample is None:
+        return None
+    if _decodes(sample, 'utf-8'):
+        return 'utf-8'
+    return normalize_encoding(_detect_with_library(sample)) or FALLBACK_ENCODING
+
+
+class EncodingResolver:
+    """ヘッダー・meta・ホストごとの記録・先頭部分の判定の順に文字コードを決める
+
+    複数スレッドから共有できる。
+    """
+
+    def __init__(self, detect_bytes=DETECT_BYTES):
+        self.detect_bytes = detect_bytes
+        self._host_encodings = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, url, content, content_type=None):
+        """ページの文字コード名を返す"""
+        encoding = charset_from_content_type(content_type) or charset_from_meta(content)
+        if encoding:
+            return encoding
+
+        host = urlparse(url).netloc if url else None
+        with self._lock:
+            host_encoding = self._host_encodings.get(host)
+        sample = non_ascii_sample(content, self.detect_bytes)
+        if sample is None:
+            # ASCIIだけのページはどの文字コードでも同じ文字列になるため、判定もホストの記録もしない
+            return host_encoding or FALLBACK_ENCODING
+        # 同じホストのページは同じ文字コードのことがほとんどだが、念のため読めるか確かめる。
+        # UTF-8のバイト列はほとんどがcp932としてもエラーなく読めてしまうため、UTF-8以外の記録は
+        # detect_prefixと同じくUTF-8として読めないことも確かめる
+        if host_encoding and _decodes(sample, host_encoding) and \
+                (host_encoding == 'utf-8' or not _decodes(sample, 'utf-8')):
+            return host_encoding
+
+        encoding = detect_prefix(content, self.detect_bytes)
+        if host:
+            with self._lock:
+                self._host_encodings[host] = encoding
+        return encoding
+
+    def resolve_response(self, response):
+        """requestsのレスポンスの文字コードを決めて設定し、その名前を返す"""
+        encoding = self.resolve(response.url, response.content, response.headers.get('Content-Type'))
+        response.encoding = encoding
+        return encoding
+
+
+# ---- ベンチマーク ----
+
+SAMPLE_BODY = """<html><head>{meta}{script}<title>{name}｜{district}の内科・小児科</title></head>
+<body><div id="header"><h1>{name}</h1><p>{district}の地域に根ざしたクリニックです。</p></div>
+<div class="info"><dl><dt>住所</dt><dd>〒230-00{i:02d} 横浜市鶴見区豊岡町{i}-{i}</dd>
+<dt>TEL</dt><dd>045-5{i:02d}-1234</dd><dt>FAX</dt><dd>045-5{i:02d}-5678</dd>
+<dt>診療時間</dt><dd>月・火・水・金 9:00〜12:00／15:00〜18:00 土曜は午前のみ</dd></dl></div>
+<div class="news">{news}</div></body></html>"""
+
+NEWS_ITEM = "<p>お知らせ：インフルエンザ予防接種の予約を受け付けております。詳しくは受付までお問い合わせください。</p>"
+# 日本語より前に判定の範囲を超えるASCIIだけの部分があるページ用のインラインスクリプト
+SCRIPT_HEAD = "<script>" + "window.dataLayer = window.dataLayer || []; dataLayer.push({'event': 'view'});\n" * 250 + "</script>"
+
+
+def _sample_pages(count):
+    """ベンチマーク用のクリニックページを文字コード別・meta有無別に作る
+
+    奇数番目は先頭に長いスクリプトを置く。4件に1件のUTF-8のページは、Shift_JISのページと同じホストに置く
+    （同じサイトで文字コードの違うページが混ざる場合）。
+    """
+    pages = []
+    for i in range(count):
+        for encoding, label in (('cp932', 'Shift_JIS'), ('euc_jp', 'EUC-JP'), ('utf-8', 'UTF-8')):
+            for with_meta in (True, False):
+                meta = f'<meta charset="{label}">' if with_meta else ''
+                html = SAMPLE_BODY.format(meta=meta, script=SCRIPT_HEAD if i % 2 else '', name=f"テストクリニック{i}",
+                                          district="鶴見区", i=i % 100, news=NEWS_ITEM * (60 + i % 120))
+                host_label = 'shift_jis' if encoding == 'utf-8' and i % 4 == 3 else label.lower()
+                pages.append((f"http://clinic{i % 10}.{host_label}.example/{i}.html",
+                              html.encode(encoding), encoding))
+    return pages
+
+
+def _load_corpus(corpus_dir):
+    """ディレクトリ内のHTMLを読み込む（正解の文字コードはファイル名に含まれる sjis/eucjp/utf8 で判断）"""
+    pages = []
+    for file_name in sorted(os.listdir(corpus_dir)):
+        lower = file_name.lower()
+        if 'sjis' in lower or 'shift' in lower:
+            expected = 'cp932'
+        elif 'euc' in lower:
+            expected = 'euc_jp'
+        elif 'utf' in lower:
+            expected = 'utf-8'
+        else:
+            continue
+        with open(os.path.join(corpus_dir, file_name), 'rb') as f:
+            pages.append((f"http://corpus.example/{file_name}", f.read(), expected))
+    return pages
+
+
+def _same_text(content, expected, actual):
+    """判定した文字コードで正しい文字列になるか"""
+    try:
+        return content.decode(actual) == content.decode(expected)
+    except (UnicodeDecodeError, LookupError, TypeError):
+        return False
+
+
+def run_benchmark(pages):
+    """apparent_encoding（本文全体の判定）とEncodingResolverの速度と正解率を比べる"""
+    import requests
+
+    def apparent(url, content):
+        response = requests.models.Response()
+        response._content = content
+        return response.apparent_encoding
+
+    resolver = EncodingResolver()
+    methods = [
+        ('apparent_encoding', apparent),
+        ('EncodingResolver', lambda url, content: resolver.resolve(url, content)),
+    ]
+    print(f"ページ数: {len(pages)}  平均サイズ: {sum(len(c) for _, c, _ in pages) // max(len(pages), 1)}バイト")
+    print(f"{'方式':<20}{'正解率':>8}{'ページあたり(ms)':>18}")
+    for name, method in methods:
+        correct = 0
+        start = time.perf_counter()
+        for url, content, expected in pages:
+            if _same_text(content, expected, method(url, content)):
+                correct += 1
+        elapsed = time.perf_counter() - start
+        print(f"{name:<20}{correct / len(pages):>8.1%}{elapsed / len(pages) * 1000:>18.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="文字コード判定のベンチマーク")
+    parser.add_argument("--benchmark", nargs="?", const="", metavar="CORPUS_DIR",
+                        help="ベンチマークを実行する。ディレクトリ省略時はサンプルページを生成して使う")
+    parser.add_argument("--pages", type=int, default=50,
+                        help="生成するサンプルページ数（文字コード×meta有無ごと、既定50）")
+    args = parser.parse_args(argv)
+    if args.benchmark is None:
+        parser.print_help()
+        return 0
+    pages = _load_corpus(args.benchmark) if args.benchmark else _sample_pages(args.pages)
+    if not pages:
+        print("ページが見つかりませんでした", file=sys.stderr)
+        return 1
+    run_benchmark(pages)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""HTMLからFAX番号を抽出する処理
+
+ScrapingWorkerのプロセスプールから呼び出されるため、Qtやネットワーク処理には依存させず、
+引数と戻り値はpickle可能な小さな値（バイト列・文字列・dict）だけにしている。
+"""
+
+import hashlib
+import re
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+from name_matcher import LINK_THRESHOLD, name_ngrams, normalize_name, weighted_containment
+from phone_normalizer import normalize_phone
+
+# 番号らしき数字列（全角数字・全角ハイフン・括弧区切りも含める。正しい番号かはphone_normalizerで確かめる）
+NUMBER_CHARS = r'[\d\-－‐−ー()（）]'
+NUMBER_RE = re.compile(rf'(\d{NUMBER_CHARS}+\d)')
+FAX_TEXT_RE = re.compile(rf'FAX.*?(\d{NUMBER_CHARS}+\d)')
+FAX_AFTER_RE = re.compile(rf'FAX[^\d]*(\d{NUMBER_CHARS}+\d)')
+FAX_BEFORE_RE = re.compile(rf'(\d{NUMBER_CHARS}+\d)[^\d]*FAX')
+FAX_ATTR_RE = re.compile('fax', re.I)
+FAX_WORD_RE = re.compile(r'FAX|fax')
+CONTACT_ATTR_RE = re.compile(r'contact|inquiry|access', re.I)
+DETAIL_HREF_RE = re.compile(r'detail\.html\?id=\d+')
+CSS_IDENT_RE = re.compile(r'^-?[A-Za-z_][\w-]*$')
+
+# FAXのラベルと紛らわしい語
+TEL_WORDS = ['TEL', 'PHONE', '電話']
+
+# クライアント側で描画するページ（SPA）のマウント先として使われるid
+SPA_ROOT_IDS = ['root', 'app', '__next', '__nuxt', 'svelte']
+# SPAとみなす本文テキストの最大文字数
+SPA_MAX_TEXT_LENGTH = 200
+
+
+def phone_candidates(pattern, text):
+    """textの中でpatternに一致した番号のうち、電話番号として正しいものを(正規化した番号, FAXの表記からの距離)で順に返す
+
+    距離はFAXの表記と番号の間の文字数（FAXの表記を含まないpatternでは0）。
+    FAXの表記と番号の間にTELなどの語がある場合（「FAX不可 TEL 045-…」）は、TELの番号とみなして飛ばす。
+    """
+    for match in pattern.finditer(text):
+        gap = text[match.start():match.start(1)] + text[match.end(1):match.end()]
+        if any(word in gap.upper() for word in TEL_WORDS):
+            continue
+        number = normalize_phone(match.group(1))
+        if number:
+            yield number, max(len(gap.strip()) - len('FAX'), 0)
+
+
+def element_candidates(pattern, element):
+    """要素のテキストの候補を(番号, 距離, 要素)で順に返す"""
+    for number, distance in phone_candidates(pattern, element.text):
+        yield number, distance, element
+
+
+def first_number(candidates):
+    """候補(番号, 距離, 要素)の列の最初の番号。なければNone"""
+    for candidate in candidates:
+        return candidate[0]
+    return None
+
+
+def find_fax_in_text(soup):
+    """パターン1: FAXという文字の後ろの数字"""
+    for text in soup.find_all(string=FAX_TEXT_RE):
+        for number, distance in phone_candidates(FAX_TEXT_RE, text):
+            yield number, distance, text.parent
+
+
+def find_fax_in_attrs(soup):
+    """パターン2: class名やid名にfaxを含む要素"""
+    fax_elements = soup.find_all(class_=FAX_ATTR_RE)
+    fax_elements.extend(soup.find_all(id=FAX_ATTR_RE))
+    for elem in fax_elements:
+        yield from element_candidates(NUMBER_RE, elem)
+
+
+def find_fax_in_dl(soup):
+    """パターン3: dt/dd タグの組み合わせ"""
+    for dt in soup.find_all('dt'):
+        dt_text = dt.text.strip().upper()
+        if 'FAX' in dt_text and not any(x in dt_text for x in TEL_WORDS):
+            next_dd = dt.find_next('dd')
+            if next_dd:
+                yield from element_candidates(NUMBER_RE, next_dd)
+
+
+def find_fax_in_table(soup):
+    """パターン4: テーブル内のFAX番号"""
+    for table in soup.find_all('table'):
+        for row in table.find_all('tr'):
+            cells = row.find_all(['td', 'th'])
+            for i, cell in enumerate(cells):
+                cell_text = cell.text.strip().upper()
+                if ('FAX' in cell_text and not any(x in cell_text for x in TEL_WORDS)
+                    and i + 1 < len(cells)):
+                    yield from element_candidates(NUMBER_RE, cells[i + 1])
+
+
+def find_fax_near_label(soup):
+    """パターン5: 一般的な電話番号パターン（FAXの前後）"""
+    for text in soup.find_all(string=FAX_WORD_RE):
+        # FAXの前後100文字を検索
+        context = text.parent.text
+        fax_index = context.upper().find('FAX')
+        if fax_index != -1:
+            # 前側はFAXの表記まで含める（番号の後ろにFAXと書く形式）
+            before = context[max(0, fax_index-100):fax_index+3]
+            after = context[fax_index:min(len(context), fax_index+100)]
+            # FAXの直後を優先的に検索
+            for number, distance in phone_candidates(FAX_AFTER_RE, after):
+                yield number, distance, text.parent
+            for number, distance in phone_candidates(FAX_BEFORE_RE, before):
+                yield number, distance, text.parent
+
+
+def find_fax_in_contact(soup):
+    """パターン6: 「お問い合わせ」や「連絡先」セクション内のFAX番号"""
+    contact_sections = soup.find_all(['div', 'section'], class_=CONTACT_ATTR_RE)
+    contact_sections.extend(soup.find_all(['div', 'section'], id=CONTACT_ATTR_RE))
+    for section in contact_sections:
+        yield from element_candidates(FAX_AFTER_RE, section)
+
+
+# 検出パターン（番号, 関数）。この順に試す。関数は候補を(番号, FAXの表記からの距離, 番号のあった要素)で順に返す
+FAX_PATTERNS = [
+    (1, find_fax_in_text),
+    (2, find_fax_in_attrs),
+    (3, find_fax_in_dl),
+    (4, find_fax_in_table),
+    (5, find_fax_near_label),
+    (6, find_fax_in_contact),
+]
+
+# パターンごとの証拠の強さ（ラベルと値の対応が構造で決まるdt/ddやテーブルが最も強く、
+# FAXの語の近くにあるだけの番号や、お問い合わせ欄の番号は弱い）
+PATTERN_STRENGTH = {1: 0.85, 2: 0.8, 3: 0.95, 4: 0.95, 5: 0.6, 6: 0.5}
+# FAXの表記からこの文字数までの番号は距離で減点しない（「FAX：」「FAX番号 」など）
+NEAR_LABEL_CHARS = 4
+# 距離による減点の下限と、下限に達する文字数
+FAR_LABEL_FACTOR = 0.5
+FAR_LABEL_CHARS = 60
+# FAXとしては使われにくい番号（携帯電話・フリーダイヤル・ナビダイヤル・IP電話）の減点
+UNLIKELY_FAX_PREFIXES = {'070': 0.6, '080': 0.6, '090': 0.6, '0120': 0.6, '0800': 0.6, '0570': 0.6, '050': 0.8}
+# ページ内でTELとして書かれている番号と同じ場合の減点
+TEL_CONFLICT_FACTOR = 0.3
+# この信頼度以上の候補が見つかれば、残りのパターンは試さない
+HIGH_CONFIDENCE = 0.8
+# これ未満の信頼度の番号しか見つからなければ、詳細ページも確かめる
+DETAIL_HOP_CONFIDENCE = 0.6
+# 1つのパターンから評価する候補の上限
+MAX_CANDIDATES_PER_PATTERN = 5
+
+# TEL・電話として書かれている番号（「TEL：045-…」と「045-…（TEL）」の形式）。
+# 「045-…（TEL）045-…（FAX）」の後ろの番号や「TEL/FAX」の番号を拾わないよう、
+# ラベルと番号の間には閉じ括弧・改行・FAXの表記を挟ませない
+TEL_AFTER_RE = re.compile(rf'(?:TEL|PHONE|電話)(?:(?!FAX)[^\d\n)）。、]){{0,10}}?(\d{NUMBER_CHARS}+\d)', re.I)
+TEL_BEFORE_RE = re.compile(rf'(\d{NUMBER_CHARS}+\d)[ 　]*[(（](?:TEL|PHONE|電話)[)）]', re.I)
+
+
+def tel_numbers(soup):
+    """ページ内でTEL・電話として書かれている番号（正規化済み）の集合。「TEL/FAX」の番号は含めない"""
+    text = soup.get_text(" ")
+    numbers = set()
+    for match in TEL_AFTER_RE.finditer(text):
+        numbers.add(normalize_phone(match.group(1)))
+    for match in TEL_BEFORE_RE.finditer(text):
+        numbers.add(normalize_phone(match.group(1)))
+    numbers.discard(None)
+    return numbers
+
+
+def candidate_confidence(number, pattern_no, distance, tel=()):
+    """1つの候補の信頼度（0〜1）: パターンの強さ × FAXの表記からの距離 × 番号の種類 × TELとの食い違い"""
+    confidence = PATTERN_STRENGTH[pattern_no]
+    if distance > NEAR_LABEL_CHARS:
+        confidence *= max(FAR_LABEL_FACTOR, 1 - (distance - NEAR_LABEL_CHARS) / FAR_LABEL_CHARS)
+    for prefix, factor in UNLIKELY_FAX_PREFIXES.items():
+        if number.startswith(prefix):
+            confidence *= factor
+            break
+    if number in tel:
+        confidence *= TEL_CONFLICT_FACTOR
+    return confidence
+
+
+# 記録したセレクタで引いた要素から番号を探す正規表現（パターンごと。要素は各パターンが番号を見つけた要素）
+HINT_PATTERNS = {
+    1: [FAX_TEXT_RE],
+    2: [NUMBER_RE],
+    3: [NUMBER_RE],
+    4: [NUMBER_RE],
+    5: [FAX_AFTER_RE, FAX_BEFORE_RE],
+    6: [FAX_AFTER_RE],
+}
+# テンプレートの指紋に使う、文書の先頭からの要素の数（ヘッダーやナビゲーションはテンプレートごとに同じ）
+FINGERPRINT_ELEMENTS = 40
+
+
+def template_fingerprint(soup):
+    """ページのテンプレートの指紋: 先頭の要素のタグ名とclass名の並びのハッシュ（16進16文字）
+
+    本文の文字は含めないため、同じテンプレートで作られたページは同じ値になる。
+    """
+    parts = [f"{tag.name}.{'.'.join(tag.get('class') or [])}"
+             for tag in soup.find_all(True, limit=FINGERPRINT_ELEMENTS)]
+    return hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def css_path(element):
+    """要素を指すCSSセレクタ（idのある祖先か、なければ文書の先頭からのタグ名・class名・同じタグの中の順番）"""
+    steps = []
+    while element is not None and element.name not in (None, '[document]'):
+        element_id = element.get('id')
+        if element_id and CSS_IDENT_RE.match(element_id):
+            steps.append(f"{element.name}#{element_id}")
+            break
+        step = element.name + ''.join(f".{name}" for name in element.get('class') or []
+                                      if CSS_IDENT_RE.match(name))
+        if element.parent is not None:
+            same_tag = element.parent.find_all(element.name, recursive=False)
+            if len(same_tag) > 1:
+                step += f":nth-of-type({same_tag.index(element) + 1})"
+        steps.append(step)
+        element = element.parent
+    return ' > '.join(reversed(steps))
+
+
+def has_fax_label(element):
+    """要素の中か、class名・id名か、直前の要素（dt・th・td）にFAXの表記があるか"""
+    if 'FAX' in element.text.upper():
+        return True
+    attrs = ' '.join(element.get('class') or []) + ' ' + (element.get('id') or '')
+    if FAX_ATTR_RE.search(attrs):
+        return True
+    label = element.find_previous_sibling()
+    if label is None:
+        return False
+    label_text = label.text.upper()
+    return 'FAX' in label_text and not any(word in label_text for word in TEL_WORDS)
+
+
+def find_fax_by_hints(soup, hints, fingerprint):
+    """記録したセレクタで要素を引き、そこにある番号を(番号, パターン番号, 信頼度, セレクタ)で返す
+
+    hintsは{'fingerprint', 'pattern', 'selector'}のリストで、指紋がページと同じものだけを試す。
+    要素にFAXの表記がない（テンプレートは同じでも中身の並びが違う）場合は使わない。
+    ページ全体のTELの番号は調べず、FAXの表記の確認で代える。見つからなければNone。
+    """
+    for hint in hints:
+        if hint['fingerprint'] != fingerprint:
+            continue
+        try:
+            element = soup.select_one(hint['selector'])
+        except Exception:
+            continue  # 記録が壊れている場合は使わない
+        if element is None or not has_fax_label(element):
+            continue
+        pattern_no = hint['pattern']
+        for regex in HINT_PATTERNS.get(pattern_no, ()):
+            for number, distance in phone_candidates(regex, element.text):
+                confidence = candidate_confidence(number, pattern_no, distance)
+                if confidence >= HIGH_CONFIDENCE:
+                    return number, pattern_no, confidence, hint['selector']
+    return None
+
+
+def find_fax_number(soup, hints=None, fingerprint=None):
+    """パターン1〜6の候補に信頼度を付け、(正規化したFAX番号, パターン番号, 信頼度, 要素のセレクタ)を返す
+
+    同じ番号が複数のパターンで見つかれば信頼度を合わせる（1 - Π(1 - パターンごとの最大値)）。
+    HIGH_CONFIDENCE以上の番号が見つかった時点で残りのパターンは試さない。
+    hints（site_memoの記録）があれば、記録したセレクタを最初に引き、記録したパターンから順に試す。
+    見つからなければ(None, None, 0.0, None)。
+    """
+    patterns = FAX_PATTERNS
+    if hints:
+        found = find_fax_by_hints(soup, hints, fingerprint or template_fingerprint(soup))
+        if found is not None:
+            return found
+        preferred = [hint['pattern'] for hint in hints]
+        patterns = sorted(FAX_PATTERNS, key=lambda item: (item[0] not in preferred, item[0]))
+
+    tel = None
+    scores = {}  # {番号: {パターン番号: (信頼度, 要素)}}
+    for pattern_no, finder in patterns:
+        for count, (number, distance, element) in enumerate(finder(soup)):
+            if count >= MAX_CANDIDATES_PER_PATTERN:
+                break
+            if tel is None:
+                tel = tel_numbers(soup)
+            confidence = candidate_confidence(number, pattern_no, distance, tel)
+            by_pattern = scores.setdefault(number, {})
+            if confidence > by_pattern.get(pattern_no, (0.0, None))[0]:
+                by_pattern[pattern_no] = (confidence, element)
+            if _combined(by_pattern) >= HIGH_CONFIDENCE:
+                return _result(number, by_pattern)
+    if not scores:
+        return None, None, 0.0, None
+    return _result(*max(scores.items(), key=lambda item: _combined(item[1])))
+
+
+def _combined(by_pattern):
+    remaining = 1.0
+    for confidence, _ in by_pattern.values():
+        remaining *= 1 - confidence
+    return 1 - remaining
+
+
+def _result(number, by_pattern):
+    pattern_no = max(by_pattern, key=lambda key: by_pattern[key][0])
+    return number, pattern_no, _combined(by_pattern), css_path(by_pattern[pattern_no][1])
+
+
+def looks_like_spa(soup):
+    """JavaScriptで本文を描画するページ（SPA）らしいかどうかを判定する
+
+    空のマウント先要素やフレームワーク固有の属性があるか、
+    スクリプトを読み込んでいるのに本文テキストがほとんどない場合にTrueを返す。
+    """
+    for root_id in SPA_ROOT_IDS:
+        root = soup.find(id=root_id)
+        if root is not None and not root.get_text(strip=True):
+            return True
+    if soup.find(attrs={'ng-app': True}) or soup.find(attrs={'data-reactroot': True}):
+        return True
+    if soup.find('script', id='__NEXT_DATA__') or soup.find('script', id='__NUXT__'):
+        return True
+
+    body = soup.body
+    if body is None or not soup.find('script', src=True):
+        return False
+    text = body.get_text(" ", strip=True)
+    for noscript in body.find_all('noscript'):
+        text = text.replace(noscript.get_text(" ", strip=True), '')
+    return len(text.strip()) < SPA_MAX_TEXT_LENGTH
+
+
+def find_detail_links(soup, clinic_name, name_weights=None):
+    """クリニック名と一致する詳細ページへのリンク(href, リンクテキスト)のリストを、一致度の高い順に返す
+
+    リンクテキストはname_matcherの2-gramの点数で判定する（表記ゆれ・法人格・空白の違いを許す）。
+    name_weightsはNameIndex.weights()の結果で、名簿の中でよくある部分の重みを下げる。
+    """
+    if name_weights is None:
+        name_weights = dict.fromkeys(name_ngrams(clinic_name), 1.0)
+    scored = []
+
+    # パターン1: クリニック名のリンク（テーブル内のリンクもここに含まれる）
+    for order, link in enumerate(soup.find_all('a', href=DETAIL_HREF_RE)):
+        link_text = link.text.strip()
+        score = weighted_containment(name_weights, normalize_name(link_text))
+        if score >= LINK_THRESHOLD:
+            scored.append((-score, order, link['href'], link_text))
+    scored.sort()
+    return [(href, link_text) for _, _, href, link_text in scored]
+
+
+def extract_page(content, clinic_name, url, encoding=None, name_weights=None, hints=None):
+    """取得したページのバイト列を解析し、結果レコード(dict)を返す
+
+    BeautifulSoupの解析とFAX番号の検出はCPU負荷が高いため、プロセスプール上で実行される。
+    name_weightsは詳細ページへのリンクの照合に使う2-gramの重み（NameIndex.weights()）。
+    hintsは同じサイト・テンプレートでFAX番号が見つかった場所の記録（SiteMemo.hints()）。
+    confidenceはFAX番号の信頼度（0〜1。見つからなければ0）、selectorは番号のあった要素のCSSセレクタ、
+    fingerprintはテンプレートの指紋、memoは記録の使用結果（hit/miss。記録がなければNone）。
+    timingsには解析(parse)と抽出(extract)の所要時間（秒）を入れる。
+    """
+    start = time.perf_counter()
+    soup = BeautifulSoup(content, 'html.parser', from_encoding=encoding)
+    parsed = time.perf_counter()
+
+    title = soup.title.string if soup.title and soup.title.string else ""
+    fingerprint = template_fingerprint(soup)
+    fax_number, pattern, confidence, selector = find_fax_number(soup, hints, fingerprint)
+    memo = None
+    if hints and any(hint['fingerprint'] == fingerprint for hint in hints):
+        memo = 'hit' if fax_number and selector in {hint['selector'] for hint in hints} else 'miss'
+
+    detail_url = None
+    detail_text = None
+    spa = False
+    if confidence < DETAIL_HOP_CONFIDENCE:
+        # 番号がないか信頼度が低い場合だけ、詳細ページを確かめられるようリンクを探す
+        detail_links = find_detail_links(soup, clinic_name, name_weights)
+        if detail_links:
+            href, detail_text = detail_links[0]
+            detail_url = urljoin(url, href)
+    if not fax_number:
+        spa = looks_like_spa(soup)
+
+    return {
+        'url': url,
+        'title': str(title),
+        'fax_number': fax_number,
+        'pattern': pattern,
+        'confidence': confidence,
+        'selector': selector,
+        'fingerprint': fingerprint,
+        'memo': memo,
+        'detail_url': detail_url,
+        'detail_text': detail_text,
+        'spa': spa,
+        'timings': {'parse': parsed - start, 'extract': time.perf_counter() - parsed},
+    }
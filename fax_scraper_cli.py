@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""クリニックFAX番号収集ツールのコマンドライン版（PyQt5不要）
+
+バッチサーバーなど画面のない環境で、GUI版と同じ処理(scraper_core)を実行する。
+
+    python fax_scraper_cli.py clinics.csv -o result.csv --cache-dir cache
+"""
+
+import argparse
+import os
+import signal
+import sys
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description="クリニックFAX番号収集ツール（コマンドライン版）")
+    parser.add_argument("input", help="クリニック名が最初の列に入ったCSVファイル")
+    parser.add_argument("-o", "--output",
+                        help="結果を書き込むCSVファイル（省略時は入力ファイルに書き戻す）")
+    parser.add_argument("-c", "--concurrency", type=int, default=4,
+                        help="ページ取得を並行して行うスレッド数（既定: 4）")
+    parser.add_argument("--parse-workers", type=int, default=None,
+                        help="HTML解析を行うプロセス数（既定: CPUコア数。0なら取得したスレッドで解析する）")
+    parser.add_argument("--row-workers", type=int, default=1,
+                        help="並行して処理する行数（既定: 1。検索は待機を挟んで1件ずつ行い、その間に他の行のページを取得する）")
+    parser.add_argument("--queue-size", type=int, default=64,
+                        help="読み込んだ行を処理待ちにしておく件数の上限（既定: 64）")
+    parser.add_argument("--unordered", dest="ordered", action="store_false",
+                        help="終わった順に書き込み、入力の順番に戻すための「行番号」列を付ける")
+    parser.add_argument("--shard", metavar="I/N",
+                        help="名簿をクリニック名のハッシュでN個に分けたうちI番目（0から）だけを処理する"
+                             "（結果は python shard.py merge で統合する）")
+    parser.add_argument("--pdf-results", nargs="+", metavar="CSV",
+                        help="pdf_to_text.pyの出力CSV（*_fax_numbers.csv）。載っているクリニックは検索せずにその番号を使う")
+    parser.add_argument("--cache-dir",
+                        help="取得したページと検索結果を保存するディレクトリ（再実行時に再利用する）")
+    parser.add_argument("--site-memo", metavar="JSON",
+                        help="サイトとテンプレートごとにFAX番号が見つかった場所の記録（次の実行でも使う。"
+                             "既定: --cache-dir を指定した場合はその中の site_memo.json）")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="前回の途中から再開せず、最初の行から処理する")
+    parser.add_argument("--render-js", action="store_true",
+                        help="JavaScriptで描画されるページをヘッドレスブラウザで取得する（要selenium）")
+    parser.add_argument("--log-file",
+                        help="全件のログを書き出すファイル（10MBごとにローテート）")
+    parser.add_argument("--trace",
+                        help="段階ごとの所要時間をJSONLで書き出すファイル（python stage_timing.py で集計できる）")
+    parser.add_argument("--metrics-port", type=int,
+                        help="指定したポートの http://127.0.0.1:<port>/metrics で実行状況を公開する")
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="プロファイルを取り、PREFIX.pstats と PREFIX.collapsed（フレームグラフ用）に書き出す")
+    parser.add_argument("--row-timeout", type=float, default=120, metavar="SECONDS",
+                        help="1行の処理の持ち時間（秒。待機は含めない）。超えた行は後回しにして1回だけ処理し直す。0で無制限（既定: 120）")
+    parser.add_argument("--slow-row", type=float, metavar="SECONDS",
+                        help="検索前の待機を除いてこの秒数以上かかった行をログに出す")
+    parser.add_argument("--record", metavar="ARCHIVE",
+                        help="ページ取得と検索のやり取りをアーカイブ（gzip圧縮のJSONL）に記録する")
+    parser.add_argument("--replay", metavar="ARCHIVE",
+                        help="ネットワークに接続せず、記録したアーカイブの応答で処理する（待機も省略する）")
+    parser.add_argument("--replay-stub-url", metavar="URL",
+                        help="再生時にページをこのスタブサーバー（python http_replay.py serve）からHTTPで取得する")
+    parser.add_argument("--replay-latency", type=float, default=0.0, metavar="MS",
+                        help="再生時に1回の取得・検索ごとに加える遅延（ミリ秒）")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="各行の詳細ログを表示しない")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # 重い依存は引数の解析が終わってから読み込む
+    from scraper_core import ScraperEngine
+
+    metrics = None
+    if args.metrics_port:
+        from metrics import MetricsRegistry, start_metrics_server
+
+        metrics = MetricsRegistry()
+        start_metrics_server(metrics, args.metrics_port)
+        print(f"メトリクスを公開しています: http://127.0.0.1:{args.metrics_port}/metrics", flush=True)
+
+    profiler = None
+    if args.profile:
+        from profiling import RunProfiler
+
+        profiler = RunProfiler(args.profile)
+        if args.parse_workers is None:
+            # 解析の内訳もプロファイルに含めるため、別プロセスに渡さず取得したスレッドで解析する
+            args.parse_workers = 0
+            print("プロファイル中はHTMLの解析を同じプロセスで行います", flush=True)
+
+    input_path = args.input
+    if args.shard:
+        from shard import parse_shard, shard_input_path, split_roster
+
+        try:
+            index, shards = parse_shard(args.shard)
+        except ValueError as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            return 2
+        if not args.output:
+            args.output = f"{os.path.splitext(args.input)[0]}_shard{index}of{shards}.csv"
+        # このシャードの行だけ（元の行番号付き）を入力にし、再開や保存は通常の実行と同じに行う
+        input_path = shard_input_path(args.output)
+        counts = split_roster(args.input, shards, {index: input_path})
+        print(f"シャード {index}/{shards}: {counts[index]}行を {input_path} に書き出しました", flush=True)
+
+    http_get = None
+    search_backend = None
+    recorder = None
+    if args.replay:
+        from http_replay import ArchiveReplayer
+
+        replayer = ArchiveReplayer(args.replay, latency=args.replay_latency / 1000,
+                                   stub_url=args.replay_stub_url)
+        http_get, search_backend = replayer.get, replayer.search
+    elif args.record:
+        import requests
+        from googlesearch import search
+        from http_replay import ArchiveRecorder
+
+        recorder = ArchiveRecorder(args.record)
+        http_get, search_backend = recorder.wrap_get(requests.get), recorder.wrap_search(search)
+
+    site_memo_path = args.site_memo
+    if site_memo_path is None and args.cache_dir:
+        from site_memo import SITE_MEMO_FILE
+
+        site_memo_path = os.path.join(args.cache_dir, SITE_MEMO_FILE)
+
+    errors = []
+
+    def on_log(message):
+        if args.quiet and message.startswith("- "):
+            return
+        print(message, flush=True)
+
+    def on_error(message):
+        errors.append(message)
+        print(f"エラー: {message}", file=sys.stderr, flush=True)
+
+    engine = ScraperEngine(
+        input_path,
+        output_path=args.output,
+        render_js=args.render_js,
+        fetch_workers=args.concurrency,
+        parse_workers=args.parse_workers,
+        cache_dir=args.cache_dir,
+        resume=args.resume,
+        log_path=args.log_file,
+        trace_path=args.trace,
+        metrics=metrics,
+        profiler=profiler,
+        slow_row_seconds=args.slow_row,
+        http_get=http_get,
+        search_backend=search_backend,
+        pace_requests=not args.replay,
+        pdf_results=args.pdf_results,
+        row_workers=args.row_workers,
+        queue_size=args.queue_size,
+        ordered=args.ordered,
+        site_memo_path=site_memo_path,
+        row_timeout=args.row_timeout,
+        on_log=on_log,
+        on_error=on_error,
+    )
+
+    # Ctrl+C やスケジューラからの終了要求では、処理中の行を処理前のまま書き込み、保存して終了する
+    def request_stop(signum, frame):
+        print("中止要求を受け付けました。処理中の行は処理前のまま書き込んで終了します", file=sys.stderr, flush=True)
+        engine.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, request_stop)
+
+    if profiler is not None:
+        from profiling import profile_run
+
+        with profile_run(profiler):
+            engine.run()
+    else:
+        engine.run()
+    if recorder is not None:
+        recorder.close()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
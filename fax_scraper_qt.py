@@ -2,511 +2,90 @@ import sys
 import os
 
 # macOS向けの設定をインポート前に行う
-os.environ['QT_MAC_WANTS_LAYER'] = '1'
-os.environ['QT_QPA_PLATFORM'] = 'cocoa'  # macOS特有の設定
+if sys.platform == 'darwin':
+    os.environ['QT_MAC_WANTS_LAYER'] = '1'
+    os.environ['QT_QPA_PLATFORM'] = 'cocoa'  # macOS特有の設定
 
-import csv
-import time
-import json
-import re
-import random  # ランダム機能のためにインポート
+import argparse
+import subprocess
 import threading
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from googlesearch import search
+import time
+from collections import deque
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QLabel, QProgressBar, QTextEdit, QFileDialog,
-    QLineEdit, QFrame, QGroupBox
+    QPushButton, QLabel, QProgressBar, QPlainTextEdit, QFileDialog,
+    QLineEdit, QFrame, QGroupBox, QCheckBox
 )
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal, Qt
+
+# 画面に表示するログの最大行数（古い行から削除し、長時間の実行でもメモリを一定に保つ）
+LOG_MAX_LINES = 5000
+# ワーカーのログを画面に反映する間隔（ミリ秒）
+LOG_FLUSH_INTERVAL_MS = 100
+
+# 処理本体(scraper_core)はpandas・requests・googlesearch・bs4を読み込むため、
+# 起動を速くするよう処理を開始する時点で読み込む
+# --helpの起動時間の上限（秒）と、画面を作った時点で読み込まれていてはいけないモジュール
+STARTUP_BUDGET_SECONDS = 0.5
+DEFERRED_MODULES = ('pandas', 'requests', 'bs4', 'googlesearch')
+# --helpの起動時間を計る回数（ディスクキャッシュなどのばらつきを除くため最短の時間で判定する）
+STARTUP_RUNS = 3
 
 class ScrapingWorker(QThread):
+    """ScraperEngineを別スレッドで実行し、コールバックをQtのシグナルに変換する
+
+    ログは1件ずつシグナルで送らずにバッファへ溜め、画面側がタイマーで
+    take_logs()を呼んでまとめて取り出す。全件のログはローテートするファイルに書き出される。
+    """
     progress_updated = pyqtSignal(str, int, int)  # clinic_name, current, total
-    log_updated = pyqtSignal(str)
     finished = pyqtSignal()
     error_occurred = pyqtSignal(str)
 
-    def __init__(self, csv_path):
+    def __init__(self, csv_path, render_js=False, metrics=None, pdf_results=None):
         super().__init__()
-        self.csv_path = csv_path
-        self.stop_requested = False
-        self.retry_delay = 15  # 基本待機時間を15秒に増加
-        self.max_retries = 3  # 最大リトライ回数
-        
-        # 一般的なUser-Agentリスト
-        self.user_agents = [
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Safari/605.1.15',
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
-            'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36',
-            'Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1',
-            'Mozilla/5.0 (iPad; CPU OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1',
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.48'
-        ]
-
-    def get_random_user_agent(self):
-        """ランダムなUser-Agentを返す"""
-        return random.choice(self.user_agents)
-
-    def search_with_retry(self, query, retry_count=0):
-        """Google検索を実行し、ネットワークエラーのみリトライする"""
-        try:
-            # 検索実行前に待機（リトライ回数に応じて待機時間を増加）
-            wait_time = self.retry_delay * (2 ** retry_count) + random.uniform(1, 5)  # ランダム要素を追加
-            self.log_updated.emit(f"- 検索前に {wait_time:.1f}秒待機します...")
-            time.sleep(wait_time)
-            
-            # Google検索を実行
-            headers = {'User-Agent': self.get_random_user_agent()}
-            self.log_updated.emit(f"- ランダムなUser-Agentを使用: {headers['User-Agent'][:30]}...")
-            search_results = list(search(query, num=1, user_agent=headers['User-Agent']))
-            
-            if search_results:
-                return search_results
-            else:
-                raise Exception("検索結果が0件でした")
-                
-        except requests.exceptions.HTTPError as e:
-            # 429エラー（Too Many Requests）の場合は長めに待機
-            if "429" in str(e):
-                if retry_count < self.max_retries:
-                    # 待機時間を一律10分に設定
-                    wait_time = 600  # 10分
-                    
-                    self.log_updated.emit(f"- リクエスト制限エラー(429): {str(e)}")
-                    self.log_updated.emit(f"- {wait_time}秒（10分）待機します... ({retry_count + 1}/{self.max_retries})")
-                    time.sleep(wait_time)  # 待機
-                    return self.search_with_retry(query, retry_count + 1)
-                else:
-                    raise Exception(f"リクエスト制限エラーが続いています: {str(e)}")
-            else:
-                # その他のHTTPエラー
-                raise Exception(f"HTTPエラー: {str(e)}")
-                
-        except requests.exceptions.RequestException as e:
-            # ネットワークエラーのみリトライ
-            if retry_count < self.max_retries:
-                wait_time = self.retry_delay * (2 ** retry_count)
-                self.log_updated.emit(f"- ネットワークエラー: {str(e)}")
-                self.log_updated.emit(f"- リトライします... {wait_time}秒後 ({retry_count + 1}/{self.max_retries})")
-                time.sleep(wait_time)  # 追加で待機
-                return self.search_with_retry(query, retry_count + 1)
-            else:
-                raise Exception(f"ネットワークエラーが続いています: {str(e)}")
-                
-        except Exception as e:
-            # その他のエラーはリトライせずに例外を投げる
-            if "Too Many Requests" in str(e) or "429" in str(e):
-                if retry_count < self.max_retries + 2:  # 最大リトライ回数を増やす
-                    # 待機時間を一律10分に設定
-                    wait_time = 600  # 10分
-                        
-                    self.log_updated.emit(f"- リクエスト制限エラー: {str(e)}")
-                    self.log_updated.emit(f"- {wait_time}秒（10分）待機します... ({retry_count + 1}/{self.max_retries + 2})")
-                    time.sleep(wait_time)
-                    return self.search_with_retry(query, retry_count + 1)
-                else:
-                    raise Exception(f"リクエスト制限エラーが続いています: {str(e)}")
-            else:
-                raise Exception(f"検索に失敗しました: {str(e)}")
+        from scraper_core import ScraperEngine
+        from site_memo import SITE_MEMO_FILE
+
+        # 画面が取り出す前に溢れた分は古いものから捨てる（ファイルには全件残る）
+        self._log_buffer = deque(maxlen=LOG_MAX_LINES)
+        self._log_lock = threading.Lock()
+
+        self.log_path = os.path.splitext(csv_path)[0] + '_scraper.log'
+        self.engine = ScraperEngine(
+            csv_path,
+            render_js=render_js,
+            log_path=self.log_path,
+            metrics=metrics,
+            pdf_results=pdf_results,
+            # サイトごとのFAX番号の場所の記録は入力CSVと同じフォルダに置き、次の実行でも使う
+            site_memo_path=os.path.join(os.path.dirname(os.path.abspath(csv_path)), SITE_MEMO_FILE),
+            on_log=self.buffer_log,
+            on_progress=self.progress_updated.emit,
+            on_error=self.error_occurred.emit,
+        )
+
+    def buffer_log(self, message):
+        with self._log_lock:
+            self._log_buffer.append(message)
+
+    def take_logs(self):
+        """溜まっているログをすべて取り出す"""
+        with self._log_lock:
+            messages = list(self._log_buffer)
+            self._log_buffer.clear()
+        return messages
+
+    @property
+    def stop_requested(self):
+        return self.engine.stop_requested
+
+    @stop_requested.setter
+    def stop_requested(self, value):
+        self.engine.stop_requested = value
 
     def run(self):
         try:
-            self.log_updated.emit("処理を開始します...")
-            
-            # CSVファイルを読み込む
-            try:
-                df = pd.read_csv(self.csv_path)
-                self.log_updated.emit(f"CSVファイルを読み込みました: {len(df)}件のデータ")
-            except Exception as e:
-                self.log_updated.emit(f"CSVファイルの読み込みに失敗しました: {str(e)}")
-                self.error_occurred.emit(f"CSVファイルの読み込みに失敗しました: {str(e)}")
-                return
-
-            total = len(df)
-            self.log_updated.emit(f"総処理件数: {total}件")
-
-            # FAX番号カラムがなければ追加
-            if 'FAX番号' not in df.columns:
-                df['FAX番号'] = df['FAX番号'].astype('object')  # 文字列として扱う
-                self.log_updated.emit("FAX番号カラムを追加しました")
-
-            # エラー詳細カラムがなければ追加
-            if 'エラー詳細' not in df.columns:
-                df['エラー詳細'] = None
-                self.log_updated.emit("エラー詳細カラムを追加しました")
-
-            # 処理済みの件数を確認（リフレッシュの場合のために）
-            start_index = 0
-            for i, row in df.iterrows():
-                if pd.isna(df.at[i, 'FAX番号']) and pd.isna(df.at[i, 'エラー詳細']):
-                    # FAX番号もエラー詳細も空の場合は、ここから開始
-                    start_index = i
-                    break
-            
-            if start_index > 0:
-                self.log_updated.emit(f"前回の処理から再開します。開始位置: {start_index + 1}件目")
-
-            # 各クリニックに対して処理
-            for index, row in df.iloc[start_index:].iterrows():
-                if self.stop_requested:
-                    self.log_updated.emit("処理を中断しました")
-                    break
-
-                try:
-                    clinic_name = row.iloc[0]  # インデックス列はCSVの最初の列と仮定
-                    self.progress_updated.emit(clinic_name, index + 1, total)
-                    self.log_updated.emit(f"処理中: {clinic_name} ({index + 1}/{total})")
-
-                    # エラー詳細をリセット
-                    df.at[index, 'エラー詳細'] = None
-
-                    # すでにFAX番号がある場合はスキップ
-                    if not pd.isna(df.at[index, 'FAX番号']):
-                        self.log_updated.emit(f"- すでにFAX番号があります: {df.at[index, 'FAX番号']}")
-                        continue
-
-                    try:
-                        # Google検索でクリニックのウェブサイトを探す
-                        search_query = clinic_name  # クリニック名のみで検索
-                        self.log_updated.emit(f"- 検索クエリ: {search_query}")
-                        search_results = self.search_with_retry(search_query)
-                        
-                        if search_results:
-                            # 検索結果から最適なURLを選択
-                            matching_url = None
-                            for url in search_results:
-                                try:
-                                    # ページを取得
-                                    headers = {'User-Agent': self.get_random_user_agent()}
-                                    self.log_updated.emit(f"- ページ取得にランダムなUser-Agentを使用")
-                                    response = requests.get(url, timeout=10, headers=headers)
-                                    response.raise_for_status()  # ステータスコードチェック
-                                    soup = BeautifulSoup(response.text, 'html.parser')
-                                    
-                                    # タイトルを取得
-                                    title = soup.title.string if soup.title else ""
-                                    
-                                    # タイトルにクリニック名が含まれているかチェック
-                                    if clinic_name in title:
-                                        matching_url = url
-                                        self.log_updated.emit(f"- タイトルに一致するURLを発見: {url}")
-                                        break
-                                        
-                                except Exception as e:
-                                    self.log_updated.emit(f"- URL取得エラー: {str(e)}")
-                                    continue
-                            
-                            if matching_url:
-                                url = matching_url
-                            else:
-                                # マッチするURLが見つからない場合は最初の結果を使用
-                                url = search_results[0]
-                                self.log_updated.emit(f"- タイトルに一致するURLが見つかりませんでした。最初の結果を使用: {url}")
-                            
-                            # ウェブページを取得（タイムアウトを設定）
-                            try:
-                                headers = {'User-Agent': self.get_random_user_agent()}
-                                self.log_updated.emit(f"- ページ取得にランダムなUser-Agentを使用")
-                                response = requests.get(url, timeout=10, headers=headers)
-                                response.raise_for_status()  # ステータスコードチェック
-                                soup = BeautifulSoup(response.text, 'html.parser')
-                                self.log_updated.emit("- ページの取得に成功しました")
-
-                                # トップページから直接FAX番号を探す
-                                self.log_updated.emit("- トップページからFAX番号を探します")
-                                fax_number = None
-                                
-                                # パターン1: FAXという文字の後ろの数字
-                                fax_patterns = soup.find_all(string=re.compile(r'FAX.*?(\d[\d\-]+\d)'))
-                                if fax_patterns:
-                                    match = re.search(r'FAX.*?(\d[\d\-]+\d)', fax_patterns[0])
-                                    if match:
-                                        fax_number = match.group(1)
-                                        self.log_updated.emit("- パターン1でFAX番号を検出")
-                                
-                                # パターン2: class名やid名にfaxを含む要素
-                                if not fax_number:
-                                    fax_elements = soup.find_all(class_=re.compile('fax', re.I))
-                                    fax_elements.extend(soup.find_all(id=re.compile('fax', re.I)))
-                                    for elem in fax_elements:
-                                        match = re.search(r'(\d[\d\-]+\d)', elem.text)
-                                        if match:
-                                            fax_number = match.group(1)
-                                            self.log_updated.emit("- パターン2でFAX番号を検出")
-                                            break
-                                
-                                # パターン3: dt/dd タグの組み合わせ
-                                if not fax_number:
-                                    dt_elements = soup.find_all('dt')
-                                    for dt in dt_elements:
-                                        dt_text = dt.text.strip().upper()
-                                        if 'FAX' in dt_text and not any(x in dt_text for x in ['TEL', 'PHONE', '電話']):
-                                            next_dd = dt.find_next('dd')
-                                            if next_dd:
-                                                match = re.search(r'(\d[\d\-]+\d)', next_dd.text)
-                                                if match:
-                                                    fax_number = match.group(1)
-                                                    self.log_updated.emit("- パターン3でFAX番号を検出")
-                                                    break
-                                
-                                # パターン4: テーブル内のFAX番号
-                                if not fax_number:
-                                    tables = soup.find_all('table')
-                                    for table in tables:
-                                        rows = table.find_all('tr')
-                                        for row in rows:
-                                            cells = row.find_all(['td', 'th'])
-                                            for i, cell in enumerate(cells):
-                                                cell_text = cell.text.strip().upper()
-                                                if ('FAX' in cell_text and not any(x in cell_text for x in ['TEL', 'PHONE', '電話']) 
-                                                    and i + 1 < len(cells)):
-                                                    match = re.search(r'(\d[\d\-]+\d)', cells[i + 1].text)
-                                                    if match:
-                                                        fax_number = match.group(1)
-                                                        self.log_updated.emit("- パターン4でFAX番号を検出")
-                                                        break
-                                            if fax_number:
-                                                break
-                                        if fax_number:
-                                            break
-                                
-                                # パターン5: 一般的な電話番号パターン（FAXの前後）
-                                if not fax_number:
-                                    text_blocks = soup.find_all(string=re.compile(r'FAX|fax'))
-                                    for text in text_blocks:
-                                        # FAXの前後100文字を検索
-                                        context = text.parent.text
-                                        fax_index = context.upper().find('FAX')
-                                        if fax_index != -1:
-                                            # FAXの前後を検索
-                                            before = context[max(0, fax_index-100):fax_index]
-                                            after = context[fax_index:min(len(context), fax_index+100)]
-                                            # FAXの直後を優先的に検索
-                                            match = re.search(r'FAX[^\d]*(\d[\d\-]+\d)', after)
-                                            if not match:
-                                                match = re.search(r'(\d[\d\-]+\d)[^\d]*FAX', before)
-                                            if match:
-                                                fax_number = match.group(1)
-                                                self.log_updated.emit("- パターン5でFAX番号を検出")
-                                                break
-                                
-                                # パターン6: 「お問い合わせ」や「連絡先」セクション内のFAX番号
-                                if not fax_number:
-                                    contact_sections = soup.find_all(['div', 'section'], class_=re.compile(r'contact|inquiry|access', re.I))
-                                    contact_sections.extend(soup.find_all(['div', 'section'], id=re.compile(r'contact|inquiry|access', re.I)))
-                                    for section in contact_sections:
-                                        text = section.text
-                                        match = re.search(r'FAX[^\d]*(\d[\d\-]+\d)', text)
-                                        if match:
-                                            fax_number = match.group(1)
-                                            self.log_updated.emit("- パターン6でFAX番号を検出")
-                                            break
-                                
-                                if fax_number:
-                                    # 番号の正規化（ハイフン統一のみ）
-                                    fax_number = re.sub(r'[^\d\-]', '', fax_number)
-                                    df.at[index, 'FAX番号'] = str(fax_number)  # 文字列として保存
-                                    df.at[index, 'エラー詳細'] = None  # エラーをクリア
-                                    self.log_updated.emit(f"- トップページでFAX番号が見つかりました: {fax_number}")
-                                else:
-                                    # 詳細ページへのリンクを探す
-                                    self.log_updated.emit("- トップページでFAX番号が見つかりませんでした。詳細ページを探します")
-                                    detail_links = []
-                                    
-                                    # パターン1: クリニック名のリンク
-                                    clinic_links = soup.find_all('a', href=re.compile(r'detail\.html\?id=\d+'))
-                                    for link in clinic_links:
-                                        link_text = link.text.strip()
-                                        # クリニック名の部分一致をチェック
-                                        if any(name in link_text for name in [clinic_name, clinic_name.replace('クリニック', ''), clinic_name.replace('医院', '')]):
-                                            detail_links.append(link['href'])
-                                            self.log_updated.emit(f"- リンクを検出: {link_text}")
-                                    
-                                    # パターン2: テーブル内のリンク
-                                    if not detail_links:
-                                        tables = soup.find_all('table')
-                                        for table in tables:
-                                            rows = table.find_all('tr')
-                                            for row in rows:
-                                                cells = row.find_all(['td', 'th'])
-                                                for cell in cells:
-                                                    links = cell.find_all('a', href=re.compile(r'detail\.html\?id=\d+'))
-                                                    for link in links:
-                                                        link_text = link.text.strip()
-                                                        # クリニック名の部分一致をチェック
-                                                        if any(name in link_text for name in [clinic_name, clinic_name.replace('クリニック', ''), clinic_name.replace('医院', '')]):
-                                                            detail_links.append(link['href'])
-                                                            self.log_updated.emit(f"- テーブル内でリンクを検出: {link_text}")
-
-                                    if detail_links:
-                                        # 詳細ページのURLを構築
-                                        base_url = '/'.join(url.split('/')[:-1]) + '/'
-                                        detail_url = base_url + detail_links[0]
-                                        self.log_updated.emit(f"- 詳細ページを検出: {detail_url}")
-
-                                        # 詳細ページを取得
-                                        try:
-                                            headers = {'User-Agent': self.get_random_user_agent()}
-                                            detail_response = requests.get(detail_url, timeout=10, headers=headers)
-                                            detail_response.raise_for_status()
-                                            detail_soup = BeautifulSoup(detail_response.text, 'html.parser')
-                                            self.log_updated.emit("- 詳細ページの取得に成功しました")
-
-                                            # FAX番号を探す
-                                            fax_number = None
-                                            
-                                            # パターン1: FAXという文字の後ろの数字
-                                            fax_patterns = detail_soup.find_all(string=re.compile(r'FAX.*?(\d[\d\-]+\d)'))
-                                            if fax_patterns:
-                                                match = re.search(r'FAX.*?(\d[\d\-]+\d)', fax_patterns[0])
-                                                if match:
-                                                    fax_number = match.group(1)
-                                                    self.log_updated.emit("- パターン1でFAX番号を検出")
-                                            
-                                            # パターン2: class名やid名にfaxを含む要素
-                                            if not fax_number:
-                                                fax_elements = detail_soup.find_all(class_=re.compile('fax', re.I))
-                                                fax_elements.extend(detail_soup.find_all(id=re.compile('fax', re.I)))
-                                                for elem in fax_elements:
-                                                    match = re.search(r'(\d[\d\-]+\d)', elem.text)
-                                                    if match:
-                                                        fax_number = match.group(1)
-                                                        self.log_updated.emit("- パターン2でFAX番号を検出")
-                                                        break
-                                            
-                                            # パターン3: dt/dd タグの組み合わせ
-                                            if not fax_number:
-                                                dt_elements = detail_soup.find_all('dt')
-                                                for dt in dt_elements:
-                                                    dt_text = dt.text.strip().upper()
-                                                    if 'FAX' in dt_text and not any(x in dt_text for x in ['TEL', 'PHONE', '電話']):
-                                                        next_dd = dt.find_next('dd')
-                                                        if next_dd:
-                                                            match = re.search(r'(\d[\d\-]+\d)', next_dd.text)
-                                                            if match:
-                                                                fax_number = match.group(1)
-                                                                self.log_updated.emit("- パターン3でFAX番号を検出")
-                                                                break
-                                            
-                                            # パターン4: テーブル内のFAX番号
-                                            if not fax_number:
-                                                tables = detail_soup.find_all('table')
-                                                for table in tables:
-                                                    rows = table.find_all('tr')
-                                                    for row in rows:
-                                                        cells = row.find_all(['td', 'th'])
-                                                        for i, cell in enumerate(cells):
-                                                            cell_text = cell.text.strip().upper()
-                                                            if ('FAX' in cell_text and not any(x in cell_text for x in ['TEL', 'PHONE', '電話']) 
-                                                                and i + 1 < len(cells)):
-                                                                match = re.search(r'(\d[\d\-]+\d)', cells[i + 1].text)
-                                                                if match:
-                                                                    fax_number = match.group(1)
-                                                                    self.log_updated.emit("- パターン4でFAX番号を検出")
-                                                                    break
-                                                        if fax_number:
-                                                            break
-                                                    if fax_number:
-                                                        break
-                                            
-                                            # パターン5: 一般的な電話番号パターン（FAXの前後）
-                                            if not fax_number:
-                                                text_blocks = detail_soup.find_all(string=re.compile(r'FAX|fax'))
-                                                for text in text_blocks:
-                                                    # FAXの前後100文字を検索
-                                                    context = text.parent.text
-                                                    fax_index = context.upper().find('FAX')
-                                                    if fax_index != -1:
-                                                        # FAXの前後を検索
-                                                        before = context[max(0, fax_index-100):fax_index]
-                                                        after = context[fax_index:min(len(context), fax_index+100)]
-                                                        # FAXの直後を優先的に検索
-                                                        match = re.search(r'FAX[^\d]*(\d[\d\-]+\d)', after)
-                                                        if not match:
-                                                            match = re.search(r'(\d[\d\-]+\d)[^\d]*FAX', before)
-                                                        if match:
-                                                            fax_number = match.group(1)
-                                                            self.log_updated.emit("- パターン5でFAX番号を検出")
-                                                            break
-                                            
-                                            # パターン6: 「お問い合わせ」や「連絡先」セクション内のFAX番号
-                                            if not fax_number:
-                                                contact_sections = detail_soup.find_all(['div', 'section'], class_=re.compile(r'contact|inquiry|access', re.I))
-                                                contact_sections.extend(detail_soup.find_all(['div', 'section'], id=re.compile(r'contact|inquiry|access', re.I)))
-                                                for section in contact_sections:
-                                                    text = section.text
-                                                    match = re.search(r'FAX[^\d]*(\d[\d\-]+\d)', text)
-                                                    if match:
-                                                        fax_number = match.group(1)
-                                                        self.log_updated.emit("- パターン6でFAX番号を検出")
-                                                        break
-                                            
-                                            if fax_number:
-                                                # 番号の正規化（ハイフン統一のみ）
-                                                fax_number = re.sub(r'[^\d\-]', '', fax_number)
-                                                df.at[index, 'FAX番号'] = str(fax_number)  # 文字列として保存
-                                                df.at[index, 'エラー詳細'] = None  # エラーをクリア
-                                                self.log_updated.emit(f"- メインページでFAX番号が見つかりました: {fax_number}")
-                                            else:
-                                                df.at[index, 'エラー詳細'] = "メインページでもFAX番号が見つかりませんでした"
-                                                self.log_updated.emit("- メインページでもFAX番号が見つかりませんでした")
-                                        
-                                        except requests.exceptions.RequestException as e:
-                                            self.log_updated.emit(f"- 詳細ページの取得に失敗しました: {str(e)}")
-                                            df.at[index, 'エラー詳細'] = f"詳細ページの取得に失敗: {str(e)}"
-                                    else:
-                                        df.at[index, 'エラー詳細'] = "詳細ページへのリンクが見つかりませんでした"
-                                        self.log_updated.emit("- 詳細ページへのリンクが見つかりませんでした")
-                                
-                            except requests.exceptions.RequestException as e:
-                                self.log_updated.emit(f"- ページの取得に失敗しました: {str(e)}")
-                                df.at[index, 'エラー詳細'] = f"ページの取得に失敗: {str(e)}"
-                                continue
-                        else:
-                            df.at[index, 'エラー詳細'] = "ウェブサイトが見つかりませんでした"
-                            self.log_updated.emit("- ウェブサイトが見つかりませんでした")
-                    
-                    except Exception as e:
-                        error_msg = f"処理中にエラーが発生しました: {str(e)}"
-                        self.log_updated.emit(f"- {error_msg}")
-                        df.at[index, 'エラー詳細'] = error_msg
-
-                    # 定期的に保存
-                    if (index + 1) % 10 == 0:
-                        try:
-                            df.to_csv(self.csv_path, index=False)
-                            self.log_updated.emit(f"- {index + 1}件目を保存しました")
-                        except Exception as e:
-                            self.log_updated.emit(f"- 保存に失敗しました: {str(e)}")
-
-                    # サーバーに負荷をかけないよう少し待機
-                    time.sleep(0.5)  # 0.5秒待機
-
-                except Exception as e:
-                    self.log_updated.emit(f"行の処理中にエラーが発生しました: {str(e)}")
-                    continue
-
-            # 最終結果を保存
-            try:
-                df.to_csv(self.csv_path, index=False)
-                self.log_updated.emit("処理が完了しました")
-            except Exception as e:
-                self.log_updated.emit(f"最終保存に失敗しました: {str(e)}")
-                self.error_occurred.emit(f"最終保存に失敗しました: {str(e)}")
-            
-        except Exception as e:
-            error_msg = f"予期せぬエラーが発生しました: {str(e)}"
-            self.log_updated.emit(error_msg)
-            self.error_occurred.emit(error_msg)
-        
+            self.engine.run()
         finally:
             self.finished.emit()
 
@@ -536,6 +115,10 @@ class MainWindow(QMainWindow):
         file_layout.addWidget(browse_button)
         
         layout.addWidget(file_group)
+
+        # オプション
+        self.render_js_checkbox = QCheckBox("JavaScriptで描画されるページはブラウザで取得する（Chromeとseleniumが必要）")
+        layout.addWidget(self.render_js_checkbox)
         
         # 処理状況表示部分
         status_group = QGroupBox("処理状況")
@@ -571,8 +154,9 @@ class MainWindow(QMainWindow):
         status_layout.addWidget(self.progress_bar)
         
         # ログ表示
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(LOG_MAX_LINES)
         status_layout.addWidget(self.log_text)
         
         layout.addWidget(status_group)
@@ -606,6 +190,15 @@ class MainWindow(QMainWindow):
         
         # スクレイピングワーカー
         self.worker = None
+        # --metrics-port 指定時に実行状況を公開するメトリクスの登録先
+        self.metrics = None
+        # --pdf-results で指定したPDFの抽出結果（載っているクリニックは検索しない）
+        self.pdf_results = []
+
+        # ワーカーのログを一定間隔でまとめて表示する
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self.log_timer.timeout.connect(self.flush_worker_logs)
 
     def browse_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -615,23 +208,29 @@ class MainWindow(QMainWindow):
             "CSVファイル (*.csv);;すべてのファイル (*.*)"
         )
         if file_path:
-            self.file_path.setText(file_path)
-            self.log("ファイルを選択しました: " + file_path)
-            self.analyze_csv(file_path)
+            self.load_file(file_path)
+
+    def load_file(self, file_path):
+        self.file_path.setText(file_path)
+        self.log("ファイルを選択しました: " + file_path)
+        self.analyze_csv(file_path)
 
     def analyze_csv(self, file_path):
+        # 大きな名簿でもすぐ開けるよう、全体は読み込まずに見出しだけを読み、件数は改行を数えて求める
+        from row_pipeline import count_csv_rows, read_csv_columns
+
         try:
-            df = pd.read_csv(file_path)
-            total = len(df)
+            columns = read_csv_columns(file_path)
+            total = count_csv_rows(file_path)
             self.status_label.setText(f"読み込み完了: {total}件のクリニックが見つかりました")
             self.log(f"クリニック総数: {total}件")
             
-            if 'FAX番号' in df.columns:
+            if 'FAX番号' in columns:
                 self.log("既存のFAX番号カラムが見つかりました")
             else:
                 self.log("FAX番号カラムが見つかりません。新規に作成します")
             
-            if 'エラー詳細' in df.columns:
+            if 'エラー詳細' in columns:
                 self.log("既存のエラー詳細カラムが見つかりました")
             else:
                 self.log("エラー詳細カラムが見つかりません。新規に作成します")
@@ -649,9 +248,11 @@ class MainWindow(QMainWindow):
             self.log("すでに処理中です")
             return
             
-        self.worker = ScrapingWorker(self.file_path.text())
+        self.worker = ScrapingWorker(
+            self.file_path.text(), render_js=self.render_js_checkbox.isChecked(),
+            metrics=self.metrics, pdf_results=self.pdf_results
+        )
         self.worker.progress_updated.connect(self.update_progress)
-        self.worker.log_updated.connect(self.log)
         self.worker.finished.connect(self.scraping_finished)
         self.worker.error_occurred.connect(self.handle_error)
         
@@ -659,7 +260,9 @@ class MainWindow(QMainWindow):
         self.stop_button.setEnabled(True)
         self.status_label.setText("処理中...")
         self.progress_bar.setValue(0)
+        self.log(f"すべてのログは {self.worker.log_path} に保存されます")
         
+        self.log_timer.start()
         self.worker.start()
 
     def stop_scraping(self):
@@ -676,6 +279,8 @@ class MainWindow(QMainWindow):
         self.status_label.setText(f"処理中... {current}/{total} ({progress}%)")
 
     def scraping_finished(self):
+        self.log_timer.stop()
+        self.flush_worker_logs()
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         if self.worker and self.worker.stop_requested:
@@ -690,15 +295,24 @@ class MainWindow(QMainWindow):
             self.worker.deleteLater()  # メモリリソースを解放
 
     def handle_error(self, error_message):
+        self.flush_worker_logs()  # エラーより前のログを先に表示する
         self.log(f"エラーが発生しました: {error_message}")
         self.status_label.setText("エラーが発生しました")
 
     def log(self, message):
-        self.log_text.append(message)
+        self.log_text.appendPlainText(message)
         self.log_text.verticalScrollBar().setValue(
             self.log_text.verticalScrollBar().maximum()
         )
 
+    def flush_worker_logs(self):
+        """ワーカーに溜まったログをまとめて表示する（スクロールも1回だけ）"""
+        if self.worker is None:
+            return
+        messages = self.worker.take_logs()
+        if messages:
+            self.log('\n'.join(messages))
+
     def closeEvent(self, event):
         # アプリケーション終了時の処理
         if self.worker and self.worker.isRunning():
@@ -720,9 +334,11 @@ class MainWindow(QMainWindow):
             return
             
         self.log("リフレッシュを開始します。未処理の行から処理を再開します...")
-        self.worker = ScrapingWorker(self.file_path.text())
+        self.worker = ScrapingWorker(
+            self.file_path.text(), render_js=self.render_js_checkbox.isChecked(),
+            metrics=self.metrics, pdf_results=self.pdf_results
+        )
         self.worker.progress_updated.connect(self.update_progress)
-        self.worker.log_updated.connect(self.log)
         self.worker.finished.connect(self.scraping_finished)
         self.worker.error_occurred.connect(self.handle_error)
         
@@ -731,8 +347,50 @@ class MainWindow(QMainWindow):
         self.stop_button.setEnabled(True)
         self.status_label.setText("処理を再開中...")
         
+        self.log_timer.start()
         self.worker.start()
 
+def parse_args(argv=None):
+    """コマンドライン引数を解析する（Qt用の引数はそのままQApplicationに渡す）"""
+    parser = argparse.ArgumentParser(description="クリニックFAX番号収集ツール")
+    parser.add_argument("csv_path", nargs="?", help="起動時に読み込むCSVファイル")
+    parser.add_argument("--metrics-port", type=int,
+                        help="指定したポートの http://127.0.0.1:<port>/metrics で実行状況を公開する")
+    parser.add_argument("--pdf-results", nargs="+", metavar="CSV", default=[],
+                        help="pdf_to_text.pyの出力CSV（*_fax_numbers.csv）。載っているクリニックは検索せずにその番号を使う")
+    parser.add_argument("--check-startup", action="store_true",
+                        help=f"--helpの起動が{STARTUP_BUDGET_SECONDS}秒以内で、画面を作った時点で"
+                             f"{'・'.join(DEFERRED_MODULES)}が読み込まれていないかを確かめる")
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+def check_startup(budget=STARTUP_BUDGET_SECONDS, log=print):
+    """起動が重くなっていないかを確かめる（問題がなければTrue）
+
+    別プロセスで `fax_scraper_qt.py --help` の時間を計って上限と比べ、このプロセスで画面を作った後に
+    処理本体の重いモジュールが読み込まれていないことを確かめる。
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--help']
+    elapsed = []
+    for _ in range(STARTUP_RUNS):
+        started = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+        elapsed.append(time.perf_counter() - started)
+    help_ok = min(elapsed) <= budget
+    log(f"--helpの起動時間: {min(elapsed):.3f}秒（上限 {budget}秒、{STARTUP_RUNS}回の最短）: "
+        f"{'OK' if help_ok else 'NG'}")
+
+    # 画面のない環境でも画面を作れるようにする
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    window = MainWindow()
+    loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+    window.close()
+    log(f"画面を作った時点で読み込まれていたモジュール: {', '.join(loaded) or 'なし'}: "
+        f"{'NG' if loaded else 'OK'}")
+    return help_ok and not loaded
+
 def main():
     try:
         # QApplication作成前にデフォルトスタイルを設定
@@ -749,6 +407,10 @@ def main():
         traceback.print_exc()
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.check_startup:
+        sys.exit(0 if check_startup() else 1)
+
     # 既存のQApplicationインスタンスがあれば削除
     app = QApplication.instance()
     if app is not None:
@@ -761,5 +423,13 @@ if __name__ == "__main__":
     # シンプルに起動
     app = QApplication(sys.argv)
     window = MainWindow()
+    if args.metrics_port:
+        from metrics import MetricsRegistry, start_metrics_server
+
+        window.metrics = MetricsRegistry()
+        start_metrics_server(window.metrics, args.metrics_port)
+    window.pdf_results = args.pdf_results
+    if args.csv_path:
+        window.load_file(args.csv_path)
     window.show()
-    sys.exit(app.exec_()) 
\ No newline at end of file
+    sys.exit(app.exec_())
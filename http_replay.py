@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""HTTPのやり取りと検索結果の記録・再生（オフラインでのスループット計測用）
+
+記録モードでは、実行中のページ取得（requests.get）と検索（googlesearch.search）の結果を
+gzip圧縮したJSONL形式のアーカイブに保存する。再生モードでは、アーカイブから同じ応答を
+指定した遅延をつけて返す。スタブサーバーを使うと、応答をローカルのHTTPサーバー経由で返す
+（ソケットとrequestsの処理も計測に含まれる）。
+
+    python fax_scraper_cli.py clinics.csv -o result.csv --record run.replay.gz
+    python http_replay.py benchmark run.replay.gz clinics.csv --row-workers 1,2,4,8 --latency 50
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+ARCHIVE_FORMAT = 'clinic-replay'
+ARCHIVE_VERSION = 1
+# 記録するレスポンスヘッダー
+RECORDED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Location']
+# パリティチェックで比較する列
+PARITY_COLUMNS = ['FAX番号', 'エラー詳細']
+
+
+class ArchiveRecorder:
+    """ページ取得と検索をラップし、やり取りをアーカイブに書き出す（複数スレッドから使える）"""
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self._file = gzip.open(archive_path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._write({'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION, 'created': time.time()})
+
+    def _write(self, entry):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def wrap_get(self, get):
+        """requests.get と同じ呼び出し方で、応答（または例外）を記録する関数を返す"""
+        def recording_get(url, **kwargs):
+            try:
+                response = get(url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._write({'kind': 'http', 'url': url, 'error': str(e)})
+                raise
+            self._write({
+                'kind': 'http',
+                'url': url,
+                'final_url': response.url,
+                'status': response.status_code,
+                'headers': {name: response.headers[name] for name in RECORDED_HEADERS
+                            if name in response.headers},
+                'body': base64.b64encode(response.content).decode('ascii'),
+            })
+            return response
+        return recording_get
+
+    def wrap_search(self, search):
+        """googlesearch.search と同じ呼び出し方で、検索結果を記録する関数を返す"""
+        def recording_search(query, **kwargs):
+            results = list(search(query, **kwargs))
+            self._write({'kind': 'search', 'query': query, 'results': results})
+            return results
+        return recording_search
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_archive(archive_path):
+    """アーカイブを読み込み、({URL: 記録}, {検索クエリ: 結果のリスト}) を返す
+
+    同じURL・クエリが複数回記録されている場合は最初の記録を使う。
+    """
+    pages = {}
+    searches = {}
+    with gzip.open(archive_path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != ARCHIVE_FORMAT:
+            raise ValueError(f"再生用のアーカイブではありません: {archive_path}")
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['kind'] == 'http':
+                pages.setdefault(entry['url'], entry)
+            elif entry['kind'] == 'search':
+                searches.setdefault(entry['query'], entry['results'])
+    return pages, searches
+
+
+class ReplayResponse:
+    """requests.Responseのうちスクレイパーが使う部分だけを持つ応答"""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = None
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class ArchiveReplayer:
+    """アーカイブからページと検索結果を返す
+
+    latencyは1回の取得・検索ごとの遅延（秒）で、jitterの割合だけランダムにばらつかせる。
+    stub_urlを指定すると、ページはスタブサーバーからHTTPで取得する。
+    """
+
+    def __init__(self, archive_path, latency=0.0, jitter=0.2, stub_url=None):
+        self.pages, self.searches = load_archive(archive_path)
+        self.latency = latency
+        self.jitter = jitter
+        self.stub_url = stub_url
+        self.misses = []
+
+    def _delay(self):
+        if self.latency > 0:
+            time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def get(self, url, **kwargs):
+        """requests.get の代わりに使う"""
+        if self.stub_url:
+            response = requests.get(f"{self.stub_url}/{quote(url, safe='')}",
+                                    timeout=kwargs.get('timeout'))
+            if response.status_code == 599:
+                raise requests.exceptions.ConnectionError(response.text)
+            return ReplayResponse(response.headers.get('X-Replay-Url', url), response.status_code,
+                                  {name: response.headers[name] for name in RECORDED_HEADERS
+                                   if name in response.headers},
+                                  response.content)
+
+        self._delay()
+        entry = self.pages.get(url)
+        if entry is None:
+            self.misses.append(url)
+            raise requests.exceptions.ConnectionError(f"アーカイブに記録されていないURLです: {url}")
+        if 'error' in entry:
+            raise requests.exceptions.ConnectionError(entry['error'])
+        return ReplayResponse(entry.get('final_url', url), entry['status'], entry['headers'],
+                              base64.b64decode(entry['body']))
+
+    def search(self, query, **kwargs):
+        """googlesearch.search の代わりに使う"""
+        self._delay()
+        if query not in self.searches:
+            self.misses.append(query)
+            return []
+        return list(self.searches[query])
+
+
+def start_stub_server(replayer, port=0, host='127.0.0.1'):
+    """アーカイブのページを返すスタブサーバーをデーモンスレッドで起動し、サーバーを返す
+
+    元のURLをエスケープしてパスに入れると（/http%3A%2F%2F...）、記録された応答を遅延をつけて返す。
+    記録されていないURLや取得エラーの記録には、ステータス599で理由を返す。
+    """
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = unquote(self.path.lstrip('/'))
+            replayer._delay()
+            entry = replayer.pages.get(url)
+            if entry is None or 'error' in entry:
+                if entry is None:
+                    replayer.misses.append(url)
+                body = (entry or {}).get('error', f"アーカイブに記録されていないURLです: {url}").encode('utf-8')
+                self.send_response(599)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            else:
+                body = base64.b64decode(entry['body'])
+                self.send_response(entry['status'])
+                for name, value in entry['headers'].items():
+                    self.send_header(name, value)
+                self.send_header('X-Replay-Url', entry.get('final_url', url))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='replay-stub', daemon=True)
+    thread.start()
+    return server
+
+
+# ---- ベンチマーク ----
+
+def compare_results(expected_path, actual_path):
+    """2つの結果CSVのFAX番号・エラー詳細を比べ、食い違った行の説明のリストを返す"""
+    import pandas as pd
+
+    expected = pd.read_csv(expected_path, dtype=str)
+    actual = pd.read_csv(actual_path, dtype=str)
+    if len(expected) != len(actual):
+        return [f"行数が異なります: {len(expected)} != {len(actual)}"]
+    mismatches = []
+    for index in range(len(expected)):
+        for column in PARITY_COLUMNS:
+            if column not in expected.columns or column not in actual.columns:
+                continue
+            want, got = expected.at[index, column], actual.at[index, column]
+            if pd.isna(want) and pd.isna(got):
+                continue
+            if want != got:
+                mismatches.append(f"{index + 1}行目 {column}: {want!r} != {got!r}")
+    return mismatches
+
+
+def run_benchmark(archive_path, input_csv, concurrency_levels, latency=0.0, stub=False,
+                  parse_workers=None, expected_path=None, log=print):
+    """再生した応答で同じ入力を並行数ごとに処理し、行/秒と結果の一致を確かめる
+
+    concurrency_levelsは(処理する行の並行数, ページ取得のスレッド数)のリスト。1行の候補ページは
+    先読みの件数までしか並行して取得しないため、行の並行数を変えないと取得のスレッドを増やしても
+    速くならない。取得のスレッド数がNoneなら、行の並行数×先読みの件数にする（取得待ちで詰まらない数）。
+    expected_pathを省略した場合は、最初の並行数の結果を基準にする。戻り値は食い違いがあればFalse。
+    """
+    from scraper_core import ScraperEngine
+
+    replayer = ArchiveReplayer(archive_path, latency=latency)
+    server = None
+    if stub:
+        server = start_stub_server(replayer)
+        replayer.stub_url = f"http://127.0.0.1:{server.server_address[1]}"
+        log(f"スタブサーバー: {replayer.stub_url}")
+
+    work_dir = tempfile.mkdtemp(prefix='replay_bench_')
+    ok = True
+    try:
+        # 全角文字は幅がずれるため、見出しは半角にする
+        log(f"{'row_workers':<12}{'fetch':>6}{'rows':>6}{'sec':>9}{'rows/s':>9}  parity")
+        for row_workers, fetch_workers in concurrency_levels:
+            output_path = os.path.join(work_dir, f"result_r{row_workers}_f{fetch_workers}.csv")
+            engine = ScraperEngine(
+                input_csv,
+                output_path=output_path,
+                row_workers=row_workers,
+                parse_workers=parse_workers,
+                resume=False,
+                http_get=replayer.get,
+                search_backend=replayer.search,
+                pace_requests=False,
+            )
+            engine.fetch_workers = fetch_workers or row_workers * engine.candidate_window
+            started = time.perf_counter()
+            engine.run()
+            elapsed = time.perf_counter() - started
+            rows = engine.rows_done
+
+            if expected_path is None:
+                expected_path = output_path
+                parity = "基準"
+            else:
+                mismatches = compare_results(expected_path, output_path)
+                parity = "OK" if not mismatches else f"{len(mismatches)}件の食い違い"
+                if mismatches:
+                    ok = False
+                    for mismatch in mismatches[:10]:
+                        log(f"    {mismatch}")
+            log(f"{row_workers:<12}{engine.fetch_workers:>6}{rows:>6}{elapsed:>9.2f}"
+                f"{rows / elapsed if elapsed else 0:>9.1f}  {parity}")
+        if replayer.misses:
+            log(f"アーカイブに記録されていなかった取得・検索: {len(set(replayer.misses))}件")
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="記録したHTTPのやり取りの再生とスループット計測")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bench = subparsers.add_parser('benchmark', help="記録を再生して並行数ごとの処理速度を計測する")
+    bench.add_argument("archive", help="--record で記録したアーカイブ")
+    bench.add_argument("input", help="記録したときと同じ入力CSV")
+    bench.add_argument("--row-workers", default="1,2,4,8",
+                       help="試す行の並行数（カンマ区切り、既定: 1,2,4,8）")
+    bench.add_argument("--concurrency",
+                       help="試すページ取得のスレッド数（カンマ区切り。行の並行数のそれぞれと組み合わせる。"
+                            "既定: 行の並行数×候補ページの先読み件数）")
+    bench.add_argument("--latency", type=float, default=0.0,
+                       help="1回の取得・検索ごとの遅延（ミリ秒）")
+    bench.add_argument("--stub-server", action="store_true",
+                       help="ローカルのスタブサーバー経由でHTTPで取得する")
+    bench.add_argument("--parse-workers", type=int, default=None,
+                       help="HTML解析を行うプロセス数（既定: CPUコア数）")
+    bench.add_argument("--expected",
+                       help="結果の比較に使うCSV（記録したときの出力など。省略時は最初の並行数の結果）")
+
+    serve = subparsers.add_parser('serve', help="スタブサーバーだけを起動する")
+    serve.add_argument("archive")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--latency", type=float, default=0.0, help="応答ごとの遅延（ミリ秒）")
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        replayer = ArchiveReplayer(args.archive, latency=args.latency / 1000)
+        server = start_stub_server(replayer, args.port)
+        print(f"http://127.0.0.1:{server.server_address[1]}/<エスケープした元のURL> で応答します（Ctrl+Cで終了）")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    row_levels = [int(value) for value in args.row_workers.split(',') if value.strip()]
+    fetch_levels = [int(value) for value in (args.concurrency or '').split(',') if value.strip()] or [None]
+    levels = [(rows, fetch) for rows in row_levels for fetch in fetch_levels]
+    ok = run_benchmark(args.archive, args.input, levels, latency=args.latency / 1000,
+                       stub=args.stub_server, parse_workers=args.parse_workers,
+                       expected_path=args.expected)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
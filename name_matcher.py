@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""クリニック名の表記ゆれに強い照合（文字2-gramの類似度）
+
+検索結果のページタイトルや、詳細ページへのリンクテキストが目的のクリニックのものかを判定する。
+名前は正規化（NFKC・法人格・空白と記号の除去）してから文字2-gramに分け、名前の2-gramのうち
+テキストに含まれるものの割合を点数（0.0〜1.0）にする。各2-gramには名簿全体から作った索引で
+重みを付ける（名簿の中で珍しいほど重い）ため、「クリニック」「内科」のように多くの名前に
+共通する部分だけが一致しても点数は上がらない。
+
+    index = NameIndex(df.iloc[:, 0])
+    score, accepted = index.match('つるみ内科クリニック', 'つるみ内科｜横浜市鶴見区の内科')
+
+acceptedは点数が確定のしきい値以上で、かつ名簿の別のクリニックの方がよく一致しない場合にTrueになる。
+確定した候補があればそれ以降の検索結果は取得せず、なければ取得した中で点数が最も高い候補を選ぶ。
+
+正解付きの照合データで、従来の完全一致との正解率と取得ページ数を比べる:
+
+    python name_matcher.py --benchmark corpus/name_matching.csv
+"""
+
+import argparse
+import csv
+import math
+import os
+import re
+import sys
+import unicodedata
+from collections import defaultdict
+
+NGRAM_SIZE = 2
+# この点数以上のページタイトルは、そのクリニックのものと確定して残りの候補を取得しない
+TITLE_ACCEPT_THRESHOLD = 0.8
+# 確定する候補がない場合に、最も点数の高い候補を選ぶための最低点
+TITLE_THRESHOLD = 0.6
+# 詳細ページへのリンクと判定する点数
+LINK_THRESHOLD = 0.6
+# 名簿の別のクリニックの点数がこれだけ上回ったら、そちらのページとみなす
+COMPETITOR_MARGIN = 0.05
+# 候補を探すときに使わない、よくある2-gram（含む名前がこれより多いもの。点数の計算には使う）
+MAX_POSTINGS = 100
+# 検索結果を判定する先まで先読みして取得する件数（ベンチマークの取得ページ数の計算用）
+CANDIDATE_WINDOW = 2
+
+# 名前の比較では無視する法人格（長いものから順に試す）
+LEGAL_ENTITY_WORDS = (
+    '医療法人社団', '医療法人財団', '社会医療法人', '特定医療法人', '医療法人',
+    '一般社団法人', '一般財団法人', '公益社団法人', '公益財団法人', '社会福祉法人',
+    '社団法人', '財団法人',
+)
+_LEGAL_ENTITY_RE = re.compile('|'.join(LEGAL_ENTITY_WORDS))
+# NFKC後の空白・記号（・｜-（）など）。長音符「ー」は文字として残る
+_SEPARATOR_RE = re.compile(r'[\W_]+')
+# 小書きの「ヶ」「ヵ」は地名で「ケ」「カ」と書かれることも多い
+_KANA_FOLD = str.maketrans({'ヶ': 'ケ', 'ヵ': 'カ', 'ゖ': 'け', 'ゕ': 'か'})
+
+
+def normalize_name(text):
+    """比較用にクリニック名やタイトルを正規化する（全角英数・空白・記号・法人格の違いをなくす）"""
+    text = unicodedata.normalize('NFKC', str(text or '')).lower().translate(_KANA_FOLD)
+    text = _LEGAL_ENTITY_RE.sub('', text)
+    return _SEPARATOR_RE.sub('', text)
+
+
+def name_ngrams(text, n=NGRAM_SIZE):
+    """正規化したテキストの文字n-gramの集合（n文字未満ならテキスト自体）"""
+    return _ngrams(normalize_name(text), n)
+
+
+def _ngrams(normalized, n=NGRAM_SIZE):
+    if len(normalized) < n:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+
+def weighted_containment(weights, normalized_text):
+    """名前の2-gram（重み付き）のうち、正規化したテキストに含まれるものの割合
+
+    部分文字列として調べるため、2文字未満の名前（2-gramがその名前自体）でも使える。
+    """
+    total = sum(weights.values())
+    if not total:
+        return 0.0
+    return sum(weight for gram, weight in weights.items() if gram in normalized_text) / total
+
+
+def name_score(name, text, weights=None):
+    """nameがtextにどれだけ含まれているかの点数（0.0〜1.0）
+
+    weightsはNameIndex.weights()の結果。省略するとすべての2-gramを同じ重みで数える。
+    """
+    if weights is None:
+        weights = dict.fromkeys(name_ngrams(name), 1.0)
+    return weighted_containment(weights, normalize_name(text))
+
+
+class NameIndex:
+    """名簿のクリニック名の2-gramの索引
+
+    2-gramごとに含む名前の集合（転置索引）を持ち、重みは log(1 + 名前の数 / その2-gramを含む名前の数)。
+
+    テキストに一致する名前を探すときは、数十万件の名簿でも「クリ」「内科」のような2-gramで全件を
+    たどらないよう、候補を次のように絞ってから点数を計算する。
+
+    - しきい値以上の名前だけを探す場合: 名前ごとに珍しい順に並べた2-gramの先頭部分（それ以外が
+      すべて一致してもしきい値に届かない分）だけの索引を使う。しきい値以上の名前は必ず先頭部分の
+      どれかを含む
+    - それ以外: 含む名前がmax_postings件以下の2-gramだけで候補を集める
+    """
+
+    def __init__(self, names=(), threshold=TITLE_ACCEPT_THRESHOLD, margin=COMPETITOR_MARGIN,
+                 max_postings=MAX_POSTINGS):
+        self.threshold = threshold
+        self.margin = margin
+        self.max_postings = max_postings
+        self.postings = defaultdict(set)
+        self.name_grams = {}
+        for name in names:
+            name = str(name)
+            if name in self.name_grams:
+                continue
+            grams = name_ngrams(name)
+            self.name_grams[name] = grams
+            for gram in grams:
+                self.postings[gram].add(name)
+        self._weights = {}
+        self._totals = {}
+        self._prefix_postings = None
+
+    def __len__(self):
+        return len(self.name_grams)
+
+    def gram_weight(self, gram):
+        # 名簿にない2-gramは名簿の中で1件だけのものと同じ扱い
+        return math.log(1 + max(len(self.name_grams), 1) / max(len(self.postings.get(gram, ())), 1))
+
+    def weights(self, name):
+        """nameの2-gramごとの重み（name_scoreに渡す）"""
+        weights = self._weights.get(name)
+        if weights is None:
+            grams = self.name_grams.get(name)
+            if grams is None:
+                grams = name_ngrams(name)
+            weights = self._weights[name] = {gram: self.gram_weight(gram) for gram in grams}
+        return weights
+
+    def weight_total(self, name):
+        total = self._totals.get(name)
+        if total is None:
+            total = self._totals[name] = sum(self.weights(name).values())
+        return total
+
+    def score(self, name, text):
+        return name_score(name, text, self.weights(name))
+
+    def prefix_postings(self):
+        """しきい値で候補を探すための、名前ごとの珍しい2-gramの先頭部分の転置索引"""
+        if self._prefix_postings is None:
+            prefix_postings = defaultdict(list)
+            for name, grams in self.name_grams.items():
+                weights = self.weights(name)
+                remaining = total = self.weight_total(name)
+                for gram in sorted(grams, key=lambda gram: (len(self.postings[gram]), gram)):
+                    if remaining < self.threshold * total:
+                        break
+                    prefix_postings[gram].append(name)
+                    remaining -= weights[gram]
+            self._prefix_postings = prefix_postings
+        return self._prefix_postings
+
+    def best_matches(self, text, limit=3, min_score=0.0):
+        """textによく一致する名簿の名前を、点数の高い順に(名前, 点数)のリストで返す
+
+        min_scoreがしきい値以上なら、min_score以上の名前だけを返す。
+        """
+        normalized = normalize_name(text)
+        # 2文字未満の名前は1文字の2-gramとして登録されているため、1文字ずつも調べる
+        grams = _ngrams(normalized) | set(normalized)
+        candidates = set()
+        if min_score >= self.threshold:
+            prefix_postings = self.prefix_postings()
+            for gram in grams & prefix_postings.keys():
+                candidates.update(prefix_postings[gram])
+        else:
+            for gram in grams:
+                names = self.postings.get(gram)
+                if names and len(names) <= self.max_postings:
+                    candidates.update(names)
+        scores = []
+        for name in candidates:
+            weights = self.weights(name)
+            total = self.weight_total(name)
+            # 含まれない2-gramの重みがこれを超えたら、min_scoreに届かない
+            allowed_missing = total * (1 - min_score)
+            missing = 0.0
+            for gram, weight in weights.items():
+                if gram not in normalized:
+                    missing += weight
+                    if missing > allowed_missing:
+                        break
+            else:
+                if total:
+                    scores.append((name, (total - missing) / total))
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores[:limit]
+
+    def match(self, name, text):
+        """(点数, 確定か)を返す。確定は点数がしきい値以上で、名簿の別の名前の方がよく一致しない場合"""
+        score = self.score(name, text)
+        if score < self.threshold:
+            return score, False
+        for other, other_score in self.best_matches(text, min_score=score + self.margin):
+            if other != name and other_score > score + self.margin:
+                return score, False
+        return score, True
+
+
+def exact_title_match(name, title):
+    """従来の判定（タイトルにクリニック名をそのまま含む）"""
+    return name in title
+
+
+def exact_link_match(name, text):
+    """従来の詳細リンクの判定（クリニック名と「クリニック」「医院」を除いた名前の部分一致）"""
+    return any(variant in text for variant in (name, name.replace('クリニック', ''), name.replace('医院', '')))
+
+
+def load_labeled_set(path):
+    """照合の正解データを読み込む
+
+    CSVの列は kind,clinic_name,rank,text,correct。kindは title（検索結果の順位ごとのページタイトル）か
+    link（詳細ページへのリンクテキスト）、correctは正解なら1。
+    {(kind, clinic_name): [(rank, text, 正解か), ...]} を順位順にして返す。
+    """
+    groups = defaultdict(list)
+    with open(path, encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            groups[(row['kind'], row['clinic_name'])].append(
+                (int(row['rank']), row['text'], row['correct'].strip() == '1'))
+    for candidates in groups.values():
+        candidates.sort()
+    return groups
+
+
+def select_title(candidates, accept, score=None, window=CANDIDATE_WINDOW):
+    """検索結果を順位順に判定した場合の(選んだ候補の位置, 取得したページ数)
+
+    acceptを満たす候補で確定する。なければscoreがTITLE_THRESHOLD以上で最も高い候補、
+    それもなければ先頭を選ぶ。判定中の候補の先までwindow件を取得しておくとして取得数を数える。
+    """
+    best = None
+    for position, (_, text, _) in enumerate(candidates):
+        if accept(text):
+            return position, min(position + window, len(candidates))
+        if score is not None:
+            value = score(text)
+            if value >= TITLE_THRESHOLD and (best is None or value > best[0]):
+                best = (value, position)
+    return (best[1] if best else 0), len(candidates)
+
+
+def run_benchmark(groups, window=CANDIDATE_WINDOW, show_failures=True):
+    """従来の完全一致と2-gramの照合の正解率・取得ページ数を比べて表示する"""
+    roster = NameIndex(name for kind, name in groups if kind == 'title')
+    title_groups = [(name, candidates) for (kind, name), candidates in groups.items() if kind == 'title']
+    link_groups = [(name, candidates) for (kind, name), candidates in groups.items() if kind == 'link']
+
+    methods = {
+        # 従来は全候補を同時に取得し、タイトルにクリニック名をそのまま含む最初の候補を選んでいた
+        'exact': lambda name, candidates: (
+            select_title(candidates, lambda text: exact_title_match(name, text))[0], len(candidates)),
+        'ngram': lambda name, candidates: select_title(
+            candidates, lambda text: roster.match(name, text)[1], lambda text: roster.score(name, text), window),
+    }
+    failures = []
+    print(f"タイトルの判定: {len(title_groups)}件（先読み{window}件）")
+    # 全角文字は幅がずれるため、見出しは半角にする
+    print(f"{'method':<8}{'hit':>6}{'rate':>7}{'fetches':>9}{'per row':>9}")
+    for method, select in methods.items():
+        hits = fetches = 0
+        for name, candidates in title_groups:
+            position, fetched = select(name, candidates)
+            fetches += fetched
+            if candidates[position][2]:
+                hits += 1
+            elif method == 'ngram':
+                failures.append(f"  [title] {name}: {candidates[position][1]}")
+        print(f"{method:<8}{hits:>6}{hits / len(title_groups):>7.0%}{fetches:>9}"
+              f"{fetches / len(title_groups):>9.2f}")
+
+    if link_groups:
+        print(f"\n詳細リンクの判定: {len(link_groups)}件")
+        print(f"{'method':<8}{'hit':>6}{'rate':>7}")
+        for method in ('exact', 'ngram'):
+            hits = 0
+            for name, candidates in link_groups:
+                if method == 'exact':
+                    chosen = next((c for c in candidates if exact_link_match(name, c[1])), None)
+                else:
+                    weights = roster.weights(name) if name in roster.name_grams else None
+                    scored = [(name_score(name, c[1], weights), c) for c in candidates]
+                    best = max(scored, key=lambda item: item[0], default=(0.0, None))
+                    chosen = best[1] if best[0] >= LINK_THRESHOLD else None
+                correct = next((c for c in candidates if c[2]), None)
+                if chosen == correct:
+                    hits += 1
+                elif method == 'ngram':
+                    failures.append(f"  [link] {name}: {chosen[1] if chosen else '(なし)'}")
+            print(f"{method:<8}{hits:>6}{hits / len(link_groups):>7.0%}")
+
+    if show_failures and failures:
+        print("\n2-gramの照合で誤った判定:")
+        print('\n'.join(failures))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="クリニック名の照合（文字2-gramの類似度）")
+    parser.add_argument("name", nargs="?", help="照合するクリニック名")
+    parser.add_argument("text", nargs="?", help="照合するタイトルやリンクテキスト")
+    parser.add_argument("--benchmark", metavar="CSV", nargs="?",
+                        const=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', 'name_matching.csv'),
+                        help="正解付きの照合データで従来の判定と比べる（既定: corpus/name_matching.csv）")
+    parser.add_argument("--window", type=int, default=CANDIDATE_WINDOW,
+                        help=f"取得ページ数の計算に使う先読みの件数（既定: {CANDIDATE_WINDOW}）")
+    parser.add_argument("--no-failures", dest="show_failures", action="store_false",
+                        help="誤った判定の一覧を表示しない")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        run_benchmark(load_labeled_set(args.benchmark), window=args.window, show_failures=args.show_failures)
+        return 0
+    if not args.name or not args.text:
+        parser.error("クリニック名とテキスト、または --benchmark を指定してください")
+    print(f"{normalize_name(args.name)} / {normalize_name(args.text)}: {name_score(args.name, args.text):.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
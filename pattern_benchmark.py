@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""FAX番号の検出パターン（fax_extractor.FAX_PATTERNS）の精度と速度の計測
+
+正解付きのコーパス（保存したHTMLと、正解のFAX番号を書いた labels.csv）に対して、
+各パターンを単独で全ページに適用し、パターンごとの適合率・再現率・検出頻度・1ページあたりの
+時間を出す。パターンは互いに独立なので、その結果から順番を入れ替えた場合の全体の正解率と
+平均時間も計算し、現在の順番と比べる。あわせて、候補に信頼度を付けて選ぶ
+fax_extractor.find_fax_number の正解率と時間も出す。
+
+コーパスの形式（ディレクトリ）:
+    labels.csv   file,fax_number,note の3列。FAXの記載がないページはfax_numberを空にする
+    *.html       保存したページ（文字コードはmetaかencoding_resolverの判定で決める）
+
+    python pattern_benchmark.py corpus
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from encoding_resolver import EncodingResolver
+from fax_extractor import FAX_PATTERNS, find_fax_number, first_number
+
+LABELS_FILE = 'labels.csv'
+# パターンの並べ方をすべて試す上限（6パターンなら720通り）
+MAX_PERMUTATION_PATTERNS = 8
+
+
+def normalize_number(number):
+    """比較用に数字だけにする"""
+    return re.sub(r'\D', '', number or '')
+
+
+def load_corpus(corpus_dir):
+    """コーパスを読み込み、(ファイル名, HTMLのバイト列, 正解のFAX番号, メモ)のリストを返す"""
+    corpus = []
+    with open(os.path.join(corpus_dir, LABELS_FILE), encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            with open(os.path.join(corpus_dir, row['file']), 'rb') as page:
+                corpus.append((row['file'], page.read(), row.get('fax_number') or '', row.get('note') or ''))
+    return corpus
+
+
+def evaluate_patterns(corpus, repeat=1):
+    """各パターンを全ページに単独で適用し、ページごとの結果と時間を返す
+
+    戻り値は (pages, parse_seconds)。pagesは
+    {'file', 'expected', 'results': {パターン番号: 検出した番号}, 'seconds': {パターン番号: 秒},
+     'scored': 信頼度で選んだ番号, 'scored_confidence': その信頼度, 'scored_seconds': 秒} のリスト。
+    """
+    resolver = EncodingResolver()
+    pages = []
+    parse_seconds = 0.0
+    for file_name, content, expected, _ in corpus:
+        encoding = resolver.resolve(None, content)
+        start = time.perf_counter()
+        soup = BeautifulSoup(content, 'html.parser', from_encoding=encoding)
+        parse_seconds += time.perf_counter() - start
+
+        results = {}
+        seconds = {}
+        for pattern_no, finder in FAX_PATTERNS:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                found = first_number(finder(soup))
+            seconds[pattern_no] = (time.perf_counter() - start) / repeat
+            results[pattern_no] = found
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            scored, _, confidence, _ = find_fax_number(soup)
+        scored_seconds = (time.perf_counter() - start) / repeat
+        pages.append({'file': file_name, 'expected': expected, 'results': results, 'seconds': seconds,
+                      'scored': scored, 'scored_confidence': confidence, 'scored_seconds': scored_seconds})
+    return pages, parse_seconds
+
+
+def pattern_report(pages):
+    """パターンごとの集計（検出数・正解数・誤検出数・適合率・再現率・平均時間）のリスト"""
+    labeled = sum(1 for page in pages if page['expected'])
+    report = []
+    for pattern_no, finder in FAX_PATTERNS:
+        fired = correct = 0
+        total_seconds = 0.0
+        for page in pages:
+            found = page['results'][pattern_no]
+            total_seconds += page['seconds'][pattern_no]
+            if found:
+                fired += 1
+                if normalize_number(found) == normalize_number(page['expected']):
+                    correct += 1
+        report.append({
+            'pattern': pattern_no,
+            'name': finder.__name__,
+            'fired': fired,
+            'correct': correct,
+            'wrong': fired - correct,
+            'precision': correct / fired if fired else 0.0,
+            'recall': correct / labeled if labeled else 0.0,
+            'ms_per_page': total_seconds / len(pages) * 1000 if pages else 0.0,
+        })
+    return report
+
+
+def evaluate_order(pages, order):
+    """パターンをorderの順に試した場合の(正解ページ数, 1ページあたりの平均時間ms)"""
+    correct = 0
+    total_seconds = 0.0
+    for page in pages:
+        found = None
+        for pattern_no in order:
+            total_seconds += page['seconds'][pattern_no]
+            found = page['results'][pattern_no]
+            if found:
+                break
+        if normalize_number(found) == normalize_number(page['expected']):
+            correct += 1
+    return correct, total_seconds / len(pages) * 1000 if pages else 0.0
+
+
+def best_order(pages):
+    """正解ページ数が最も多く、その中で平均時間が最も短い並べ方を返す"""
+    pattern_numbers = [pattern_no for pattern_no, _ in FAX_PATTERNS]
+    if len(pattern_numbers) > MAX_PERMUTATION_PATTERNS:
+        return None
+    best = None
+    for order in itertools.permutations(pattern_numbers):
+        correct, ms = evaluate_order(pages, order)
+        if best is None or (correct, -ms) > (best[1], -best[2]):
+            best = (order, correct, ms)
+    return best
+
+
+def print_report(pages, parse_seconds, show_failures=True):
+    print(f"ページ数: {len(pages)}（FAXの記載あり: {sum(1 for page in pages if page['expected'])}）  "
+          f"HTML解析: {parse_seconds / len(pages) * 1000:.2f}ms/ページ")
+    # 全角文字は幅がずれるため、見出しは半角にする
+    print(f"{'no':<4}{'function':<24}{'fired':>6}{'correct':>8}{'wrong':>6}{'precision':>10}{'recall':>8}{'ms/page':>9}")
+    for row in pattern_report(pages):
+        print(f"{row['pattern']:<4}{row['name']:<24}{row['fired']:>6}{row['correct']:>8}{row['wrong']:>6}"
+              f"{row['precision']:>10.0%}{row['recall']:>8.0%}{row['ms_per_page']:>9.3f}")
+
+    current = [pattern_no for pattern_no, _ in FAX_PATTERNS]
+    correct, ms = evaluate_order(pages, current)
+    print(f"\n現在の順番 {current}: 正解 {correct}/{len(pages)}  平均 {ms:.3f}ms/ページ")
+    best = best_order(pages)
+    if best is not None:
+        order, correct, ms = best
+        print(f"最適な順番 {list(order)}: 正解 {correct}/{len(pages)}  平均 {ms:.3f}ms/ページ")
+    scored_correct = sum(1 for page in pages
+                         if normalize_number(page['scored']) == normalize_number(page['expected']))
+    scored_ms = sum(page['scored_seconds'] for page in pages) / len(pages) * 1000
+    print(f"信頼度による選択: 正解 {scored_correct}/{len(pages)}  平均 {scored_ms:.3f}ms/ページ")
+
+    if show_failures:
+        failures = []
+        for page in pages:
+            found = None
+            for pattern_no in current:
+                found = page['results'][pattern_no]
+                if found:
+                    break
+            if normalize_number(found) != normalize_number(page['expected']):
+                failures.append(f"  {page['file']}: 正解 {page['expected'] or '(なし)'} / 検出 {found or '(なし)'}")
+        if failures:
+            print("\n現在の順番で誤ったページ:")
+            print('\n'.join(failures))
+        failures = [f"  {page['file']}: 正解 {page['expected'] or '(なし)'} / 検出 {page['scored'] or '(なし)'}"
+                    f"（信頼度 {page['scored_confidence']:.2f}）"
+                    for page in pages
+                    if normalize_number(page['scored']) != normalize_number(page['expected'])]
+        if failures:
+            print("\n信頼度による選択で誤ったページ:")
+            print('\n'.join(failures))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FAX番号の検出パターンの精度と速度の計測")
+    parser.add_argument("corpus", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus'),
+                        help="正解付きコーパスのディレクトリ（既定: corpus）")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="時間を安定させるため各パターンを繰り返す回数（既定: 5）")
+    parser.add_argument("--no-failures", dest="show_failures", action="store_false",
+                        help="誤ったページの一覧を表示しない")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print("コーパスにページがありません", file=sys.stderr)
+        return 1
+    pages, parse_seconds = evaluate_patterns(corpus, repeat=args.repeat)
+    print_report(pages, parse_seconds, show_failures=args.show_failures)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
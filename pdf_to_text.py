@@ -1,12 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
+import io
+import mmap
 import os
+import struct
 import sys
+import tarfile
+import time
+import zipfile
+from urllib.parse import urlparse
 import pandas as pd
 import fitz  # PyMuPDF
 import re
 from tqdm import tqdm
+from phone_normalizer import phone_digits
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QProgressBar, QTextEdit, QFileDialog,
@@ -14,52 +23,208 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import QThread, pyqtSignal, Qt
 
-def extract_fax_numbers(pdf_path, output_path=None):
-    """PDFからFAX番号を抽出してCSVファイルに保存"""
-    print(f"PDFファイルからFAX番号を抽出中: {pdf_path}")
-    
-    # 出力パスが指定されていない場合は、PDFと同じ場所に作成
-    if output_path is None:
-        base_name = os.path.splitext(os.path.basename(pdf_path))[0]
-        output_dir = os.path.dirname(os.path.abspath(pdf_path))
-        output_path = os.path.join(output_dir, f"{base_name}_fax_numbers.csv")
+# 入力として扱うアーカイブの拡張子（中のPDFをディスクに展開せずに順に処理する）
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+# zipのローカルファイルヘッダー（固定長30バイト。ファイル名と拡張フィールドの長さを読んでデータの位置を求める）
+ZIP_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+
+
+def source_base_name(name):
+    """出力ファイル名の元にする名前（PDF・アーカイブの拡張子を除いたファイル名）"""
+    base_name = os.path.basename(name)
+    for suffix in ARCHIVE_SUFFIXES + ('.pdf',):
+        if base_name.lower().endswith(suffix):
+            return base_name[:-len(suffix)]
+    return os.path.splitext(base_name)[0]
+
+
+def default_output_path(pdf_path):
+    """PDF（またはアーカイブ）と同じ場所の <名前>_fax_numbers.csv"""
+    output_dir = os.path.dirname(os.path.abspath(pdf_path))
+    return os.path.join(output_dir, f"{source_base_name(pdf_path)}_fax_numbers.csv")
+
+
+def open_pdf(source):
+    """PDFを開く
+
+    sourceはファイルのパス、バイト列・memoryview・mmap、またはファイルオブジェクト。
+    パスはMuPDFが必要な部分だけを読む。実ファイルのファイルオブジェクトとmmapはmemoryviewで
+    そのまま渡し（コピーしない）、パイプなどmmapできないものだけを読み込む。
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if isinstance(source, mmap.mmap):
+        source = memoryview(source)
+    elif hasattr(source, 'read'):
+        try:
+            source = memoryview(mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            source = source.read()
+    return fitz.open(stream=source, filetype='pdf')
+
+
+def is_archive(path):
+    return isinstance(path, (str, os.PathLike)) and str(path).lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def iter_archive_pdfs(archive_path):
+    """zip/tarアーカイブの中のPDFを(メンバー名, データ)で順に返す（ディスクには展開しない）
+
+    無圧縮で格納されたzipのメンバーと、圧縮していないtarのメンバーは、アーカイブをmmapした
+    memoryviewの一部として返す（コピーしない）。圧縮されたものはメンバーごとにメモリ上で展開する。
+    データは次のメンバーに進むと解放されるため、それまでに開いたPDFを閉じること。
+    """
+    with open(archive_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if zipfile.is_zipfile(f):
+                with zipfile.ZipFile(f) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir() or not info.filename.lower().endswith('.pdf'):
+                            continue
+                        if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                            header = ZIP_LOCAL_HEADER.unpack_from(mapped, info.header_offset)
+                            start = info.header_offset + ZIP_LOCAL_HEADER.size + header[-2] + header[-1]
+                            yield from _yield_view(info.filename, mapped, start, info.file_size)
+                        else:
+                            yield info.filename, archive.read(info)
+                return
+
+            f.seek(0)
+            try:
+                # 圧縮していないtarはメンバーの位置が分かるので、mmapから切り出す
+                archive = tarfile.open(fileobj=f, mode='r:')
+                plain = True
+            except tarfile.ReadError:
+                f.seek(0)
+                archive = tarfile.open(fileobj=f, mode='r|*')
+                plain = False
+            with archive:
+                for member in archive:
+                    if not member.isfile() or not member.name.lower().endswith('.pdf'):
+                        continue
+                    if plain:
+                        yield from _yield_view(member.name, mapped, member.offset_data, member.size)
+                    else:
+                        yield member.name, archive.extractfile(member).read()
+
+
+def _yield_view(name, mapped, start, size):
+    view = memoryview(mapped)[start:start + size]
+    try:
+        yield name, view
+    finally:
+        view.release()
+
+
+def iter_pdf_sources(pdf_source, name=None):
+    """処理するPDFを(名前, open_pdfに渡すもの)で順に返す
+
+    pdf_sourceがアーカイブのパスなら中のPDFを、http(s)のURLなら取得したバイト列を、
+    それ以外（PDFのパス・バイト列・mmap・ファイルオブジェクト）はそのまま1件返す。
+    """
+    if isinstance(pdf_source, (str, os.PathLike)):
+        path = str(pdf_source)
+        if path.startswith(('http://', 'https://')):
+            import requests
+
+            response = requests.get(path, timeout=60)
+            response.raise_for_status()
+            yield name or os.path.basename(urlparse(path).path) or 'download.pdf', response.content
+            return
+        if is_archive(path):
+            yield from iter_archive_pdfs(path)
+            return
+        yield name or os.path.basename(path), path
+        return
+    yield name or getattr(pdf_source, 'name', None) or 'stream.pdf', pdf_source
+
+
+def extract_fax_numbers(pdf_path, output_path=None, metrics=None, slow_page_seconds=None, name=None):
+    """PDFからFAX番号を抽出してCSVファイルに保存
+
+    pdf_pathはPDFのパスのほか、http(s)のURL、zip/tarアーカイブのパス（中のPDFをすべて処理し、
+    どのPDFかを file 列に入れる）、バイト列・mmap・ファイルオブジェクトも受け付ける。
+    パス以外を渡す場合、nameは表示と既定の出力先の名前に使う（省略時は出力先の指定が必要）。
+    metrics（metrics.MetricsRegistry）を渡すと、ページ数・所要時間・検出件数を公開する。
+    slow_page_secondsを指定すると、その秒数以上かかったページを表示する。
+    """
+    source_name = str(pdf_path) if isinstance(pdf_path, (str, os.PathLike)) else name
+    print(f"PDFファイルからFAX番号を抽出中: {source_name or '(ストリーム)'}")
+    if metrics is None:
+        from metrics import NullMetrics
+        metrics = NullMetrics()
+    pages_counter = metrics.counter('pdf_pages_total', '処理したページ数')
+    page_errors = metrics.counter('pdf_page_errors_total', '処理中にエラーになったページ数')
+    page_seconds = metrics.histogram('pdf_page_seconds', '1ページのテキスト抽出と検索の所要時間（秒）')
+    fax_counter = metrics.counter('pdf_fax_numbers_total', '検出したFAX番号の件数（重複除去前）')
+    pages_remaining = metrics.gauge('pdf_pages_remaining', '処理中のPDFの残りページ数')
     
     try:
-        # PDFを開く
-        doc = fitz.open(pdf_path)
-        num_pages = len(doc)
-        print(f"PDFを開きました: {num_pages}ページ")
-        
+        # 出力パスが指定されていない場合は、PDFと同じ場所に作成
+        if output_path is None:
+            if source_name is None or source_name.startswith(('http://', 'https://')):
+                raise ValueError("パス以外から読み込む場合は出力先を指定してください")
+            output_path = default_output_path(source_name)
+
         # FAX番号を抽出
         fax_numbers = []
+        archive = is_archive(pdf_path)
         
         # FAX番号を抽出するための正規表現パターン
-        # 括弧()に挟まれて、ハイフン2つを含む10桁の数字
-        fax_pattern = r'\((\d{3}-\d{3}-\d{4})\)'
+        # 括弧()に挟まれて、ハイフン2つを含む番号（市外局番の桁数は問わず、全角も含める）。
+        # 正しい番号かどうかと桁数はphone_normalizerで確かめる
+        fax_pattern = r'[(（]([0０][\d０-９]{1,4}[-－][\d０-９]{1,4}[-－][\d０-９]{3,4})[)）]'
         
-        for page_num in tqdm(range(num_pages), desc="FAX番号抽出中"):
+        for file_name, source in iter_pdf_sources(pdf_path, name):
+            # PDFを開く
+            doc = open_pdf(source)
             try:
-                page = doc[page_num]
-                text = page.get_text()
-                
-                # 正規表現でFAX番号を検索
-                matches = re.findall(fax_pattern, text)
-                
-                if matches:
-                    # 重複を除去
-                    unique_fax = list(set(matches))
-                    
-                    for fax in unique_fax:
-                        # ハイフンを削除して数字のみの10桁に変換
-                        clean_fax = fax.replace('-', '')
-                        fax_numbers.append({
-                            "page": page_num + 1,
-                            "fax_number": clean_fax,
-                            "context": get_context(text, fax)  # FAX番号の周辺テキストを取得
-                        })
-                        
-            except Exception as e:
-                print(f"ページ {page_num+1} の処理中にエラー: {e}")
+                num_pages = len(doc)
+                print(f"PDFを開きました: {file_name} {num_pages}ページ")
+                pages_remaining.set(num_pages)
+
+                for page_num in tqdm(range(num_pages), desc="FAX番号抽出中"):
+                    page_started = time.perf_counter()
+                    try:
+                        page = doc[page_num]
+                        text = page.get_text()
+
+                        # 正規表現でFAX番号を検索
+                        matches = re.findall(fax_pattern, text)
+
+                        if matches:
+                            # 重複を除去
+                            unique_fax = list(set(matches))
+                            fax_counter.inc(len(unique_fax))
+
+                            for fax in unique_fax:
+                                # 正規化して数字のみに変換（電話番号として成り立たないものは捨てる）
+                                clean_fax = phone_digits(fax)
+                                if clean_fax is None:
+                                    continue
+                                record = {
+                                    "page": page_num + 1,
+                                    "fax_number": clean_fax,
+                                    "context": get_context(text, fax)  # FAX番号の周辺テキストを取得
+                                }
+                                if archive:
+                                    record["file"] = os.path.basename(file_name)  # アーカイブ内のどのPDFか
+                                fax_numbers.append(record)
+
+                    except Exception as e:
+                        print(f"ページ {page_num+1} の処理中にエラー: {e}")
+                        page_errors.inc()
+                    page_elapsed = time.perf_counter() - page_started
+                    page_seconds.observe(page_elapsed)
+                    if slow_page_seconds is not None and page_elapsed >= slow_page_seconds:
+                        print(f"ページ {page_num+1} の処理に {page_elapsed:.2f}秒かかりました")
+                    pages_counter.inc()
+                    pages_remaining.dec()
+            finally:
+                # PDFを閉じる（アーカイブのメンバーのデータは次に進むと解放される）
+                doc.close()
         
         # データフレームに変換
         df = pd.DataFrame(fax_numbers)
@@ -80,9 +245,6 @@ def extract_fax_numbers(pdf_path, output_path=None):
         else:
             print("FAX番号が見つかりませんでした")
         
-        # PDFを閉じる
-        doc.close()
-        
         return output_path, len(df)
     
     except Exception as e:
@@ -109,17 +271,18 @@ class ExtractWorker(QThread):
     finished = pyqtSignal(str, int)  # output_path, num_found
     error_occurred = pyqtSignal(str)
 
-    def __init__(self, pdf_path, output_path=None):
+    def __init__(self, pdf_path, output_path=None, metrics=None):
         super().__init__()
         self.pdf_path = pdf_path
         self.output_path = output_path
+        self.metrics = metrics
 
     def run(self):
         try:
             self.log_updated.emit(f"PDFファイルからFAX番号を抽出中: {self.pdf_path}")
             
             # 抽出処理（既存のコードを使用）
-            result_path, num_found = extract_fax_numbers(self.pdf_path, self.output_path)
+            result_path, num_found = extract_fax_numbers(self.pdf_path, self.output_path, self.metrics)
             
             if result_path:
                 # extract_fax_numbers関数内で重複削除が行われるため、ここでログに記録
@@ -213,13 +376,15 @@ class MainWindow(QMainWindow):
         
         # 抽出ワーカー
         self.worker = None
+        # --metrics-port 指定時に実行状況を公開するメトリクスの登録先
+        self.metrics = None
 
     def browse_input_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self,
             "PDFファイルを選択",
             "",
-            "PDFファイル (*.pdf);;すべてのファイル (*.*)"
+            "PDFファイル (*.pdf);;PDFを含むアーカイブ (*.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tar.xz);;すべてのファイル (*.*)"
         )
         if file_path:
             self.input_path.setText(file_path)
@@ -227,9 +392,7 @@ class MainWindow(QMainWindow):
             
             # デフォルトの出力パスを設定
             if not self.output_path.text():
-                base_name = os.path.splitext(os.path.basename(file_path))[0]
-                output_dir = os.path.dirname(os.path.abspath(file_path))
-                default_output = os.path.join(output_dir, f"{base_name}_fax_numbers.csv")
+                default_output = default_output_path(file_path)
                 self.output_path.setText(default_output)
                 self.log(f"デフォルトの出力先を設定しました: {default_output}")
 
@@ -260,7 +423,7 @@ class MainWindow(QMainWindow):
             self.log("すでに処理中です")
             return
             
-        self.worker = ExtractWorker(self.input_path.text(), self.output_path.text())
+        self.worker = ExtractWorker(self.input_path.text(), self.output_path.text(), self.metrics)
         self.worker.log_updated.connect(self.log)
         self.worker.finished.connect(self.extraction_finished)
         self.worker.error_occurred.connect(self.handle_error)
@@ -286,7 +449,46 @@ class MainWindow(QMainWindow):
             self.log_text.verticalScrollBar().maximum()
         )
 
+def parse_args(argv=None):
+    """コマンドライン引数を解析する（PDFを指定した場合は画面を開かずに抽出する）"""
+    parser = argparse.ArgumentParser(description="PDF FAX番号抽出ツール")
+    parser.add_argument("pdf_path", nargs="?",
+                        help="FAX番号を抽出するPDFファイル（指定すると画面を開かずに実行する）。"
+                             "PDFを含むzip/tar、http(s)のURL、標準入力（-）も指定できる")
+    parser.add_argument("-o", "--output",
+                        help="出力先のCSVファイル（省略時は <PDF名>_fax_numbers.csv。URLと標準入力では必須）")
+    parser.add_argument("--metrics-port", type=int,
+                        help="指定したポートの http://127.0.0.1:<port>/metrics で実行状況を公開する")
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="プロファイルを取り、PREFIX.pstats と PREFIX.collapsed（フレームグラフ用）に書き出す")
+    parser.add_argument("--slow-page", type=float, metavar="SECONDS",
+                        help="この秒数以上かかったページを表示する")
+    args, _ = parser.parse_known_args(argv)
+    return args
+
 if __name__ == "__main__":
+    args = parse_args()
+    metrics = None
+    if args.metrics_port:
+        from metrics import MetricsRegistry, start_metrics_server
+
+        metrics = MetricsRegistry()
+        start_metrics_server(metrics, args.metrics_port)
+        print(f"メトリクスを公開しています: http://127.0.0.1:{args.metrics_port}/metrics")
+
+    if args.pdf_path:
+        if args.pdf_path == '-':
+            # パイプで受け取ったPDFは一時ファイルに書かずに開く
+            args.pdf_path = sys.stdin.buffer
+        if args.profile:
+            from profiling import RunProfiler, profile_run
+
+            with profile_run(RunProfiler(args.profile)):
+                result_path, _ = extract_fax_numbers(args.pdf_path, args.output, metrics, args.slow_page)
+        else:
+            result_path, _ = extract_fax_numbers(args.pdf_path, args.output, metrics, args.slow_page)
+        sys.exit(0 if result_path else 1)
+
     # macOS向けの設定
     if sys.platform == 'darwin':
         os.environ['QT_MAC_WANTS_LAYER'] = '1'
@@ -294,5 +496,6 @@ if __name__ == "__main__":
     
     app = QApplication(sys.argv)
     window = MainWindow()
+    window.metrics = metrics
     window.show()
     sys.exit(app.exec_())
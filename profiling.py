@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""抽出処理のプロファイリング（--profile）
+
+cProfileによる決定的なプロファイルと、全スレッドのスタックを一定間隔で記録する
+サンプリングプロファイルを同時に取る。出力は次の2つ。
+
+- <prefix>.pstats: pstats / snakeviz などで開ける標準形式
+- <prefix>.collapsed: flamegraph.pl や speedscope で読み込める折りたたみスタック形式
+
+cProfileはスレッドごとに有効にする必要があるため、プロファイルしたい処理を
+section() で囲む（スレッドプール上の処理もそれぞれのスレッドで囲む）。
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# サンプリングの間隔（秒）
+SAMPLE_INTERVAL = 0.005
+# 終了時に表示する関数の数
+TOP_FUNCTIONS = 20
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RunProfiler:
+    """1回の実行全体のプロファイルを取る"""
+
+    def __init__(self, output_prefix, sample_interval=SAMPLE_INTERVAL):
+        self.output_prefix = output_prefix
+        self.sample_interval = sample_interval
+        self.samples = Counter()
+        self._profiles = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sampler = None
+
+    @property
+    def pstats_path(self):
+        return self.output_prefix + '.pstats'
+
+    @property
+    def collapsed_path(self):
+        return self.output_prefix + '.collapsed'
+
+    def start(self):
+        """サンプリングを開始する"""
+        self._stop_event.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, name='profile-sampler', daemon=True)
+        self._sampler.start()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    @contextmanager
+    def section(self):
+        """この中の処理を呼び出したスレッドのcProfileで記録する（入れ子にしてもよい）"""
+        local = self._local
+        if not hasattr(local, 'profile'):
+            local.profile = cProfile.Profile()
+            local.depth = 0
+            with self._lock:
+                self._profiles.append(local.profile)
+        local.depth += 1
+        if local.depth == 1:
+            local.profile.enable()
+        try:
+            yield
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                local.profile.disable()
+
+    def stop(self):
+        """サンプリングを止め、pstatsと折りたたみスタックを書き出す
+
+        すべてのsection()を抜けてから呼ぶこと。
+        """
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+        with self._lock:
+            profiles = list(self._profiles)
+        if profiles:
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(self.pstats_path)
+
+        with open(self.collapsed_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """自分自身の処理時間（tottime）が長い関数の一覧を文字列で返す"""
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return "プロファイルが記録されていません"
+        stream = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=stream)
+        stats.strip_dirs().sort_stats('tottime').print_stats(limit)
+        return stream.getvalue()
+
+
+@contextmanager
+def profile_run(profiler, log=print):
+    """with文の中の処理全体（呼び出したスレッド）をプロファイルし、終了時に結果を表示する"""
+    profiler.start()
+    started = time.perf_counter()
+    try:
+        with profiler.section():
+            yield profiler
+    finally:
+        profiler.stop()
+        log(f"プロファイル（{time.perf_counter() - started:.1f}秒）: "
+            f"{profiler.pstats_path}, {profiler.collapsed_path}")
+        log(profiler.top_functions())
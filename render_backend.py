@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""JavaScriptで連絡先を描画するページ用のヘッドレスブラウザ描画（オプション）
+
+静的なHTMLからFAX番号が見つからず、かつSPAの特徴があるページだけを描画する。
+ブラウザの起動は重いため、少数のインスタンスを使い回すプールとして実装している。
+seleniumはこのモジュールを使う場合にのみ必要。
+"""
+
+import queue
+import threading
+import time
+
+
+class BrowserPool:
+    """起動済みのヘッドレスChromeを使い回すプール"""
+
+    def __init__(self, size=2, page_timeout=20, settle_time=5, log=None):
+        self.size = size
+        self.page_timeout = page_timeout  # ページ読み込みのタイムアウト（秒）
+        self.settle_time = settle_time  # 読み込み後、本文が描画されるまで待つ最大時間（秒）
+        self.log = log or (lambda message: None)
+        self._idle = queue.Queue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create_driver(self):
+        """ヘッドレスChromeを1つ起動する"""
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+
+        options = Options()
+        options.add_argument('--headless=new')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        options.add_argument('--blink-settings=imagesEnabled=false')  # 画像は不要
+
+        try:
+            # webdriver_managerがあればドライバーを自動で用意する
+            from webdriver_manager.chrome import ChromeDriverManager
+            service = Service(ChromeDriverManager().install())
+        except ImportError:
+            service = Service()
+
+        driver = webdriver.Chrome(service=service, options=options)
+        driver.set_page_load_timeout(self.page_timeout)
+        self.log(f"- ヘッドレスブラウザを起動しました ({len(self._all) + 1}/{self.size})")
+        return driver
+
+    def _acquire(self):
+        """空いているブラウザを取り出す。上限まではその場で起動する"""
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("ブラウザプールは終了しています")
+                if len(self._all) < self.size:
+                    driver = self._create_driver()
+                    self._all.append(driver)
+                    return driver
+
+            # 異常終了したブラウザが外れた場合に備え、定期的に上限を確認し直す
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def _discard(self, driver):
+        """異常が起きたブラウザを終了してプールから外す"""
+        with self._lock:
+            if driver in self._all:
+                self._all.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def render(self, url):
+        """URLをブラウザで描画し、描画後のHTMLを返す"""
+        driver = self._acquire()
+        try:
+            driver.get(url)
+            # 読み込み完了後も、スクリプトが連絡先を描画するまで少し待つ
+            deadline = time.time() + self.settle_time
+            while time.time() < deadline:
+                ready = driver.execute_script("return document.readyState") == "complete"
+                body_text = driver.execute_script(
+                    "return document.body ? document.body.innerText : ''"
+                ) or ""
+                if ready and ('FAX' in body_text.upper() or 'ファックス' in body_text):
+                    break
+                time.sleep(0.5)
+            html = driver.page_source
+        except Exception:
+            self._discard(driver)
+            raise
+        if self._closed:
+            self._discard(driver)
+        else:
+            self._idle.put(driver)
+        return html
+
+    def close(self):
+        """すべてのブラウザを終了する"""
+        with self._lock:
+            self._closed = True
+            drivers, self._all = self._all, []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
@@ -0,0 +1,495 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""区医師会などの会員名簿サイトからFAX番号を集める汎用クローラー（Qtに依存しない）
+
+サイトごとの違い（検索URL・フォームの送信内容・詳細ページへのリンク・項目の取り出し方）は
+sites/ 以下のJSON（サイトプロファイル）に書く。区を追加するときはJSONを1つ追加すればよい。
+
+    python roster_crawler.py sites/*.json -o output
+
+複数のサイトは並行して処理し、同じホストへのリクエスト間隔はサイトごとの設定に従う。
+接続（requests.Session）と前回の取得結果（スナップショット）はすべてのサイトで共有する。
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+from encoding_resolver import EncodingResolver
+from phone_normalizer import normalize_phone
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# サイトプロファイルに必須の項目
+REQUIRED_PROFILE_KEYS = ['id', 'name', 'search', 'detail_link_selector', 'fields']
+# 検索結果の次ページをたどる上限
+MAX_LISTING_PAGES = 50
+
+
+def load_profile(path):
+    """サイトプロファイル(JSON)を読み込んで既定値を補う"""
+    with open(path, encoding='utf-8') as f:
+        profile = json.load(f)
+    missing = [key for key in REQUIRED_PROFILE_KEYS if key not in profile]
+    if missing:
+        raise ValueError(f"サイトプロファイル {path} に必要な項目がありません: {', '.join(missing)}")
+    if 'url' not in profile['search']:
+        raise ValueError(f"サイトプロファイル {path} の search に url がありません")
+
+    profile.setdefault('request_interval', 1.0)  # 同じホストへのリクエスト間隔（秒）
+    profile.setdefault('max_workers', 4)  # 詳細ページを並行して取得するスレッド数
+    profile.setdefault('headers', {})
+    profile.setdefault('encoding', None)  # 省略時は自動判定
+    profile['search'].setdefault('method', 'POST')
+    profile['search'].setdefault('data', {})
+    for name, spec in profile['fields'].items():
+        if 'selector' not in spec and 'regex' not in spec:
+            raise ValueError(f"サイトプロファイル {path} の項目 {name} に selector も regex もありません")
+    return profile
+
+
+class HostRateLimiter:
+    """ホストごとにリクエストの間隔を一定以上空ける（複数スレッドから共有する）"""
+
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._next_time = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url, interval=None):
+        """このホストへの次のリクエストが許可される時刻まで待つ"""
+        if interval is None:
+            interval = self.min_interval
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_time.get(host, now))
+            self._next_time[host] = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def collect_detail_links(soup, page_url, selector):
+    """検索結果ページから詳細ページへのリンクだけを重複なく取り出す
+
+    ナビゲーションやサイト外へのリンクは除き、urljoinで絶対URLにしてから重複を除く。
+    戻り値は(URL, リンクテキスト)のリスト（ページ内の出現順）。
+    """
+    links = {}
+    for link in soup.select(selector):
+        if not link.get('href'):
+            continue
+        full_url, _ = urldefrag(urljoin(page_url, link['href']))
+        link_text = link.get_text().strip()
+        # 同じURLが画像リンクなどで複数回出てくる場合は、テキストのあるものを優先する
+        if full_url not in links or (link_text and not links[full_url]):
+            links[full_url] = link_text
+    return list(links.items())
+
+
+def extract_fields(soup, fields):
+    """プロファイルの項目定義に従って詳細ページから値を取り出す
+
+    selectorがあればその要素のテキストを、regexがあれば最初のグループを取り出す。
+    selectorがなければページ全体のテキストにregexを適用する。
+    normalizeが"phone"なら電話番号として正規化し、番号として正しくない一致は飛ばす。
+    """
+    page_text = None
+    values = {}
+    for name, spec in fields.items():
+        if 'selector' in spec:
+            elem = soup.select_one(spec['selector'])
+            text = elem.get_text(" ", strip=True) if elem else None
+        else:
+            if page_text is None:
+                page_text = soup.get_text()
+            text = page_text
+
+        value = None
+        if text is not None:
+            if 'regex' in spec:
+                for match in re.finditer(spec['regex'], text):
+                    value = match.group(1) if match.groups() else match.group(0)
+                    if spec.get('normalize') == 'phone':
+                        value = normalize_phone(value)
+                    if value:
+                        break
+            else:
+                value = normalize_phone(text) if spec.get('normalize') == 'phone' else text
+        values[name] = value if value else spec.get('default', f"{name}が見つかりませんでした")
+    return values
+
+
+class SnapshotStore:
+    """前回の取得結果（URLごとのハッシュ・ETag・項目の値など）を保存するファイル
+
+    すべてのサイトで1つのファイルを共有する。各エントリはサイトIDを持つ。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+            for entry in self.entries.values():
+                # FAX番号だけを保存していた形式からの読み替え
+                if 'fields' not in entry and 'fax_number' in entry:
+                    entry['fields'] = {'FAX番号': entry.pop('fax_number')}
+
+    def get(self, url):
+        with self._lock:
+            return self.entries.get(url)
+
+    def update(self, url, entry):
+        with self._lock:
+            self.entries[url] = entry
+
+    def site_entries(self, site_id):
+        """サイトのエントリを返す（サイトIDのない古いエントリも含める）"""
+        with self._lock:
+            return {url: entry for url, entry in self.entries.items()
+                    if entry.get('site', site_id) == site_id}
+
+    def remove(self, urls):
+        with self._lock:
+            for url in urls:
+                self.entries.pop(url, None)
+
+    def save(self):
+        """書き込み途中で中断しても壊れないよう一時ファイルから置き換える"""
+        with self._lock:
+            data = json.dumps(self.entries, ensure_ascii=False, indent=1)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def diff_snapshots(old, new, field_names, complete=True):
+    """前回と今回の取得結果を比べ、追加・削除・変更された行の一覧を返す
+
+    completeがFalse（途中で中止した場合）は、今回たどっていないURLを削除とはみなさない。
+    """
+    def row(kind, url, old_entry, new_entry):
+        entry = new_entry or old_entry
+        values = {'種別': kind, 'リンク名': entry.get('link_text', ''), 'URL': url}
+        for name in field_names:
+            values[f'旧{name}'] = (old_entry or {}).get('fields', {}).get(name, '')
+            values[f'新{name}'] = (new_entry or {}).get('fields', {}).get(name, '')
+        return values
+
+    diff = []
+    for url, entry in new.items():
+        if url not in old:
+            diff.append(row('追加', url, None, entry))
+        elif old[url].get('fields') != entry.get('fields'):
+            diff.append(row('変更', url, old[url], entry))
+    if complete:
+        for url, entry in old.items():
+            if url not in new:
+                diff.append(row('削除', url, entry, None))
+    return diff
+
+
+class RosterCrawler:
+    """サイトプロファイルに従って名簿サイトを巡回する
+
+    on_log(message), on_progress(site_id, done, total) のコールバックで状況を通知する。
+    """
+
+    def __init__(self, snapshot=None, incremental=True, session=None, on_log=None, on_progress=None):
+        self.snapshot = snapshot  # SnapshotStore。Noneなら差分更新しない
+        self.incremental = incremental
+        self.stop_requested = False
+        self.rate_limiter = HostRateLimiter()
+        self.encoding_resolver = EncodingResolver()
+        self.on_log = on_log or (lambda message: None)
+        self.on_progress = on_progress or (lambda site_id, done, total: None)
+
+        # 接続を使い回すため、すべてのサイト・スレッドで1つのセッションを共有する
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=16)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def log(self, message):
+        self.on_log(message)
+
+    def stop(self):
+        """処理の中止を要求する"""
+        self.stop_requested = True
+
+    def request(self, profile, method, url, **kwargs):
+        """サイトのリクエスト間隔を守ってリクエストを送る"""
+        headers = {'User-Agent': DEFAULT_USER_AGENT}
+        headers.update(profile['headers'])
+        headers.update(kwargs.pop('headers', {}))
+        self.rate_limiter.wait(url, profile['request_interval'])
+        return self.session.request(method, url, headers=headers, timeout=10, **kwargs)
+
+    def decode(self, profile, response):
+        """レスポンスの本文を文字列にする（プロファイルに文字コードの指定がなければ自動判定）"""
+        if profile['encoding']:
+            response.encoding = profile['encoding']
+        else:
+            self.encoding_resolver.resolve_response(response)
+        return response.text
+
+    def fetch_listing(self, profile):
+        """検索フォームを送信し、詳細ページへのリンク(URL, リンクテキスト)の一覧を返す"""
+        if profile.get('prefetch_url'):
+            # セッションのクッキーなどを得るため、先に検索ページを開く
+            self.request(profile, 'GET', profile['prefetch_url'])
+
+        search = profile['search']
+        if search['method'].upper() == 'GET':
+            response = self.request(profile, 'GET', search['url'], params=search['data'])
+        else:
+            response = self.request(profile, 'POST', search['url'], data=search['data'],
+                                    headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        response.raise_for_status()
+
+        links = {}
+        for page_no in range(MAX_LISTING_PAGES):
+            page_url = response.url or search['url']
+            soup = BeautifulSoup(self.decode(profile, response), 'html.parser')
+            for url, link_text in collect_detail_links(soup, page_url, profile['detail_link_selector']):
+                if url not in links or (link_text and not links[url]):
+                    links[url] = link_text
+
+            # 検索結果が複数ページに分かれている場合は次のページをたどる
+            next_link = soup.select_one(profile['next_page_selector']) if profile.get('next_page_selector') else None
+            if next_link is None or not next_link.get('href') or self.stop_requested:
+                break
+            response = self.request(profile, 'GET', urljoin(page_url, next_link['href']))
+            response.raise_for_status()
+        return list(links.items())
+
+    def fetch_detail(self, profile, url, previous=None):
+        """詳細ページを取得して項目の値を返す
+
+        前回の取得結果(previous)があれば条件付きリクエストを送り、変更がなければ
+        (304またはハッシュが同じ)前回の値をそのまま使う。
+        戻り値はstatus('unchanged'/'changed'/'new'/'error')と項目の値などを持つdict。
+        """
+        result = {'status': 'error', 'fields': None, 'hash': None,
+                  'etag': None, 'last_modified': None, 'error': None}
+        try:
+            headers = {}
+            if previous:
+                if previous.get('etag'):
+                    headers['If-None-Match'] = previous['etag']
+                if previous.get('last_modified'):
+                    headers['If-Modified-Since'] = previous['last_modified']
+
+            if self.stop_requested:
+                result['error'] = "中止されました"
+                return result
+            response = self.request(profile, 'GET', url, headers=headers)
+
+            if previous and response.status_code == 304:
+                for key in ('fields', 'hash', 'etag', 'last_modified'):
+                    result[key] = previous.get(key)
+                result['status'] = 'unchanged'
+                return result
+            response.raise_for_status()
+
+            result['etag'] = response.headers.get('ETag')
+            result['last_modified'] = response.headers.get('Last-Modified')
+            result['hash'] = hashlib.sha256(response.content).hexdigest()
+            if previous and previous.get('hash') == result['hash']:
+                result['fields'] = previous.get('fields')
+                result['status'] = 'unchanged'
+                return result
+
+            soup = BeautifulSoup(self.decode(profile, response), 'html.parser')
+            result['fields'] = extract_fields(soup, profile['fields'])
+            result['status'] = 'changed' if previous else 'new'
+            return result
+
+        except Exception as e:
+            result['error'] = f"エラー: {str(e)}"
+            return result
+
+    def crawl_site(self, profile, output_path, diff_path=None):
+        """1つのサイトを巡回して結果をCSVに書き出す（終わった行から順に書き出す）
+
+        戻り値は状態ごとの件数。
+        """
+        site_id = profile['id']
+        field_names = list(profile['fields'])
+        self.log(f"=== {profile['name']}: 検索結果を取得 ===")
+        detail_links = self.fetch_listing(profile)
+        total_links = len(detail_links)
+        self.log(f"{profile['name']}: 詳細ページ {total_links} 件を処理します...")
+
+        # 前回の取得結果（差分更新の場合）
+        use_snapshot = self.snapshot is not None and self.incremental
+        old_entries = self.snapshot.site_entries(site_id) if use_snapshot else {}
+        if old_entries:
+            self.log(f"{profile['name']}: 前回の取得結果 {len(old_entries)} 件と比較し、変更されたページだけを抽出します")
+        new_entries = {}
+        counts = {'unchanged': 0, 'changed': 0, 'new': 0, 'error': 0}
+        completed = True
+
+        with open(output_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=['リンク名', 'URL'] + field_names)
+            writer.writeheader()
+
+            with ThreadPoolExecutor(max_workers=profile['max_workers']) as executor:
+                futures = {
+                    executor.submit(self.fetch_detail, profile, full_url, old_entries.get(full_url)):
+                        (i, full_url, link_text)
+                    for i, (full_url, link_text) in enumerate(detail_links)
+                }
+
+                done_count = 0
+                for future in as_completed(futures):
+                    i, full_url, link_text = futures[future]
+                    if not link_text:
+                        link_text = f"リンク {i+1}"
+
+                    result = future.result()
+                    done_count += 1
+                    counts[result['status']] += 1
+                    self.log(f"処理済み ({done_count}/{total_links}): {link_text} - {full_url}")
+
+                    # 結果を保存
+                    row = {'リンク名': link_text, 'URL': full_url}
+                    if result['fields']:
+                        row.update(result['fields'])
+                    else:
+                        row.update({name: result['error'] for name in field_names})
+                    writer.writerow(row)
+                    csvfile.flush()
+
+                    if result['status'] == 'error':
+                        # 取得に失敗したページは前回の結果を残しておく
+                        if full_url in old_entries:
+                            new_entries[full_url] = old_entries[full_url]
+                    else:
+                        new_entries[full_url] = {
+                            'site': site_id,
+                            'link_text': link_text,
+                            'fields': result['fields'],
+                            'hash': result['hash'],
+                            'etag': result['etag'],
+                            'last_modified': result['last_modified'],
+                            'last_seen': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        }
+
+                    self.on_progress(site_id, done_count, total_links)
+
+                    if self.stop_requested:
+                        self.log(f"{profile['name']}: 処理を中止しました")
+                        completed = False
+                        for pending in futures:
+                            pending.cancel()
+                        break
+
+        self.log(
+            f"{profile['name']}: 変更なし: {counts['unchanged']}件, 変更あり: {counts['changed']}件, "
+            f"新規: {counts['new']}件, エラー: {counts['error']}件"
+        )
+
+        if self.snapshot is not None:
+            for url, entry in new_entries.items():
+                self.snapshot.update(url, entry)
+            if completed:
+                # 名簿から消えたページは今回の結果から除く
+                self.snapshot.remove(url for url in self.snapshot.site_entries(site_id) if url not in new_entries)
+
+        if old_entries and diff_path:
+            diff = diff_snapshots(old_entries, new_entries, field_names, complete=completed)
+            fieldnames = ['種別', 'リンク名', 'URL']
+            for name in field_names:
+                fieldnames += [f'旧{name}', f'新{name}']
+            with open(diff_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(diff)
+            self.log(f"{profile['name']}: 前回からの差分 {len(diff)} 件を '{diff_path}' に保存しました")
+
+        return counts
+
+    def crawl_sites(self, profiles, output_dir, max_sites=8):
+        """複数のサイトを並行して巡回し、サイトごとのCSVを出力先ディレクトリに書き出す
+
+        各サイトはそれぞれのリクエスト間隔で巡回するため、全体の所要時間は
+        サイト数の合計ではなく、最も大きいサイトの所要時間に近づく。
+        戻り値は {サイトID: 状態ごとの件数またはエラー文字列}。
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_sites) as executor:
+            futures = {
+                executor.submit(
+                    self.crawl_site, profile,
+                    os.path.join(output_dir, f"{profile['id']}.csv"),
+                    os.path.join(output_dir, f"{profile['id']}_diff.csv"),
+                ): profile
+                for profile in profiles
+            }
+            for future in as_completed(futures):
+                profile = futures[future]
+                try:
+                    results[profile['id']] = future.result()
+                except Exception as e:
+                    self.log(f"{profile['name']}: エラーが発生しました: {str(e)}")
+                    results[profile['id']] = f"エラー: {str(e)}"
+        if self.snapshot is not None:
+            self.snapshot.save()
+        return results
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析する"""
+    parser = argparse.ArgumentParser(description="名簿サイトからFAX番号を集める（サイトプロファイル指定）")
+    parser.add_argument("profiles", nargs="+", help="サイトプロファイル(JSON)。複数指定できます")
+    parser.add_argument("-o", "--output-dir", default="output",
+                        help="サイトごとのCSVを書き出すディレクトリ（既定: output）")
+    parser.add_argument("--snapshot", help="前回の取得結果を保存するファイル（既定: 出力先/snapshot.json）")
+    parser.add_argument("--no-incremental", dest="incremental", action="store_false",
+                        help="前回の取得結果を使わず、すべてのページを抽出し直す")
+    parser.add_argument("--max-sites", type=int, default=8,
+                        help="並行して巡回するサイト数（既定: 8）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiles = [load_profile(path) for path in args.profiles]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    snapshot = SnapshotStore(args.snapshot or os.path.join(args.output_dir, 'snapshot.json'))
+    crawler = RosterCrawler(snapshot=snapshot, incremental=args.incremental,
+                            on_log=lambda message: print(message, flush=True))
+
+    # Ctrl+C では取得中のページを終えてから、それまでの結果を保存して終了する
+    def request_stop(signum, frame):
+        print("中止要求を受け付けました", file=sys.stderr, flush=True)
+        crawler.stop()
+
+    signal.signal(signal.SIGINT, request_stop)
+    results = crawler.crawl_sites(profiles, args.output_dir, max_sites=args.max_sites)
+    return 1 if any(isinstance(result, str) for result in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
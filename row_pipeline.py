@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""CSVの行を段階的に処理するパイプライン（読み込み → 有界キュー → 処理ワーカー → 書き込み）
+
+入力CSVを一度にメモリへ読み込まず、チャンクごとに読んだ行を上限付きのキューに流す。
+読み込みから書き込みまでの途中にある行の数にも上限を設けるため、処理や書き込みが遅れると
+読み込みが止まり（背圧）、メモリ使用量は入力の行数によらず一定に収まる。
+
+書き込みは入力の順番どおり（ordered=True。先に終わった行は前の行が終わるまで待たせる）か、
+終わった順（ordered=False）を選べる。終わった順で書く場合は行番号の列を付けておけば、
+あとから入力の順番に並べ直せる。処理の途中で後回しにした行（RetryLater）は、
+キューにある新しい行がなくなったところで処理し直す。
+
+    python row_pipeline.py --benchmark 1000000   # 擬似データでの行数の数え上げ・処理速度・メモリ使用量
+"""
+
+import argparse
+import csv
+import os
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+# 入力CSVを一度に読む行数
+CHUNK_ROWS = 10000
+# 行数を数えるときに一度に読むバイト数
+COUNT_BLOCK_BYTES = 1 << 20
+# 読み込みと処理ワーカーの間のキューの長さ
+DEFAULT_QUEUE_SIZE = 64
+# 入力の何行目か（1から数える）を入れる列。終わった順に書いた結果を元の順番に戻すのに使う
+ROW_NUMBER_COLUMN = '行番号'
+# 空白だけの行（pandasが読み飛ばす）の末尾の改行の手前の改行に一致する
+BLANK_LINE_RE = re.compile(rb'\n(?=[ \t\r]*\n)')
+# 空行があるかだけを確かめる（先読みを使わないほうが速い）
+HAS_BLANK_LINE_RE = re.compile(rb'\n[ \t\r]*\n')
+# ブロックの先頭が、前のブロックから続く空白だけの行の終わりになっている
+LEADING_BLANK_RE = re.compile(rb'[ \t\r]*\n')
+
+# 処理待ちのキューの優先度（小さいほど先に取り出す）。後回しにした行は新しい行より後、終了の合図より前
+_NEW = 0
+_RETRY = 1
+_DONE_PRIORITY = 2
+_DONE = object()
+
+
+class RetryLater(Exception):
+    """handleが投げると、その行を新しい行より後回しにして処理し直す"""
+
+
+def read_csv_strings(path, **kwargs):
+    """CSVをDataFrameで読む
+
+    値はすべて文字列として読み（郵便番号などの先頭の0や数値の書式を変えない）、
+    空の値だけを欠損として扱う（「NA」という名前などを欠損にしない）。
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''], **kwargs)
+
+
+def read_csv_chunks(path, chunk_rows=CHUNK_ROWS, **kwargs):
+    """CSVをchunk_rows行ずつのDataFrameで返す（値の扱いはread_csv_stringsと同じ）"""
+    return read_csv_strings(path, chunksize=chunk_rows, **kwargs)
+
+
+def read_csv_columns(path):
+    """CSVの見出しの列名のリスト"""
+    return list(pd.read_csv(path, dtype=str, nrows=0).columns)
+
+
+def count_csv_rows(path, block_size=COUNT_BLOCK_BYTES):
+    """見出しを除いたCSVの行数を、ファイルをパースせずに改行を数えて求める
+
+    引用符で囲まれた値の中の改行は数えない（ブロックを引用符で区切り、
+    引用符の外側の部分の改行だけを数える。""のエスケープは引用符が2回続くだけなので同じ扱いでよい）。
+    pandas（iter_csv_rows）と同じく、空白だけの行は数えない。空行は引用符を含まないため、
+    ブロックの中では引用符の外側の部分ごとに、ブロックの境目では前後の端を見て数える。
+    空行の有無はブロックごとに正規表現の検索1回で確かめ、引用符も空行もないブロックは改行を数えるだけで
+    済むため、数GBのファイルでも数秒で終わる。
+    """
+    newlines = 0
+    blanks = 0
+    quoted = False
+    line_blank = True  # 直前の改行（かファイルの先頭）から空白しかない
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            # 前のブロックの末尾から続く行が、このブロックの先頭で空行として終わる
+            if not quoted and line_blank and LEADING_BLANK_RE.match(block):
+                blanks += 1
+            parts = [block] if not quoted and b'"' not in block else block.split(b'"')
+            has_blank = HAS_BLANK_LINE_RE.search(block) is not None
+            for part in parts:
+                if not quoted:
+                    newlines += part.count(b'\n')
+                    if has_blank:
+                        blanks += len(BLANK_LINE_RE.findall(part))
+                quoted = not quoted
+            # 区切りの数は部分の数より1つ少ないため、最後の切り替えを戻す
+            quoted = not quoted
+            if quoted:
+                line_blank = False
+            else:
+                _, newline, tail = parts[-1].rpartition(b'\n')
+                blank_tail = not tail.strip(b' \t\r')
+                line_blank = blank_tail if newline else (line_blank and len(parts) == 1 and blank_tail)
+    if not line_blank:
+        newlines += 1  # 最後の行に改行がない
+    return max(newlines - blanks - 1, 0)
+
+
+def iter_csv_rows(path, start=0, chunk_rows=CHUNK_ROWS):
+    """CSVの行を(行番号, {列名: 値})で順に返す。欠損はNone、行番号は0から数える"""
+    index = 0
+    for chunk in read_csv_chunks(path, chunk_rows):
+        if index + len(chunk) <= start:
+            index += len(chunk)
+            continue
+        columns = list(chunk.columns)
+        for values in chunk.itertuples(index=False, name=None):
+            if index >= start:
+                yield index, {column: (None if pd.isna(value) else value)
+                              for column, value in zip(columns, values)}
+            index += 1
+
+
+class CsvRowWriter:
+    """行（{列名: 値}）をCSVに追記していく書き込み
+
+    appendがFalseなら見出しから書き始め、Trueなら既存のファイルの末尾に追記する。
+    列にない値は書かず、Noneは空欄になる（pandasのto_csvと同じ形式）。
+    """
+
+    def __init__(self, path, columns, append=False):
+        self.path = path
+        self.columns = list(columns)
+        self.rows_written = 0
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file, lineterminator=os.linesep)
+        if not append:
+            self._writer.writerow(self.columns)
+
+    def write(self, row):
+        self._writer.writerow([row.get(column) for column in self.columns])
+        self.rows_written += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class RowPipeline:
+    """行を読み込み・処理・書き込みの段階に分けて並行して流す
+
+    handle(index, row) は処理ワーカーのスレッドで呼ばれ、戻り値がそのまま
+    write(index, result) に渡される。writeはrun()を呼んだスレッドだけで呼ばれる。
+    handleが例外を投げた行は (row, False) を書き込み、最初の例外をrun()の最後に投げ直す。
+    RetryLaterを投げた行は処理待ちのキューの後ろの優先度で入れ直す（何度入れ直すかはhandleが決める）。
+    入れ直した行も読み込みから書き込みまでの行数の上限に含まれるため、順番どおりに書く場合でも
+    メモリ使用量は増えない（上限に達して読み込みが止まると、キューが空になって後回しの行が処理される）。
+    """
+
+    def __init__(self, handle, write, workers=1, queue_size=DEFAULT_QUEUE_SIZE, ordered=True):
+        self.handle = handle
+        self.write = write
+        self.workers = max(workers, 1)
+        self.queue_size = max(queue_size, 1)
+        self.ordered = ordered
+        # 読み込んでまだ書き込んでいない行の上限（キューの分と、各ワーカーが処理中の分）
+        self.max_in_flight = self.queue_size + self.workers
+        self.in_flight = 0  # 読み込み済みで書き込み前の行数
+        self.buffered = 0  # 順番待ちで書き込みを待たせている行数
+        self.requeued = 0  # 後回しにして入れ直した回数
+        self.error = None
+        self._slots = threading.Semaphore(self.max_in_flight)
+        # キューの長さは読み込みから書き込みまでの行数の上限で抑える（後回しの行を入れ直すときに待たせない）
+        self._work = queue.PriorityQueue()
+        self._done = queue.Queue()
+        self._closing = threading.Event()
+        self._lock = threading.Lock()
+
+    def _fail(self, error):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def _read(self, rows):
+        try:
+            for seq, (index, row) in enumerate(rows):
+                # 書き込みが追いつくまで次の行を読まない
+                while not self._slots.acquire(timeout=0.5):
+                    if self._closing.is_set():
+                        return
+                with self._lock:
+                    self.in_flight += 1
+                self._work.put((_NEW, seq, index, row))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for worker in range(self.workers):
+                self._work.put((_DONE_PRIORITY, worker, None, _DONE))
+
+    def _work_loop(self):
+        while True:
+            _, seq, index, row = self._work.get()
+            if row is _DONE:
+                self._done.put(_DONE)
+                return
+            if self._closing.is_set():
+                # 書き込みが止まった後は、キューに残った行を処理せずに読み捨てる
+                continue
+            try:
+                result = self.handle(index, row)
+            except RetryLater:
+                with self._lock:
+                    self.requeued += 1
+                self._work.put((_RETRY, seq, index, row))
+                continue
+            except Exception as e:
+                self._fail(e)
+                result = (row, False)
+            self._done.put((seq, index, result))
+
+    def _write_one(self, index, result):
+        self.write(index, result)
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def run(self, rows):
+        """rows（(行番号, 行)の列）をすべて処理して書き込む"""
+        threads = [threading.Thread(target=self._read, args=(rows,), name='pipeline-reader', daemon=True)]
+        threads += [threading.Thread(target=self._work_loop, name=f'pipeline-worker-{i}', daemon=True)
+                    for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        pending = {}  # 順番待ちの行 {通し番号: (行番号, 結果)}
+        next_seq = 0
+        finished = 0
+        try:
+            while finished < self.workers:
+                item = self._done.get()
+                if item is _DONE:
+                    finished += 1
+                    continue
+                seq, index, result = item
+                if not self.ordered:
+                    self._write_one(index, result)
+                    continue
+                pending[seq] = (index, result)
+                while next_seq in pending:
+                    self._write_one(*pending.pop(next_seq))
+                    next_seq += 1
+                self.buffered = len(pending)
+        finally:
+            # 書き込みで例外が出た場合も読み込みスレッドを止める
+            self._closing.set()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def _benchmark(rows, workers=4, queue_size=DEFAULT_QUEUE_SIZE, ordered=True, log=print):
+    """擬似的な名簿CSVの行数の数え上げと、パイプラインに流したときの処理速度と最大メモリ使用量を測る"""
+    import random
+    import tracemalloc
+
+    work_dir = tempfile.mkdtemp(prefix='row_pipeline_')
+    input_path = os.path.join(work_dir, 'input.csv')
+    output_path = os.path.join(work_dir, 'output.csv')
+    rng = random.Random(0)
+    with open(input_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(['施設名', '住所', 'FAX番号'])
+        for i in range(rows):
+            writer.writerow([f"施設{i}クリニック", f"横浜市鶴見区{rng.randint(1, 99)}-{i}", ''])
+    log(f"入力: {rows}行 {os.path.getsize(input_path) / 1024 / 1024:.1f}MB")
+
+    def handle(index, row):
+        # 処理時間がばらつくと、順番どおりの書き込みでは先に終わった行が待たされる
+        if index % 1000 == 0:
+            time.sleep(0.001)
+        row['FAX番号'] = f"045-{index % 1000:03d}-{index % 10000:04d}"
+        return row, True
+
+    def run_once():
+        writer = CsvRowWriter(output_path, ['施設名', '住所', 'FAX番号'])
+        pipeline = RowPipeline(handle, lambda index, result: writer.write(result[0]),
+                               workers=workers, queue_size=queue_size, ordered=ordered)
+        pipeline.run(iter_csv_rows(input_path))
+        writer.close()
+        return writer.rows_written
+
+    def measure(func):
+        """(戻り値, 秒, 最大メモリのバイト数)。tracemallocは処理を遅くするため、時間とは別に測る"""
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    try:
+        # GUIで名簿を開いたときの件数表示: 改行を数える場合と、pandasで全体を読み込む場合
+        counted, count_seconds, count_peak = measure(lambda: count_csv_rows(input_path))
+        loaded, load_seconds, load_peak = measure(lambda: len(pd.read_csv(input_path)))
+        log(f"行数の数え上げ: {counted}行 {count_seconds * 1000:.0f}ms 最大メモリ {count_peak / 1024 / 1024:.1f}MB"
+            f"（pandasで全体を読む場合: {loaded}行 {load_seconds * 1000:.0f}ms 最大メモリ "
+            f"{load_peak / 1024 / 1024:.1f}MB）")
+
+        written, elapsed, peak = measure(run_once)
+        log(f"{'ordered' if ordered else 'unordered'}: {written}行 {elapsed:.2f}秒 "
+            f"({written / elapsed:.0f}行/秒)  最大メモリ {peak / 1024 / 1024:.1f}MB")
+    finally:
+        for path in (input_path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(work_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CSVの行を段階的に処理するパイプラインの計測")
+    parser.add_argument("--benchmark", type=int, default=100000, metavar="ROWS",
+                        help="擬似データの行数（既定: 100000）")
+    parser.add_argument("--workers", type=int, default=4, help="処理ワーカーのスレッド数（既定: 4）")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"キューの長さ（既定: {DEFAULT_QUEUE_SIZE}）")
+    parser.add_argument("--unordered", dest="ordered", action="store_false",
+                        help="終わった順に書き込む")
+    args = parser.parse_args(argv)
+    _benchmark(args.benchmark, workers=args.workers, queue_size=args.queue_size, ordered=args.ordered)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1010 @@
+# -*- coding: utf-8 -*-
+"""クリニックFAX番号収集の処理本体（Qtに依存しない）
+
+GUI（fax_scraper_qt.py）とコマンドライン（fax_scraper_cli.py）の両方から使う。
+進捗やログはpyqtSignalではなくコールバックで通知する。
+"""
+
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import random
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+from googlesearch import search
+
+from cross_reference import CrossReference, load_pdf_results
+from encoding_resolver import EncodingResolver
+from fax_extractor import DETAIL_HOP_CONFIDENCE, extract_page
+from metrics import NullMetrics
+from name_matcher import TITLE_THRESHOLD, NameIndex
+from phone_normalizer import normalize_phone
+from row_pipeline import DEFAULT_QUEUE_SIZE, ROW_NUMBER_COLUMN, CsvRowWriter, RetryLater, RowPipeline, \
+    count_csv_rows, iter_csv_rows, read_csv_chunks, read_csv_columns
+from site_memo import SiteMemo
+from stage_timing import StageTimer
+
+
+# ログファイルのローテート設定
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 5
+
+# 処理結果を書き込む列
+RESULT_COLUMNS = ['FAX番号', 'エラー詳細', '取得元', '信頼度']
+# 書き込み途中の出力のファイル名（出力先の名前に付ける）。最後まで書き終えたら出力先に置き換える
+PARTIAL_SUFFIX = '.partial'
+# この行数を処理するごとに書き込み途中の出力をディスクに書き出す
+SAVE_EVERY_ROWS = 10
+# 名前の照合に使う名簿の索引に入れる件数の上限（語の重みの推定には十分で、メモリを抑えられる）
+NAME_INDEX_MAX_NAMES = 100000
+# 1行の処理の持ち時間（秒。検索前などの待機は含めない）。超えた行は後回しにして1回だけ処理し直す
+ROW_TIMEOUT_SECONDS = 120
+# ページ取得1回のタイムアウト（秒。行の持ち時間の残りがこれより短ければ残りに合わせる）
+REQUEST_TIMEOUT_SECONDS = 10
+# 取得・検索・解析の完了を待つ間に、中止の要求と行の持ち時間を確かめる間隔（秒）
+CANCEL_POLL_SECONDS = 0.1
+
+
+def open_log_file(log_path):
+    """ローテートするログファイルに書き出すロガーを返す"""
+    logger = logging.getLogger(f"fax_scraper.{os.path.abspath(log_path)}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(
+            log_path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+def close_log_file(logger):
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def _init_parse_worker():
+    """解析プロセスの初期化: Ctrl+Cは親プロセスだけが受けて中止処理を行う"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class RowInterrupted(Exception):
+    """行の処理を途中でやめる（中止の要求か、行の持ち時間切れ）"""
+
+
+class RowCancelled(RowInterrupted):
+    """中止が要求された"""
+
+
+class RowTimeout(RowInterrupted):
+    """行の持ち時間を使い切った"""
+
+
+def submit_daemon(func, name=None):
+    """funcを使い捨てのデーモンスレッドで実行し、結果を受け取るFutureを返す
+
+    googlesearchの検索にはタイムアウトがなく、打ち切った検索がいつまでも終わらないことがある。
+    共有のスレッドで行うと後の行の検索がその後ろで待たされるため、検索ごとにスレッドを分ける
+    （終わらない検索が残っていても、後の行の検索とプロセスの終了は妨げない）。
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+class PageCache:
+    """取得したページと検索結果をディスクに保存する簡易キャッシュ
+
+    再実行や中断後の再開では、保存済みのページを読み込むだけで済むため、
+    ネットワークを待たずに解析処理だけを行える。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(os.path.join(cache_dir, 'pages'), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, 'search'), exist_ok=True)
+
+    def _path(self, kind, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, kind, digest)
+
+    def _write(self, path, data):
+        # 書き込み途中のファイルを読まないよう、一時ファイルから置き換える
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get_page(self, url):
+        """保存済みのページを(バイト列, 文字コード)で返す。なければNone"""
+        path = self._path('pages', url)
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(path + '.body', 'rb') as f:
+                return f.read(), meta.get('encoding')
+        except (OSError, ValueError):
+            return None
+
+    def put_page(self, url, content, encoding):
+        path = self._path('pages', url)
+        self._write(path + '.body', content)
+        meta = {'url': url, 'encoding': encoding, 'fetched_at': time.time()}
+        self._write(path + '.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def get_search(self, query):
+        """保存済みの検索結果(URLのリスト)を返す。なければNone"""
+        try:
+            with open(self._path('search', query) + '.json', encoding='utf-8') as f:
+                return json.load(f)['results']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put_search(self, query, results):
+        data = {'query': query, 'results': results, 'searched_at': time.time()}
+        self._write(self._path('search', query) + '.json',
+                    json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+class ScraperEngine:
+    """CSVのクリニック名からFAX番号を探してCSVに書き込む
+
+    on_log(message), on_progress(clinic_name, current, total), on_error(message)
+    のコールバックで状況を通知する。stop()で待機と取得の完了待ちをすぐにやめ、処理中の行も
+    処理前のまま書いて中断する（次の実行でその行から再開する）。
+
+    1行の処理には持ち時間（row_timeout秒。検索前などの待機は含めない）があり、使い切った行は
+    後回しにして、キューにある新しい行がなくなったところで1回だけ処理し直す。
+
+    入力はrow_pipelineでチャンクごとに読み、row_workers件の行を並行して処理しながら
+    書き込み途中の出力（出力先 + PARTIAL_SUFFIX）に追記していく。読み込みから書き込みまでの
+    行数には上限があるため、名簿の大きさによらずメモリ使用量は一定に収まる。
+    """
+
+    def __init__(self, csv_path, output_path=None, render_js=False, fetch_workers=4,
+                 parse_workers=None, cache_dir=None, resume=True, log_path=None,
+                 trace_path=None, metrics=None, profiler=None, slow_row_seconds=None,
+                 http_get=None, search_backend=None, pace_requests=True, pdf_results=None,
+                 row_workers=1, queue_size=DEFAULT_QUEUE_SIZE, ordered=True, site_memo_path=None,
+                 row_timeout=ROW_TIMEOUT_SECONDS, on_log=None, on_progress=None, on_error=None):
+        self.csv_path = csv_path
+        self.output_path = output_path or csv_path  # 指定がなければ入力ファイルに書き戻す
+        self.render_js = render_js  # JavaScriptで描画されるページをブラウザで描画するか
+        self.resume = resume  # 前回の処理済み位置から再開するか
+        self.stop_event = threading.Event()  # 中止の要求（待機と取得の完了待ちをすぐに終わらせる）
+        self.row_timeout = row_timeout or None  # 1行の処理の持ち時間（秒）。0かNoneなら制限しない
+        self.retried_rows = set()  # 持ち時間を使い切って後回しにした行の行番号
+        self.retry_delay = 15  # 基本待機時間を15秒に増加
+        self.max_retries = 3  # 最大リトライ回数
+        self.fetch_workers = fetch_workers  # ページ取得を並行して行うスレッド数
+        # HTML解析を行うプロセス数（0なら取得したスレッドでそのまま解析する）
+        self.parse_workers = (os.cpu_count() or 1) if parse_workers is None else parse_workers
+        self.render_pool_size = 2  # 使い回すヘッドレスブラウザの数
+        # 並行して処理する行数（検索は1件ずつ順に行い、その間に他の行のページを取得する）
+        self.row_workers = row_workers
+        self.queue_size = queue_size  # 読み込んだ行を処理待ちにしておく件数の上限
+        # Trueなら入力の順番どおりに書き込む。Falseなら終わった順に書き込み、行番号の列を付ける
+        self.ordered = ordered
+        self.candidate_window = 2  # 検索結果の候補ページを判定する先まで先読みして取得する件数
+        self.name_index = NameIndex()  # 実行時に入力CSVのクリニック名から作る
+        self.cache = PageCache(cache_dir) if cache_dir else None
+        # ホストとテンプレートごとにFAX番号が見つかった場所の記録（次の実行でも使う）
+        self.site_memo_path = site_memo_path
+        self.site_memo = None
+        self.encoding_resolver = EncodingResolver()
+        self.log_path = log_path  # 指定があれば全件のログをファイルにも書き出す
+        self.file_logger = None
+        self.trace_path = trace_path  # 指定があれば段階ごとの所要時間をJSONLで書き出す
+        self.timer = StageTimer()
+        self.metrics = metrics or NullMetrics()  # metrics.MetricsRegistryを渡すと実行状況を公開する
+        self.init_metrics()
+        self.profiler = profiler  # profiling.RunProfilerを渡すと取得スレッドの処理もプロファイルする
+        self.slow_row_seconds = slow_row_seconds  # 待機を除いてこの秒数以上かかった行をログに出す
+        self.row_state = threading.local()  # 処理中の行ごとの待機時間（行は複数のスレッドで並行して処理する）
+        self.search_lock = threading.Lock()  # 検索は並行させず、待機を挟んで1件ずつ行う
+        self.count_lock = threading.Lock()
+        # ページ取得と検索の実体（http_replayで記録・再生するときに差し替える）
+        self.http_get = http_get or requests.get
+        self.search_backend = search_backend or search
+        self.pace_requests = pace_requests  # 検索前と行ごとの待機を行うか（再生時は不要）
+        # pdf_to_text.pyの出力CSV（*_fax_numbers.csv）のリスト。載っている施設は検索せずにその番号を使う
+        self.pdf_results = list(pdf_results or [])
+        self.pdf_index = None
+        self.name_column = None
+        self.total = 0
+        self.start_index = 0
+        self.pipeline = None
+        self.writer = None
+        self.unsaved_rows = 0
+        self.io_pool = None
+        self.parse_pool = None
+        self.browser_pool = None
+
+        self.on_log = on_log or (lambda message: None)
+        self.on_progress = on_progress or (lambda clinic_name, current, total: None)
+        self.on_error = on_error or (lambda message: None)
+
+        # 一般的なUser-Agentリスト
+        self.user_agents = [
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Safari/605.1.15',
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
+            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36',
+            'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36',
+            'Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1',
+            'Mozilla/5.0 (iPad; CPU OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1',
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 Edg/91.0.864.48'
+        ]
+
+    def init_metrics(self):
+        """公開するメトリクスを登録する（無効時はすべて何もしないオブジェクトになる）"""
+        metrics = self.metrics
+        self.rows_done = 0
+        self.run_started = time.monotonic()
+        self.metric_rows = metrics.counter(
+            'clinic_rows_total', '処理した行数（result: found/pdf/not_found/error/timeout/skipped）', ('result',))
+        self.metric_requeued = metrics.counter(
+            'clinic_rows_requeued_total', '持ち時間を使い切って後回しにした行数')
+        metrics.gauge('clinic_rows_per_minute', '実行開始からの1分あたりの処理行数').set_function(
+            lambda: self.rows_done * 60 / max(time.monotonic() - self.run_started, 1e-9))
+        self.metric_stage_seconds = metrics.histogram(
+            'clinic_stage_seconds', '処理段階ごとの所要時間（秒）', ('stage',))
+        self.metric_cache = metrics.counter(
+            'clinic_cache_requests_total', 'キャッシュの参照回数（kind: page/search, result: hit/miss）',
+            ('kind', 'result'))
+        metrics.gauge('clinic_cache_hit_ratio', 'キャッシュのヒット率').set_function(self.cache_hit_ratio)
+        self.metric_patterns = metrics.counter(
+            'clinic_fax_pattern_hits_total', 'FAX番号を検出したパターンごとの件数', ('pattern',))
+        self.metric_detail_hops = metrics.counter(
+            'clinic_detail_hops_total', '詳細ページを取得した回数（reason: not_found/low_confidence）', ('reason',))
+        self.metric_site_memo = metrics.counter(
+            'clinic_site_memo_total', '記録した場所でFAX番号を探した回数（result: hit/miss）', ('result',))
+        self.metric_rate_limited = metrics.counter(
+            'clinic_search_rate_limited_total', '検索でリクエスト制限(429)を受けた回数')
+        self.metric_candidates = metrics.counter(
+            'clinic_candidate_pages_total',
+            '検索結果の候補ページの扱い（result: accepted/rejected/error/not_fetched）', ('result',))
+        self.metric_queue_depth = metrics.gauge(
+            'clinic_queue_depth', '投入済みで完了していない処理の数（pool: fetch/parse）', ('pool',))
+        metrics.gauge('clinic_rows_in_flight', '入力から読み込み、まだ出力に書き込んでいない行数').set_function(
+            lambda: self.pipeline.in_flight if self.pipeline is not None else 0)
+
+    def cache_hit_ratio(self):
+        hits = sum(self.metric_cache.get(kind=kind, result='hit') for kind in ('page', 'search'))
+        misses = sum(self.metric_cache.get(kind=kind, result='miss') for kind in ('page', 'search'))
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def log_if_slow(self, clinic_name, index, elapsed):
+        """待機を除いた処理時間がしきい値を超えた行をログに出す"""
+        working = elapsed - self.row_wait_seconds
+        if self.slow_row_seconds is not None and working >= self.slow_row_seconds:
+            self.log(f"処理に時間がかかった行: {clinic_name} ({index + 1}件目, "
+                     f"{working:.1f}秒, 待機 {self.row_wait_seconds:.1f}秒を除く)")
+
+    def count_row(self, result):
+        with self.count_lock:
+            self.rows_done += 1
+        self.metric_rows.inc(result=result)
+
+    def track_queue(self, future, pool):
+        """完了するまでの間、キューの長さのゲージに数える"""
+        self.metric_queue_depth.inc(pool=pool)
+        future.add_done_callback(lambda f: self.metric_queue_depth.dec(pool=pool))
+        return future
+
+    def profile_section(self):
+        return self.profiler.section() if self.profiler is not None else nullcontext()
+
+    def call_profiled(self, func, *args):
+        """スレッドプール上の処理をそのスレッドのプロファイルに記録する"""
+        with self.profile_section():
+            return func(*args)
+
+    @property
+    def row_wait_seconds(self):
+        """このスレッドで処理中の行の待機時間の合計"""
+        return getattr(self.row_state, 'wait_seconds', 0.0)
+
+    @row_wait_seconds.setter
+    def row_wait_seconds(self, seconds):
+        self.row_state.wait_seconds = seconds
+
+    def wait(self, seconds):
+        """検索前後の待機。行の処理時間から除くために合計を記録する。中止を要求されたらすぐにやめる"""
+        started = time.perf_counter()
+        stopped = self.stop_event.wait(seconds)
+        self.row_wait_seconds += time.perf_counter() - started
+        if stopped:
+            raise RowCancelled("中止が要求されました")
+
+    def start_row_clock(self, started=None):
+        """このスレッドで処理する行の持ち時間を数え始める（Noneを渡すと数えるのをやめる）"""
+        self.row_wait_seconds = 0.0
+        self.row_state.started = started
+
+    def row_remaining(self):
+        """このスレッドで処理中の行の持ち時間の残り（秒）。持ち時間がなければNone"""
+        started = getattr(self.row_state, 'started', None)
+        if self.row_timeout is None or started is None:
+            return None
+        return self.row_timeout - (time.perf_counter() - started - self.row_wait_seconds)
+
+    def check_row(self):
+        """中止が要求されていればRowCancelled、行の持ち時間を使い切っていればRowTimeoutを投げる"""
+        if self.stop_event.is_set():
+            raise RowCancelled("中止が要求されました")
+        remaining = self.row_remaining()
+        if remaining is not None and remaining <= 0:
+            raise RowTimeout(f"{self.row_timeout}秒の持ち時間を超えました")
+
+    def request_timeout(self):
+        """ページ取得1回のタイムアウト（行の持ち時間の残りを超えない）"""
+        remaining = self.row_remaining()
+        if remaining is None:
+            return REQUEST_TIMEOUT_SECONDS
+        return max(min(REQUEST_TIMEOUT_SECONDS, remaining), CANCEL_POLL_SECONDS)
+
+    def await_result(self, future):
+        """スレッドプール・プロセスプールに渡した処理の結果を待つ
+
+        取得中の通信はほかのスレッドから止められないため、中止の要求か行の持ち時間切れで
+        待つのをやめて例外を投げる（残った通信はタイムアウトまでに終わり、結果は捨てられる）。
+        """
+        while True:
+            self.check_row()
+            try:
+                return future.result(timeout=CANCEL_POLL_SECONDS)
+            except FutureTimeoutError:
+                pass
+
+    def log(self, message):
+        if self.file_logger is not None:
+            self.file_logger.info(message)
+        self.on_log(message)
+
+    @property
+    def stop_requested(self):
+        return self.stop_event.is_set()
+
+    @stop_requested.setter
+    def stop_requested(self, value):
+        if value:
+            self.stop_event.set()
+        else:
+            self.stop_event.clear()
+
+    def stop(self):
+        """処理の中止を要求する"""
+        self.stop_event.set()
+
+    def get_random_user_agent(self):
+        """ランダムなUser-Agentを返す"""
+        return random.choice(self.user_agents)
+
+    def search_with_retry(self, query, retry_count=0, row=None):
+        """Google検索を実行し、ネットワークエラーのみリトライする"""
+        try:
+            # 検索実行前に待機（リトライ回数に応じて待機時間を増加）
+            if self.pace_requests:
+                wait_time = self.retry_delay * (2 ** retry_count) + random.uniform(1, 5)  # ランダム要素を追加
+                self.log(f"- 検索前に {wait_time:.1f}秒待機します...")
+                with self.timer.span('pre_search_wait', row=row, retry=retry_count):
+                    self.wait(wait_time)
+            
+            # Google検索を実行
+            headers = {'User-Agent': self.get_random_user_agent()}
+            self.log(f"- ランダムなUser-Agentを使用: {headers['User-Agent'][:30]}...")
+            with self.timer.span('search', row=row, retry=retry_count) as span:
+                # 中止と持ち時間切れで待つのをやめられるよう、検索は別スレッドで行う
+                future = submit_daemon(
+                    lambda: list(self.search_backend(query, num=1, user_agent=headers['User-Agent'])), 'search')
+                search_results = self.await_result(future)
+                span['results'] = len(search_results)
+            
+            if search_results:
+                return search_results
+            else:
+                raise Exception("検索結果が0件でした")
+
+        except RowInterrupted:
+            raise
+
+        except requests.exceptions.HTTPError as e:
+            # 429エラー（Too Many Requests）の場合は長めに待機
+            if "429" in str(e):
+                if retry_count < self.max_retries:
+                    # 待機時間を一律10分に設定
+                    wait_time = 600  # 10分
+                    
+                    self.metric_rate_limited.inc()
+                    self.log(f"- リクエスト制限エラー(429): {str(e)}")
+                    self.log(f"- {wait_time}秒（10分）待機します... ({retry_count + 1}/{self.max_retries})")
+                    self.wait(wait_time)  # 待機
+                    return self.search_with_retry(query, retry_count + 1, row)
+                else:
+                    raise Exception(f"リクエスト制限エラーが続いています: {str(e)}")
+            else:
+                # その他のHTTPエラー
+                raise Exception(f"HTTPエラー: {str(e)}")
+                
+        except requests.exceptions.RequestException as e:
+            # ネットワークエラーのみリトライ
+            if retry_count < self.max_retries:
+                wait_time = self.retry_delay * (2 ** retry_count)
+                self.log(f"- ネットワークエラー: {str(e)}")
+                self.log(f"- リトライします... {wait_time}秒後 ({retry_count + 1}/{self.max_retries})")
+                self.wait(wait_time)  # 追加で待機
+                return self.search_with_retry(query, retry_count + 1, row)
+            else:
+                raise Exception(f"ネットワークエラーが続いています: {str(e)}")
+                
+        except Exception as e:
+            # その他のエラーはリトライせずに例外を投げる
+            if "Too Many Requests" in str(e) or "429" in str(e):
+                if retry_count < self.max_retries + 2:  # 最大リトライ回数を増やす
+                    # 待機時間を一律10分に設定
+                    wait_time = 600  # 10分
+                        
+                    self.metric_rate_limited.inc()
+                    self.log(f"- リクエスト制限エラー: {str(e)}")
+                    self.log(f"- {wait_time}秒（10分）待機します... ({retry_count + 1}/{self.max_retries + 2})")
+                    self.wait(wait_time)
+                    return self.search_with_retry(query, retry_count + 1, row)
+                else:
+                    raise Exception(f"リクエスト制限エラーが続いています: {str(e)}")
+            else:
+                raise Exception(f"検索に失敗しました: {str(e)}")
+
+    def search(self, query, row=None):
+        """検索結果のURLのリストを返す。キャッシュがあれば検索（と検索前の待機）を省略する"""
+        if self.cache:
+            cached = self.cache.get_search(query)
+            self.metric_cache.inc(kind='search', result='miss' if cached is None else 'hit')
+            if cached is not None:
+                self.log("- キャッシュ済みの検索結果を使用します")
+                return cached
+
+        # 他の行の検索（と検索前の待機）が終わるのを待つ時間も待機に数える
+        lock_started = time.perf_counter()
+        with self.search_lock:
+            self.row_wait_seconds += time.perf_counter() - lock_started
+            self.check_row()  # 待っている間に中止が要求されていれば検索しない
+            search_results = self.search_with_retry(query, row=row)
+        if self.cache and search_results:
+            self.cache.put_search(query, search_results)
+        return search_results
+
+    def fetch_and_extract(self, url, clinic_name, row=None, stage='candidate_fetch',
+                          timeout=REQUEST_TIMEOUT_SECONDS):
+        """ページを取得し、解析と抽出をプロセスプールに渡して結果レコードを返す
+
+        I/Oスレッドプール上で実行される。スレッドは取得したバイト列を渡すだけで、
+        BeautifulSoupの解析はGILの外（別プロセス）で行われる。
+        stageは所要時間を記録する段階名（候補ページはcandidate_fetch、詳細ページはdetail_fetch）。
+        timeoutは取得のタイムアウト（秒。行の持ち時間の残りに合わせて行のスレッドが決める）。
+        """
+        host = urlparse(url).netloc
+        with self.timer.span(stage, row=row, host=host) as span:
+            cached = self.cache.get_page(url) if self.cache else None
+            if self.cache:
+                self.metric_cache.inc(kind='page', result='hit' if cached else 'miss')
+            if cached:
+                content, encoding = cached
+            else:
+                headers = {'User-Agent': self.get_random_user_agent()}
+                response = self.http_get(url, timeout=timeout, headers=headers)
+                response.raise_for_status()  # ステータスコードチェック
+                content = response.content
+                # 文字コードはヘッダー・meta・ホストごとの記録から決め、BeautifulSoupに本文全体を判定させない
+                encoding = self.encoding_resolver.resolve(url, content, response.headers.get('Content-Type'))
+                if self.cache:
+                    self.cache.put_page(url, content, encoding)
+            span['bytes'] = len(content)
+            span['cached'] = bool(cached)
+
+        return self.parse_page(content, clinic_name, url, encoding, row, host)
+
+    def parse_page(self, content, clinic_name, url, encoding, row, host):
+        """解析と抽出をプロセスプールで行い、結果レコードを返す"""
+        name_weights = self.name_index.weights(clinic_name)
+        hints = self.site_memo.hints(host) if self.site_memo is not None else None
+        if self.parse_pool is None:
+            page = extract_page(content, clinic_name, url, encoding, name_weights, hints)
+        else:
+            future = self.track_queue(
+                self.parse_pool.submit(extract_page, content, clinic_name, url, encoding, name_weights, hints),
+                'parse')
+            page = self.await_result(future)
+        self.record_extract_timings(page, row, host)
+        if self.site_memo is not None:
+            self.site_memo.record(host, page)
+            if page['memo']:
+                self.metric_site_memo.inc(result=page['memo'])
+        return page
+
+    def record_extract_timings(self, page, row, host):
+        """解析プロセスで測った解析・抽出の所要時間を記録する"""
+        timings = page.get('timings', {})
+        if 'parse' in timings:
+            self.timer.record('parse', timings['parse'], row=row, host=host)
+        if 'extract' in timings:
+            self.timer.record('extract', timings['extract'], row=row, host=host, pattern=page['pattern'])
+
+    def select_page(self, clinic_name, search_results, row=None):
+        """検索結果のページを順位の高い順に取得・解析し、タイトルがクリニック名と一致するページを選ぶ
+
+        タイトルはname_matcherの2-gramの点数で判定する。判定中の候補の先まで
+        candidate_window件だけ並行して取得し、一致が確定した時点で残りの候補は取得しない。
+        確定する候補がなければ、点数が最も高い候補（それもなければ最初の結果）を使う。
+        """
+        window = max(self.candidate_window, 1)
+        self.log(f"- {len(search_results)}件の候補ページを順に取得します（先読み{window}件）")
+        futures = []
+        first_page = None
+        first_error = None
+        best = None
+        try:
+            # 検索結果の順位どおりに判定する
+            for rank, url in enumerate(search_results):
+                while len(futures) < min(rank + window, len(search_results)):
+                    futures.append(self.track_queue(self.io_pool.submit(
+                        self.call_profiled, self.fetch_and_extract, search_results[len(futures)], clinic_name, row,
+                        'candidate_fetch', self.request_timeout()), 'fetch'))
+                try:
+                    page = self.await_result(futures[rank])
+                except RowInterrupted:
+                    raise
+                except Exception as e:
+                    self.log(f"- URL取得エラー: {str(e)}")
+                    self.metric_candidates.inc(result='error')
+                    if rank == 0:
+                        first_error = e
+                    continue
+
+                if rank == 0:
+                    first_page = page
+                score, accepted = self.name_index.match(clinic_name, page['title'])
+                if accepted:
+                    self.metric_candidates.inc(result='accepted')
+                    self.log(f"- タイトルに一致するURLを発見: {url}（一致度 {score:.2f}）")
+                    return page
+                self.metric_candidates.inc(result='rejected')
+                if score >= TITLE_THRESHOLD and (best is None or score > best[0]):
+                    best = (score, page)
+        finally:
+            # 一致するページが見つかった時点で残りの取得は不要
+            for future in futures:
+                future.cancel()
+            self.metric_candidates.inc(len(search_results) - len(futures), result='not_fetched')
+
+        if best is not None:
+            self.log(f"- タイトルが最もよく一致するURLを使用: {best[1]['url']}（一致度 {best[0]:.2f}）")
+            return best[1]
+        if first_page is None:
+            raise first_error
+        # マッチするURLが見つからない場合は最初の結果を使用
+        self.log(f"- タイトルに一致するURLが見つかりませんでした。最初の結果を使用: {first_page['url']}")
+        return first_page
+
+    def render_and_extract(self, page, clinic_name, row=None):
+        """静的なHTMLでFAX番号が見つからず、SPAらしいページだけをブラウザで描画して解析し直す"""
+        if self.browser_pool is None or page['fax_number'] or not page['spa']:
+            return page
+
+        self.log(f"- JavaScriptで描画されるページのため、ブラウザで描画します: {page['url']}")
+        host = urlparse(page['url']).netloc
+        try:
+            with self.timer.span('render', row=row, host=host) as span:
+                html = self.browser_pool.render(page['url'])
+                span['bytes'] = len(html)
+        except Exception as e:
+            self.log(f"- ブラウザでの描画に失敗しました: {str(e)}")
+            return page
+
+        return self.parse_page(html.encode('utf-8'), clinic_name, page['url'], 'utf-8', row, host)
+
+    def save_fax_number(self, row, page, message):
+        """抽出結果のFAX番号と信頼度を行に書き込む"""
+        self.log(f"- パターン{page['pattern']}でFAX番号を検出（信頼度 {page['confidence']:.2f}）")
+        self.metric_patterns.inc(pattern=page['pattern'])
+        # 番号の正規化（市外局番に合わせたハイフン区切り。抽出側で正規化済みだが念のため）
+        fax_number = normalize_phone(page['fax_number']) or page['fax_number']
+        row['FAX番号'] = str(fax_number)  # 文字列として保存
+        row['エラー詳細'] = None  # エラーをクリア
+        row['取得元'] = page['url']
+        row['信頼度'] = f"{page['confidence']:.2f}"
+        self.log(f"{message}{fax_number}")
+
+    def load_pdf_index(self, names):
+        """PDFの結果を読み込み、入力CSVのクリニック名で引ける索引を作る"""
+        try:
+            records = load_pdf_results(self.pdf_results)
+        except Exception as e:
+            self.log(f"PDFの結果の読み込みに失敗しました: {str(e)}")
+            return
+        started = time.perf_counter()
+        self.pdf_index = CrossReference(names, records)
+        self.log(f"PDFの結果を読み込みました: {len(records)}件の番号のうち{len(self.pdf_index.by_name)}件が"
+                 f"入力のクリニックに対応します（{time.perf_counter() - started:.1f}秒）")
+
+    def resolve_from_pdf(self, row, clinic_name):
+        """PDFの結果に載っているクリニックなら、検索せずにその番号を書き込んでTrueを返す"""
+        if self.pdf_index is None:
+            return False
+        record, score = self.pdf_index.lookup(str(clinic_name))
+        if record is None:
+            return False
+        fax_number = normalize_phone(record['digits']) or record['digits']
+        row['FAX番号'] = fax_number
+        row['エラー詳細'] = None
+        row['取得元'] = f"PDF: {record['file']} {record['page']}ページ"
+        self.log(f"- PDFの結果にあるため検索しません: {fax_number}（{record['file']} {record['page']}ページ, "
+                 f"一致度 {score:.2f}）")
+        return True
+
+    def process_row(self, row, index, clinic_name):
+        """1件のクリニックについて検索・取得・抽出を行い、結果を行に書き込む"""
+        # Google検索でクリニックのウェブサイトを探す
+        search_query = clinic_name  # クリニック名のみで検索
+        self.log(f"- 検索クエリ: {search_query}")
+        search_results = self.search(search_query, index)
+
+        if not search_results:
+            row['エラー詳細'] = "ウェブサイトが見つかりませんでした"
+            self.log("- ウェブサイトが見つかりませんでした")
+            return
+
+        try:
+            page = self.select_page(clinic_name, search_results, index)
+        except requests.exceptions.RequestException as e:
+            self.log(f"- ページの取得に失敗しました: {str(e)}")
+            row['エラー詳細'] = f"ページの取得に失敗: {str(e)}"
+            return
+        self.log("- ページの取得に成功しました")
+        page = self.render_and_extract(page, clinic_name, index)
+
+        # トップページから直接FAX番号を探す（信頼度が十分なら詳細ページは見ない）
+        self.log("- トップページからFAX番号を探します")
+        if page['fax_number'] and page['confidence'] >= DETAIL_HOP_CONFIDENCE:
+            self.save_fax_number(row, page, "- トップページでFAX番号が見つかりました: ")
+            return
+
+        # 詳細ページへのリンクを探す
+        if page['fax_number']:
+            self.log(f"- トップページの番号の信頼度が低いため（{page['confidence']:.2f}）、詳細ページも探します")
+        else:
+            self.log("- トップページでFAX番号が見つかりませんでした。詳細ページを探します")
+        if not page['detail_url']:
+            self.log("- 詳細ページへのリンクが見つかりませんでした")
+            if page['fax_number']:
+                self.save_fax_number(row, page, "- トップページの番号を使います: ")
+            else:
+                row['エラー詳細'] = "詳細ページへのリンクが見つかりませんでした"
+            return
+
+        self.log(f"- リンクを検出: {page['detail_text']}")
+        self.log(f"- 詳細ページを検出: {page['detail_url']}")
+        self.metric_detail_hops.inc(reason='low_confidence' if page['fax_number'] else 'not_found')
+        future = self.track_queue(self.io_pool.submit(
+            self.call_profiled, self.fetch_and_extract, page['detail_url'], clinic_name, index, 'detail_fetch',
+            self.request_timeout()), 'fetch')
+        try:
+            detail_page = self.await_result(future)
+        except RowInterrupted:
+            future.cancel()
+            raise
+        except requests.exceptions.RequestException as e:
+            self.log(f"- 詳細ページの取得に失敗しました: {str(e)}")
+            if page['fax_number']:
+                self.save_fax_number(row, page, "- トップページの番号を使います: ")
+            else:
+                row['エラー詳細'] = f"詳細ページの取得に失敗: {str(e)}"
+            return
+        self.log("- 詳細ページの取得に成功しました")
+        detail_page = self.render_and_extract(detail_page, clinic_name, index)
+
+        # トップページと詳細ページの番号のうち、信頼度の高い方を使う
+        if detail_page['fax_number'] and detail_page['confidence'] > page['confidence']:
+            self.save_fax_number(row, detail_page, "- メインページでFAX番号が見つかりました: ")
+        elif page['fax_number']:
+            self.save_fax_number(row, page, "- トップページの番号を使います: ")
+        else:
+            row['エラー詳細'] = "メインページでもFAX番号が見つかりませんでした"
+            self.log("- メインページでもFAX番号が見つかりませんでした")
+
+    def count_partial_rows(self, partial_path):
+        """前回の書き込み途中の出力があれば、その行数を返す（再開しない場合や使えない場合は消して0）
+
+        入力の順番どおりに書いた途中結果は入力の先頭からの行と同じなので、続きの行から再開できる。
+        終わった順に書いた途中結果は先頭からの行とは限らず、結果の列が足りないものは追記できないため使わない。
+        """
+        if not os.path.exists(partial_path):
+            return 0
+        columns = read_csv_columns(partial_path)
+        # 結果の列が足りない途中結果（列を追加する前の版で書いたもの）には追記できない
+        if self.resume and ROW_NUMBER_COLUMN not in columns and all(column in columns for column in RESULT_COLUMNS):
+            rows = count_csv_rows(partial_path)
+            self.log(f"書き込み途中の出力から再開します: {partial_path}（{rows}件処理済み）")
+            return rows
+        os.remove(partial_path)
+        return 0
+
+    def scan_input(self, sources):
+        """(クリニック名のリスト, 総件数, 処理を始める行)を返す
+
+        sourcesは(CSVのパス, 先頭から読み飛ばす行数)のリストで、順につなげて1つの入力として扱う。
+        総件数は改行を数えて求め、名前と結果の列だけを、再開位置と名簿の索引に使う件数が
+        そろうところまで読む。PDFの結果と突き合わせる場合はクリニック名をすべて読む。
+        """
+        total = sum(max(count_csv_rows(path) - skip, 0) for path, skip in sources)
+        names = []
+        keep_all_names = bool(self.pdf_results)
+        start_index = None if self.resume else 0
+        offset = 0
+        for path, skip in sources:
+            columns = read_csv_columns(path)
+            usecols = [columns[0]] + [column for column in ('FAX番号', 'エラー詳細') if column in columns[1:]]
+            seen = 0
+            for chunk in read_csv_chunks(path, usecols=usecols):
+                if seen < skip:
+                    dropped = min(skip - seen, len(chunk))
+                    seen += dropped
+                    chunk = chunk.iloc[dropped:]
+                    if chunk.empty:
+                        continue
+                if start_index is None:
+                    # FAX番号もエラー詳細も空の最初の行から再開する（列がなければ空とみなす）
+                    empty = pd.Series(True, index=chunk.index)
+                    for column in ('FAX番号', 'エラー詳細'):
+                        if column in chunk.columns:
+                            empty &= chunk[column].isna()
+                    if empty.any():
+                        start_index = offset + int(empty.to_numpy().argmax())
+                if keep_all_names or len(names) < NAME_INDEX_MAX_NAMES:
+                    names.extend(chunk.iloc[:, 0].dropna())
+                offset += len(chunk)
+                if start_index is not None and not keep_all_names and len(names) >= NAME_INDEX_MAX_NAMES:
+                    return names, total, start_index
+        return names, total, start_index or 0
+
+    def handle_row(self, index, row):
+        """1行を処理して(行, 処理したか)を返す（パイプラインの処理ワーカーのスレッドで呼ばれる）
+
+        再開位置より前の行と、中止の要求を受けた後の行はそのまま書き込む。処理中に中止を要求された行も
+        処理前のまま書き込む。持ち時間を使い切った行は処理前に戻してRetryLaterを投げ、パイプラインに
+        後回しにさせる。2回目も使い切れば時間切れとしてエラー詳細に記録する。
+        """
+        if ROW_NUMBER_COLUMN in self.writer.columns and row.get(ROW_NUMBER_COLUMN) is None:
+            row[ROW_NUMBER_COLUMN] = str(index + 1)
+        if index < self.start_index or self.stop_requested:
+            return row, False
+
+        original = dict(row)
+        try:
+            clinic_name = row[self.name_column]  # インデックス列はCSVの最初の列と仮定
+            self.on_progress(clinic_name, index + 1, self.total)
+            self.log(f"処理中: {clinic_name} ({index + 1}/{self.total})")
+
+            # エラー詳細をリセット
+            row['エラー詳細'] = None
+
+            # すでにFAX番号がある場合はスキップ
+            if row.get('FAX番号') is not None:
+                self.log(f"- すでにFAX番号があります: {row['FAX番号']}")
+                self.count_row('skipped')
+                return row, True
+
+            # PDFの結果に載っていればネットワークに接続しない
+            if self.resolve_from_pdf(row, clinic_name):
+                self.count_row('pdf')
+                return row, True
+
+            row_started = time.perf_counter()
+            self.start_row_clock(row_started)
+            with self.timer.span('row', row=index):
+                try:
+                    self.process_row(row, index, clinic_name)
+                    self.count_row('not_found' if row.get('FAX番号') is None else 'found')
+                except RowCancelled:
+                    self.log("- 中止の要求を受けたため、この行は処理前のまま書き込みます")
+                    row.clear()
+                    row.update(original)
+                    return row, False
+                except RowTimeout as e:
+                    if index not in self.retried_rows:
+                        self.retried_rows.add(index)
+                        self.metric_requeued.inc()
+                        self.log(f"- {e}。後回しにして処理し直します")
+                        row.clear()
+                        row.update(original)
+                        raise RetryLater(str(e)) from e
+                    self.retried_rows.discard(index)
+                    error_msg = f"時間切れ: 処理し直しても{e}"
+                    self.log(f"- {error_msg}")
+                    row['エラー詳細'] = error_msg
+                    self.count_row('timeout')
+                except Exception as e:
+                    error_msg = f"処理中にエラーが発生しました: {str(e)}"
+                    self.log(f"- {error_msg}")
+                    row['エラー詳細'] = error_msg
+                    self.count_row('error')
+                finally:
+                    self.start_row_clock(None)
+            self.log_if_slow(clinic_name, index, time.perf_counter() - row_started)
+
+            # サーバーに負荷をかけないよう少し待機（中止を要求されたらすぐにやめる）
+            if self.pace_requests:
+                self.stop_event.wait(0.5)  # 0.5秒待機
+
+        except RetryLater:
+            raise
+        except Exception as e:
+            self.log(f"行の処理中にエラーが発生しました: {str(e)}")
+        return row, True
+
+    def write_row(self, index, result):
+        """処理を終えた行を書き込み途中の出力に追記し、定期的にディスクへ書き出す"""
+        row, processed = result
+        self.writer.write(row)
+        if not processed:
+            return
+        self.unsaved_rows += 1
+        if self.unsaved_rows >= SAVE_EVERY_ROWS:
+            try:
+                with self.timer.span('save', row=index):
+                    self.writer.flush()
+                self.log(f"- {index + 1}件目を保存しました")
+            except Exception as e:
+                self.log(f"- 保存に失敗しました: {str(e)}")
+            self.unsaved_rows = 0
+
+    def run(self):
+        if self.log_path:
+            self.file_logger = open_log_file(self.log_path)
+        self.timer = StageTimer(self.trace_path, histogram=self.metric_stage_seconds)
+        self.rows_done = 0
+        self.run_started = time.monotonic()
+        try:
+            self.log("処理を開始します...")
+            if self.site_memo_path:
+                try:
+                    self.site_memo = SiteMemo(self.site_memo_path)
+                    self.log(f"サイトごとのFAX番号の場所の記録を読み込みました: {len(self.site_memo)}件")
+                except Exception as e:
+                    # 記録が壊れていても処理は続け、最後に新しい記録で置き換える
+                    self.log(f"サイトごとの記録の読み込みに失敗しました: {str(e)}")
+                    self.site_memo = SiteMemo()
+                    self.site_memo.path = self.site_memo_path
+
+            # CSVファイルを読み込む（出力先に前回の途中結果があればそちらから再開する）
+            source_path = self.csv_path
+            if self.resume and self.output_path != self.csv_path and os.path.exists(self.output_path):
+                source_path = self.output_path
+                self.log(f"前回の出力ファイルから再開します: {source_path}")
+            # 出力は書き込み途中のファイルに追記し、最後まで書いたら出力先に置き換える
+            partial_path = self.output_path + PARTIAL_SUFFIX
+            try:
+                done_rows = self.count_partial_rows(partial_path)
+                sources = [(partial_path, 0)] if done_rows else []
+                names, total, self.start_index = self.scan_input(sources + [(source_path, done_rows)])
+                columns = read_csv_columns(partial_path if done_rows else source_path)
+                self.log(f"CSVファイルを読み込みました: {total}件のデータ")
+            except Exception as e:
+                self.log(f"CSVファイルの読み込みに失敗しました: {str(e)}")
+                self.on_error(f"CSVファイルの読み込みに失敗しました: {str(e)}")
+                return
+
+            self.total = total
+            self.name_column = columns[0]
+            self.log(f"総処理件数: {total}件")
+
+            # 検索結果のタイトルやリンクの照合に使う名簿の索引
+            self.name_index = NameIndex(names[:NAME_INDEX_MAX_NAMES])
+            if self.pdf_results:
+                self.load_pdf_index(names)
+            del names
+
+            # FAX番号・エラー詳細・取得元（番号を見つけたページのURL、またはPDFのファイル名とページ）・
+            # 信頼度（ページから抽出した番号の確からしさ）の
+            # カラムがなければ追加。終わった順に書き込む場合は入力の順番に戻せるよう行番号も付ける
+            added_columns = [column for column in RESULT_COLUMNS if column not in columns]
+            if not self.ordered and ROW_NUMBER_COLUMN not in columns:
+                added_columns.append(ROW_NUMBER_COLUMN)
+            for column in added_columns:
+                columns.append(column)
+                self.log(f"{column}カラムを追加しました")
+
+            if self.start_index > 0:
+                self.log(f"前回の処理から再開します。開始位置: {self.start_index + 1}件目")
+
+            # ページ取得はI/Oスレッド、HTMLの解析と抽出はプロセスプールで行う
+            self.log(
+                f"取得スレッド数: {self.fetch_workers}, 解析プロセス数: {self.parse_workers}, "
+                f"並行して処理する行数: {self.row_workers}"
+            )
+            if self.render_js:
+                from render_backend import BrowserPool
+
+                # ブラウザは必要になった時点で起動し、実行中は使い回す
+                self.browser_pool = BrowserPool(size=self.render_pool_size, log=self.log)
+                self.log("JavaScriptで描画されるページはヘッドレスブラウザで取得します")
+
+            if self.parse_workers > 0:
+                parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                                     initializer=_init_parse_worker)
+            else:
+                parse_executor = nullcontext()
+            self.writer = CsvRowWriter(partial_path, columns, append=bool(done_rows))
+            self.unsaved_rows = 0
+            # 中止したときは取得中の通信の終わりを待たずに抜けられるよう、I/Oのスレッドプールはwithで閉じない
+            self.io_pool = ThreadPoolExecutor(max_workers=self.fetch_workers)
+            try:
+                with parse_executor as parse_pool:
+                    self.parse_pool = parse_pool
+                    self.retried_rows = set()
+
+                    # 各クリニックに対して処理（読み込み・処理・書き込みを並行して流す）
+                    self.pipeline = RowPipeline(self.handle_row, self.write_row, workers=self.row_workers,
+                                                queue_size=self.queue_size, ordered=self.ordered)
+                    self.pipeline.run(iter_csv_rows(source_path, start=done_rows))
+                    if self.pipeline.requeued:
+                        self.log(f"持ち時間を使い切って後回しにした行: {self.pipeline.requeued}件")
+            finally:
+                self.io_pool.shutdown(wait=not self.stop_requested, cancel_futures=True)
+                self.writer.close()
+                self.pipeline = None
+            if self.stop_requested:
+                self.log("処理を中断しました")
+
+            # 最終結果を保存（中断した場合も残りの行は書き込み済み）
+            try:
+                with self.timer.span('save'):
+                    os.replace(partial_path, self.output_path)
+                self.log(f"処理が完了しました。結果は '{self.output_path}' に保存されています")
+            except Exception as e:
+                self.log(f"最終保存に失敗しました: {str(e)}")
+                self.on_error(f"最終保存に失敗しました: {str(e)}")
+
+        except Exception as e:
+            error_msg = f"予期せぬエラーが発生しました: {str(e)}"
+            self.log(error_msg)
+            self.on_error(error_msg)
+        
+        finally:
+            if self.site_memo is not None and self.site_memo.changed:
+                try:
+                    self.site_memo.save()
+                    self.log(f"サイトごとのFAX番号の場所の記録を保存しました: {len(self.site_memo)}件")
+                except Exception as e:
+                    self.log(f"サイトごとの記録の保存に失敗しました: {str(e)}")
+            if self.timer.durations:
+                self.log("段階ごとの所要時間:\n" + self.timer.summary())
+            self.timer.close()
+            if self.browser_pool is not None:
+                self.browser_pool.close()
+                self.browser_pool = None
+            if self.file_logger is not None:
+                close_log_file(self.file_logger)
+                self.file_logger = None
+
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""名簿の分割（シャード）と、シャードごとの結果の統合
+
+1台の検索の待機時間が処理速度の上限になるため、名簿をN個に分けて別々のマシンで処理する。
+行の振り分けは正規化したクリニック名のハッシュで決めるので、何度分けても同じ行は同じシャードに入り、
+表記ゆれのある同じクリニックの行もまとまる（同じシャードのキャッシュが効く）。
+シャードの入力には元の行番号（1から数える）の列を付けておき、統合ではその列で元の順番に戻し、
+同じ行が複数の結果にあれば結果のあるものを残す。
+
+    python fax_scraper_cli.py clinics.csv --shard 0/4 -o shard0.csv   # 各マシンで1つずつ処理する
+    python shard.py merge shard0.csv shard1.csv shard2.csv shard3.csv --roster clinics.csv -o result.csv
+    python shard.py split clinics.csv --shards 4 -o shards            # 入力だけを先に分けておく場合
+    python shard.py local clinics.csv --shards 4 --replay run.replay.gz -o result.csv   # 手元での確認
+"""
+
+import argparse
+import hashlib
+import heapq
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from name_matcher import normalize_name
+from row_pipeline import ROW_NUMBER_COLUMN, CsvRowWriter, iter_csv_rows, read_csv_columns
+
+SHARD_INPUT_SUFFIX = '_input.csv'
+
+
+def shard_of(clinic_name, shards):
+    """クリニック名を振り分けるシャードの番号（0からshards-1）
+
+    Pythonのhash()は実行ごとに変わるため、正規化した名前のblake2bで決める。
+    """
+    digest = hashlib.blake2b(normalize_name(clinic_name).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+def parse_shard(text):
+    """「I/N」を(I, N)にする"""
+    try:
+        index, shards = (int(value) for value in text.split('/'))
+    except ValueError:
+        raise ValueError(f"シャードは「番号/分割数」の形式で指定してください: {text}")
+    if not 0 <= index < shards:
+        raise ValueError(f"シャードの番号は0から{shards - 1}の範囲で指定してください: {text}")
+    return index, shards
+
+
+def shard_input_path(output_path):
+    """シャードの出力先に対応する、シャードの入力ファイルのパス"""
+    return os.path.splitext(output_path)[0] + SHARD_INPUT_SUFFIX
+
+
+def split_roster(roster_path, shards, paths):
+    """名簿を読みながら各行をシャードに振り分け、{シャード番号: 行数}を返す
+
+    pathsは{シャード番号: 書き込み先}で、指定のないシャードの行は書かない。
+    名簿にすでに行番号の列があればそれを使い、なければ名簿の何行目か（1から数える）を付ける。
+    """
+    columns = read_csv_columns(roster_path)
+    if ROW_NUMBER_COLUMN not in columns:
+        columns.append(ROW_NUMBER_COLUMN)
+    writers = {index: CsvRowWriter(path, columns) for index, path in paths.items()}
+    counts = {index: 0 for index in range(shards)}
+    try:
+        for row_index, row in iter_csv_rows(roster_path):
+            index = shard_of(row[columns[0]], shards)
+            counts[index] += 1
+            if index in writers:
+                if row.get(ROW_NUMBER_COLUMN) is None:
+                    row[ROW_NUMBER_COLUMN] = str(row_index + 1)
+                writers[index].write(row)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts
+
+
+def _result_rank(row):
+    """重複した行のうち残すものの優先度（小さいほど優先: FAX番号あり → エラー詳細あり → 未処理）"""
+    if row.get('FAX番号') is not None:
+        return 0
+    if row.get('エラー詳細') is not None:
+        return 1
+    return 2
+
+
+def _numbered_rows(path):
+    """シャードの結果を(行番号, 行)で返す。統合のため行番号の順に並んでいることを確かめる"""
+    previous = 0
+    for _, row in iter_csv_rows(path):
+        number = row.get(ROW_NUMBER_COLUMN)
+        if number is None:
+            raise ValueError(f"{ROW_NUMBER_COLUMN}の列がない行があります: {path}")
+        number = int(number)
+        if number < previous:
+            raise ValueError(f"{ROW_NUMBER_COLUMN}の順に並んでいません（--unorderedで処理した結果は"
+                             f"{ROW_NUMBER_COLUMN}で並べ替えてから統合してください）: {path}")
+        previous = number
+        yield number, row
+
+
+def _roster_rows(path):
+    """名簿を(行番号, 行)で返す。名簿に行番号の列があればその値、なければ何行目か（1から数える）を使う"""
+    for row_index, row in iter_csv_rows(path):
+        number = row.get(ROW_NUMBER_COLUMN)
+        yield (int(number) if number is not None else row_index + 1), row
+
+
+def merge_shards(shard_paths, output_path, roster_path=None, keep_row_numbers=False):
+    """シャードの結果を行番号の順に統合して書き出し、件数の集計を返す
+
+    各シャードの結果は行番号の順に並んでいるので、ファイル全体を読み込まずに順に突き合わせる。
+    同じ行番号の行が複数あれば、結果のあるものを1つだけ残す。roster_pathを指定すると
+    どのシャードにもない名簿の行もそのまま書き、missingとして数える。
+    """
+    columns = read_csv_columns(shard_paths[0])
+    if roster_path is not None:
+        roster_columns = read_csv_columns(roster_path)
+        keep_row_numbers = keep_row_numbers or ROW_NUMBER_COLUMN in roster_columns
+        columns = roster_columns + [column for column in columns if column not in roster_columns]
+    if not keep_row_numbers:
+        columns = [column for column in columns if column != ROW_NUMBER_COLUMN]
+
+    summary = {'rows': 0, 'found': 0, 'duplicates': 0, 'missing': 0}
+    merged = heapq.merge(*(_numbered_rows(path) for path in shard_paths), key=lambda item: item[0])
+    roster = _roster_rows(roster_path) if roster_path is not None else iter(())
+    roster_item = next(roster, None)
+    writer = CsvRowWriter(output_path, columns)
+
+    def write_result(number, row):
+        nonlocal roster_item
+        # 名簿でこの行番号より前にある、どのシャードにもなかった行を先に書く
+        while roster_item is not None and roster_item[0] < number:
+            summary['missing'] += 1
+            emit(roster_item[1])
+            roster_item = next(roster, None)
+        if roster_item is not None and roster_item[0] == number:
+            roster_item = next(roster, None)
+        if row is not None:
+            emit(row)
+
+    def emit(row):
+        writer.write(row)
+        summary['rows'] += 1
+        if row.get('FAX番号') is not None:
+            summary['found'] += 1
+
+    try:
+        current_number, current = None, None
+        for number, row in merged:
+            if number == current_number:
+                summary['duplicates'] += 1
+                if _result_rank(row) < _result_rank(current):
+                    current = row
+                continue
+            if current is not None:
+                write_result(current_number, current)
+            current_number, current = number, row
+        if current is not None:
+            write_result(current_number, current)
+        write_result(float('inf'), None)
+    finally:
+        writer.close()
+    return summary
+
+
+def run_local(roster_path, shards, archive_path, output_path, latency=0.0, parse_workers=None,
+              work_dir=None, log=print):
+    """記録したアーカイブのスタブサーバーを立て、シャードごとにCLIを別プロセスで実行して統合する
+
+    各プロセスは検索結果をアーカイブから、ページをスタブサーバーからHTTPで取得する。
+    複数のマシンで分担する場合と同じ手順を1台で確かめるためのもの。
+    """
+    from http_replay import ArchiveReplayer, start_stub_server
+
+    replayer = ArchiveReplayer(archive_path, latency=latency)
+    server = start_stub_server(replayer)
+    stub_url = f"http://127.0.0.1:{server.server_address[1]}"
+    work_dir = work_dir or tempfile.mkdtemp(prefix='shards_')
+    os.makedirs(work_dir, exist_ok=True)
+    cli_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fax_scraper_cli.py')
+    log(f"スタブサーバー: {stub_url}  作業ディレクトリ: {work_dir}")
+
+    processes = []
+    outputs = []
+    started = time.perf_counter()
+    try:
+        for index in range(shards):
+            output = os.path.join(work_dir, f"shard{index}.csv")
+            command = [sys.executable, cli_path, roster_path, '--shard', f"{index}/{shards}", '-o', output,
+                       '--replay', archive_path, '--replay-stub-url', stub_url,
+                       '--replay-latency', str(latency * 1000), '--no-resume', '-q',
+                       '--log-file', os.path.join(work_dir, f"shard{index}.log")]
+            if parse_workers is not None:
+                command += ['--parse-workers', str(parse_workers)]
+            processes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL))
+            outputs.append(output)
+        failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        server.shutdown()
+    elapsed = time.perf_counter() - started
+    if failed:
+        log(f"失敗したシャード: {failed}（ログ: {work_dir}）")
+        return False
+    summary = merge_shards(outputs, output_path, roster_path=roster_path)
+    log(f"{shards}シャード {elapsed:.2f}秒  {summary['rows']}行を統合しました（FAX番号あり {summary['found']}件, "
+        f"重複 {summary['duplicates']}件, どのシャードにもない行 {summary['missing']}件）")
+    return not failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="名簿の分割と、シャードごとの結果の統合")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    split = subparsers.add_parser('split', help="名簿をシャードごとの入力ファイルに分ける")
+    split.add_argument("roster", help="クリニック名が最初の列に入ったCSVファイル")
+    split.add_argument("--shards", type=int, required=True, help="分割数")
+    split.add_argument("-o", "--output-dir", default=".", help="shard<番号>.csv を書き出すディレクトリ")
+
+    merge = subparsers.add_parser('merge', help="シャードごとの結果を1つのCSVに統合する")
+    merge.add_argument("shards", nargs="+", help="各シャードの結果CSV（--shardで処理した出力）")
+    merge.add_argument("-o", "--output", required=True, help="統合した結果の保存先")
+    merge.add_argument("--roster", help="元の名簿。指定するとどのシャードにもない行も残して件数を確かめる")
+    merge.add_argument("--keep-row-numbers", action="store_true", help=f"{ROW_NUMBER_COLUMN}の列を残す")
+
+    local = subparsers.add_parser('local', help="記録したアーカイブとスタブサーバーで、シャードを別プロセスで処理して統合する")
+    local.add_argument("roster")
+    local.add_argument("--shards", type=int, required=True, help="分割数（同時に起動するプロセス数）")
+    local.add_argument("--replay", required=True, metavar="ARCHIVE", help="--record で記録したアーカイブ")
+    local.add_argument("-o", "--output", required=True, help="統合した結果の保存先")
+    local.add_argument("--latency", type=float, default=0.0, help="1回の取得・検索ごとの遅延（ミリ秒）")
+    local.add_argument("--parse-workers", type=int, default=None, help="各プロセスのHTML解析のプロセス数")
+    local.add_argument("--work-dir", help="シャードごとの出力とログの保存先（既定: 一時ディレクトリ）")
+    local.add_argument("--expected", help="結果の比較に使うCSV（分割せずに処理した出力など）")
+
+    args = parser.parse_args(argv)
+    if args.command == 'split':
+        os.makedirs(args.output_dir, exist_ok=True)
+        paths = {index: os.path.join(args.output_dir, f"shard{index}.csv") for index in range(args.shards)}
+        counts = split_roster(args.roster, args.shards, paths)
+        for index, count in counts.items():
+            print(f"{paths[index]}: {count}行")
+        return 0
+
+    if args.command == 'merge':
+        summary = merge_shards(args.shards, args.output, roster_path=args.roster,
+                               keep_row_numbers=args.keep_row_numbers)
+        print(f"{summary['rows']}行を統合しました（FAX番号あり {summary['found']}件, "
+              f"重複 {summary['duplicates']}件, どのシャードにもない行 {summary['missing']}件）: {args.output}")
+        return 0
+
+    ok = run_local(args.roster, args.shards, args.replay, args.output, latency=args.latency / 1000,
+                   parse_workers=args.parse_workers, work_dir=args.work_dir)
+    if ok and args.expected:
+        from http_replay import compare_results
+
+        mismatches = compare_results(args.expected, args.output)
+        print("結果の一致: " + ("OK" if not mismatches else f"{len(mismatches)}件の食い違い"))
+        for mismatch in mismatches[:10]:
+            print(f"    {mismatch}")
+        ok = ok and not mismatches
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
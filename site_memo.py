@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""サイトごとに、FAX番号が見つかった検出パターンと要素の場所を覚えておく記録
+
+同じホスティングのテンプレート（協会の detail.html?id= のページなど）を使うクリニックが多いが、
+どのページも検出パターン1から順に試している。FAX番号を高い信頼度で見つけたページについて、
+(ホスト, テンプレートの指紋)ごとにパターン番号と番号のあった要素のCSSセレクタを記録しておき、
+次に同じテンプレートのページを解析するときは、そのセレクタで要素を引くだけで済ませる。
+複数のホストで同じ場所が確かめられたテンプレートは、初めてのホストのページにも使う。
+記録はJSONファイルに保存し、次の実行でも使う。
+
+    python site_memo.py site_memo.json      # 記録の一覧
+    python site_memo.py --benchmark 300     # 擬似的なテンプレートのページで、記録がある場合とない場合の抽出時間
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from fax_extractor import HIGH_CONFIDENCE
+
+SITE_MEMO_FILE = 'site_memo.json'
+SITE_MEMO_VERSION = 1
+# 1つのホストについて渡す記録の数の上限（テンプレートを使い分けるサイトでも数種類まで）
+MAX_HINTS_PER_HOST = 4
+# 別のホストで確かめられたテンプレートの記録を渡す数の上限
+MAX_SHARED_HINTS = 8
+# この数以上のホストで同じ場所が確かめられたテンプレートは、他のホストのページにも使う
+SHARED_TEMPLATE_HOSTS = 2
+# 続けてこの回数だけ記録した場所で見つからなければ、記録を消す（サイトの作り替えなど）
+MAX_MISSES = 3
+
+
+class SiteMemo:
+    """(ホスト, テンプレートの指紋)ごとの、FAX番号が見つかったパターンとセレクタの記録
+
+    複数スレッドから共有できる。pathを指定すると既存の記録を読み込み、save()で書き出す。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        # {ホスト: {指紋: {'pattern', 'selector', 'hits', 'misses', 'updated_at'}}}
+        self.sites = {}
+        self._shared = None  # 複数のホストで確かめられたテンプレートの記録（変更があれば作り直す）
+        self.changed = False
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == SITE_MEMO_VERSION:
+                self.sites = data.get('sites', {})
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(entries) for entries in self.sites.values())
+
+    def hints(self, host):
+        """extract_pageに渡す記録のリスト（{'fingerprint', 'pattern', 'selector'}）
+
+        このホストの記録を見つかった回数の多い順に並べ、複数のホストで確かめられたテンプレートの記録を続ける。
+        """
+        with self._lock:
+            entries = sorted(self.sites.get(host, {}).items(), key=lambda item: -item[1]['hits'])
+            hints = [{'fingerprint': fingerprint, 'pattern': entry['pattern'], 'selector': entry['selector']}
+                     for fingerprint, entry in entries[:MAX_HINTS_PER_HOST]]
+            if self._shared is None:
+                self._shared = self._shared_templates()
+            own = {hint['fingerprint'] for hint in hints}
+            hints.extend(hint for hint in self._shared if hint['fingerprint'] not in own)
+        return hints
+
+    def _shared_templates(self):
+        counts = Counter()
+        for entries in self.sites.values():
+            for fingerprint, entry in entries.items():
+                counts[(fingerprint, entry['pattern'], entry['selector'])] += 1
+        return [{'fingerprint': fingerprint, 'pattern': pattern, 'selector': selector}
+                for (fingerprint, pattern, selector), hosts in counts.most_common(MAX_SHARED_HINTS)
+                if hosts >= SHARED_TEMPLATE_HOSTS]
+
+    def record(self, host, page):
+        """extract_pageの結果を記録に反映する
+
+        信頼度の高い番号が見つかったページは、その場所を記録する（同じテンプレートで場所が
+        変わっていれば新しい場所に置き換える）。記録した場所で見つからなかった回数が続けば記録を消す。
+        """
+        fingerprint = page.get('fingerprint')
+        if not host or not fingerprint:
+            return
+        with self._lock:
+            entries = self.sites.setdefault(host, {})
+            entry = entries.get(fingerprint)
+            if page['fax_number'] and page['confidence'] >= HIGH_CONFIDENCE and page.get('selector'):
+                if entry is None or (entry['pattern'], entry['selector']) != (page['pattern'], page['selector']):
+                    entry = entries[fingerprint] = {'pattern': page['pattern'], 'selector': page['selector'],
+                                                    'hits': 0, 'misses': 0}
+                    self._shared = None
+                entry['hits'] += 1
+                entry['misses'] = 0
+                entry['updated_at'] = time.time()
+                self.changed = True
+            elif entry is not None and page.get('memo') == 'miss':
+                entry['misses'] += 1
+                if entry['misses'] >= MAX_MISSES:
+                    del entries[fingerprint]
+                    self._shared = None
+                self.changed = True
+            if not entries:
+                del self.sites[host]
+
+    def save(self, path=None):
+        """書き込み途中で中断しても壊れないよう一時ファイルから置き換える"""
+        path = path or self.path
+        with self._lock:
+            data = json.dumps({'version': SITE_MEMO_VERSION, 'sites': self.sites}, ensure_ascii=False, indent=1)
+            self.changed = False
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+# ---- ベンチマーク ----
+
+TEMPLATE_PAGE = """<html><head><meta charset="utf-8"><title>{name}｜{association}</title>
+<link rel="stylesheet" href="/css/{template}.css"></head>
+<body><div class="header {template}"><h1>{association}</h1><ul class="nav">{nav}</ul></div>
+<div class="news">{news}</div>
+<div class="clinic"><h2>{name}</h2><table class="info">
+<tr><th>住所</th><td>横浜市鶴見区豊岡町{i}-{i}</td></tr>
+<tr><th>電話番号</th><td>045-5{i:02d}-1234</td></tr>
+<tr><th>FAX</th><td>045-5{i:02d}-5678</td></tr>
+<tr><th>診療科目</th><td>内科・小児科</td></tr></table></div>
+<div class="footer">{association} 事務局</div></body></html>"""
+
+NAV_ITEM = '<li><a href="/list.html?page={page}">一覧{page}</a></li>'
+NEWS_ITEM = "<p>お知らせ：予防接種の予約は各医療機関へ直接お問い合わせください。（{date}更新）</p>"
+
+
+def _template_pages(count, templates=3, hosts=10):
+    """ベンチマーク用に、いくつかのテンプレートで作った協会の詳細ページを(ホスト, HTML)で返す"""
+    pages = []
+    for i in range(count):
+        template = f"tpl{i % templates}"
+        html = TEMPLATE_PAGE.format(
+            name=f"テストクリニック{i}", association=f"{template}医師会", template=template, i=i % 100,
+            nav=''.join(NAV_ITEM.format(page=page) for page in range(20 + 5 * (i % templates))),
+            news=''.join(NEWS_ITEM.format(date=f"{i % 12 + 1}月{day + 1}日") for day in range(40)))
+        pages.append((f"{template}-{i % hosts}.example.jp", html.encode('utf-8')))
+    return pages
+
+
+def _benchmark(count, log=print):
+    """記録がない場合（6パターンを順に試す）と、前半のページで記録した後の抽出時間と結果を比べる"""
+    from bs4 import BeautifulSoup
+
+    from fax_extractor import extract_page, find_fax_number, template_fingerprint
+
+    pages = _template_pages(count)
+    soups = [(host, BeautifulSoup(content, 'html.parser')) for host, content in pages]
+    memo = SiteMemo()
+    # 前半のページを解析しながら記録を作る
+    for host, content in pages[:len(pages) // 2]:
+        memo.record(host, extract_page(content, '', f"http://{host}/detail.html?id=1", 'utf-8'))
+
+    results = {}
+    for label, use_memo in (('no memo', False), ('site memo', True)):
+        found = []
+        started = time.perf_counter()
+        for host, soup in soups:
+            hints = memo.hints(host) if use_memo else None
+            found.append(find_fax_number(soup, hints, template_fingerprint(soup) if hints else None)[0])
+        results[label] = (found, (time.perf_counter() - started) / len(soups) * 1000)
+
+    log(f"ページ数: {len(pages)}（テンプレート3種類・ホスト{len({host for host, _ in pages})}件）  記録: {len(memo)}件")
+    # 全角文字は幅がずれるため、見出しは半角にする
+    log(f"{'':<12}{'ms/page':>9}{'found':>7}")
+    for label, (found, ms) in results.items():
+        log(f"{label:<12}{ms:>9.3f}{sum(1 for number in found if number):>7}")
+    same = results['no memo'][0] == results['site memo'][0]
+    log(f"結果の一致: {'OK' if same else 'NG'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="サイトごとのFAX番号の場所の記録の一覧と計測")
+    parser.add_argument("memo", nargs="?", help="記録のファイル（site_memo.json）")
+    parser.add_argument("--benchmark", type=int, nargs="?", const=300, metavar="PAGES",
+                        help="擬似的なテンプレートのページで、記録がある場合とない場合の抽出時間を比べる（既定: 300ページ）")
+    args = parser.parse_args(argv)
+    if args.benchmark:
+        _benchmark(args.benchmark)
+        return 0
+    if not args.memo:
+        parser.error("記録のファイルか --benchmark を指定してください")
+
+    memo = SiteMemo(args.memo)
+    print(f"{len(memo.sites)}ホスト {len(memo)}件")
+    # 全角文字は幅がずれるため、見出しは半角にする
+    print(f"{'host':<32}{'fingerprint':<18}{'pattern':>8}{'hits':>6}  selector")
+    for host, entries in sorted(memo.sites.items()):
+        for fingerprint, entry in entries.items():
+            print(f"{host:<32}{fingerprint:<18}{entry['pattern']:>8}{entry['hits']:>6}  {entry['selector']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""処理段階ごとの所要時間の記録と集計
+
+1行（1クリニック）の処理を段階（検索前の待機・検索・候補ページ取得・解析・抽出・
+詳細ページ取得・保存など）に分け、それぞれの所要時間・バイト数・ホスト・ヒットしたパターンを
+記録する。記録はJSONL形式で書き出せ、実行の最後に段階ごとのパーセンタイル表を出す。
+
+    python stage_timing.py trace.jsonl   # 保存済みの記録を集計する
+"""
+
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# 集計表に出すパーセンタイル
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, p):
+    """ソート済みの値のpパーセンタイル（最近傍順位法）"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def format_summary(durations):
+    """{段階: [秒, ...]} を段階ごとのパーセンタイル表（ミリ秒）にする"""
+    # 全角文字は幅がずれるため、見出しは半角にする
+    header = f"{'stage':<18}{'count':>8}{'total(s)':>10}" + ''.join(f"{f'p{p}(ms)':>11}" for p in PERCENTILES) + f"{'max(ms)':>11}"
+    lines = [header]
+    # 合計時間の大きい段階から並べる
+    for stage, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values = sorted(values)
+        line = f"{stage:<18}{len(values):>8}{sum(values):>10.1f}"
+        line += ''.join(f"{percentile(values, p) * 1000:>11.1f}" for p in PERCENTILES)
+        line += f"{values[-1] * 1000:>11.1f}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+class StageTimer:
+    """段階ごとの所要時間を記録する（複数スレッドから使える）
+
+    trace_pathを指定すると、1件ごとの記録をJSONLとして逐次書き出す。
+    集計用にはメモリ上に段階ごとの所要時間だけを持つ。
+    histogram（metrics.Histogram）を渡すと、stageラベル付きで所要時間を記録する。
+    """
+
+    def __init__(self, trace_path=None, histogram=None):
+        self.durations = defaultdict(list)
+        self.histogram = histogram
+        self._lock = threading.Lock()
+        self._trace = open(trace_path, 'a', encoding='utf-8') if trace_path else None
+
+    def record(self, stage, duration, **attrs):
+        """記録を1件追加する。attrsにはrow, host, bytes, patternなどを入れる"""
+        if self.histogram is not None:
+            self.histogram.observe(duration, stage=stage)
+        with self._lock:
+            self.durations[stage].append(duration)
+            if self._trace is not None:
+                span = {'stage': stage, 'duration': round(duration, 6), 'ts': round(time.time(), 3)}
+                span.update((key, value) for key, value in attrs.items() if value is not None)
+                self._trace.write(json.dumps(span, ensure_ascii=False) + '\n')
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """with文の中の処理時間を記録する。yieldしたdictに値を追加すると記録に含まれる"""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record(stage, time.perf_counter() - start, **attrs)
+
+    def summary(self):
+        """段階ごとのパーセンタイル表を返す"""
+        with self._lock:
+            durations = {stage: list(values) for stage, values in self.durations.items()}
+        return format_summary(durations)
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+def load_trace(path):
+    """JSONLの記録を読み込み、{段階: [秒, ...]} にする"""
+    durations = defaultdict(list)
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                durations[span['stage']].append(span['duration'])
+    return durations
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("使い方: python stage_timing.py trace.jsonl [...]", file=sys.stderr)
+        sys.exit(1)
+    merged = defaultdict(list)
+    for trace_path in sys.argv[1:]:
+        for stage, values in load_trace(trace_path).items():
+            merged[stage].extend(values)
+    print(format_summary(merged))
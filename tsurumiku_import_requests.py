@@ -1,111 +1,58 @@
-import requests
-from bs4 import BeautifulSoup
-import re
-import time
-import csv
+import os
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QLabel, QLineEdit, QPushButton, 
-                           QFileDialog, QProgressBar, QTextEdit, QMessageBox)
+                           QFileDialog, QProgressBar, QTextEdit, QMessageBox,
+                           QCheckBox)
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 
+from roster_crawler import RosterCrawler, SnapshotStore, load_profile
+
+# 鶴見区医師会のサイトプロファイル（検索フォームやFAX番号の取り出し方はこちらに定義）
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites', 'tsurumiku.json')
+
+
 class FaxScraperThread(QThread):
+    """鶴見区医師会のプロファイルでRosterCrawlerを別スレッドで実行する"""
     progress_updated = pyqtSignal(int)
     log_updated = pyqtSignal(str)
     finished = pyqtSignal()
     error_occurred = pyqtSignal(str)
 
-    def __init__(self, output_path):
+    def __init__(self, output_path, max_workers=4, request_interval=1.0, incremental=True):
         super().__init__()
         self.output_path = output_path
-        self.stop_requested = False
+        base_path = os.path.splitext(output_path)[0]
+        self.snapshot_path = base_path + '_snapshot.json'
+        self.diff_path = base_path + '_diff.csv'
+
+        self.profile = load_profile(PROFILE_PATH)
+        self.profile['max_workers'] = max_workers  # 詳細ページを並行して取得するスレッド数
+        self.profile['request_interval'] = request_interval  # 同じホストへのリクエスト間隔（秒）
+
+        # 差分更新: 前回の取得結果から変わったページだけを抽出し直し、差分を出力する
+        self.crawler = RosterCrawler(
+            snapshot=SnapshotStore(self.snapshot_path),
+            incremental=incremental,
+            on_log=self.log_updated.emit,
+            on_progress=self.update_progress,
+        )
+
+    @property
+    def stop_requested(self):
+        return self.crawler.stop_requested
+
+    @stop_requested.setter
+    def stop_requested(self, value):
+        self.crawler.stop_requested = value
+
+    def update_progress(self, site_id, done, total):
+        self.progress_updated.emit(int(done / total * 100))
 
     def run(self):
         try:
-            base_url = "https://www.tsurumiku-med.org/Renewal/search/list.html"
-            results = []
-            
-            # ベースページを取得（ユーザーエージェントを設定）
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Content-Type': 'application/x-www-form-urlencoded',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-                'Accept-Language': 'ja,en-US;q=0.9,en;q=0.8',
-                'Origin': 'https://www.tsurumiku-med.org',
-                'Referer': 'https://www.tsurumiku-med.org/Renewal/search/index.html'
-            }
-            
-            self.log_updated.emit("=== 検索ページを取得 ===")
-            search_page_url = "https://www.tsurumiku-med.org/Renewal/search/index.html"
-            response = requests.get(search_page_url, headers=headers)
-            response.encoding = response.apparent_encoding
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # 検索フォームのデータ（キーワード検索を使用）
-            data = {
-                'mode': '1',  # キーワード検索モード
-                'keyword': '',  # 空のキーワードで全件検索
-                'week[]': ['1', '2', '3', '4', '5', '6', '7', '8'],  # すべての診療日を選択
-                'submit': 'この条件でさがす'
-            }
-            
-            # POSTリクエストを送信
-            response = requests.post(base_url, headers=headers, data=data)
-            response.encoding = response.apparent_encoding
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            links = soup.find_all('a')
-            
-            total_links = len(links)
-            self.log_updated.emit(f"\n合計 {total_links} 個のリンクが見つかりました。処理を開始します...")
-            
-            # 各リンク先にアクセスしてFAX番号を取得
-            for i, link in enumerate(links):
-                if self.stop_requested:
-                    self.log_updated.emit("処理を中止しました")
-                    break
-                
-                href = link.get('href')
-                if href and not href.startswith('#') and not href.startswith('javascript'):
-                    # 相対URLを絶対URLに変換
-                    if not href.startswith('http'):
-                        if base_url.endswith('/'):
-                            full_url = base_url + href
-                        else:
-                            full_url = base_url[:base_url.rfind('/')+1] + href
-                    else:
-                        full_url = href
-                    
-                    link_text = link.get_text().strip()
-                    if not link_text:
-                        link_text = f"リンク {i+1}"
-                    
-                    self.log_updated.emit(f"処理中 ({i+1}/{total_links}): {link_text} - {full_url}")
-                    
-                    # FAX番号を取得
-                    fax_number = self.get_fax_number(full_url)
-                    
-                    # 結果を保存
-                    results.append({
-                        'リンク名': link_text,
-                        'URL': full_url,
-                        'FAX番号': fax_number
-                    })
-                    
-                    # 進捗を更新
-                    progress = int((i + 1) / total_links * 100)
-                    self.progress_updated.emit(progress)
-                    
-                    # サーバーに負荷をかけないよう少し待機
-                    time.sleep(1)
-            
-            # 結果をCSVファイルに保存
-            with open(self.output_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
-                fieldnames = ['リンク名', 'URL', 'FAX番号']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
-                for result in results:
-                    writer.writerow(result)
+            self.crawler.crawl_site(self.profile, self.output_path, self.diff_path)
+            self.crawler.snapshot.save()
             
             self.log_updated.emit(f"\n処理が完了しました。結果は '{self.output_path}' に保存されています。")
             self.finished.emit()
@@ -113,31 +60,6 @@ class FaxScraperThread(QThread):
         except Exception as e:
             self.error_occurred.emit(str(e))
 
-    def get_fax_number(self, url):
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            page_text = soup.get_text()
-            
-            fax_pattern = re.compile(r'[Ff][Aa][Xx]:?\s*(\d[\d\-]+)')
-            match = fax_pattern.search(page_text)
-            
-            if match:
-                fax_number = match.group(1)
-                return fax_number
-            else:
-                return "FAX番号が見つかりませんでした"
-                
-        except Exception as e:
-            return f"エラー: {str(e)}"
-
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -166,6 +88,11 @@ class MainWindow(QMainWindow):
         browse_button.clicked.connect(self.browse_output_file)
         output_frame.addWidget(browse_button)
         
+        # 差分更新
+        self.incremental_checkbox = QCheckBox("前回から変更のあったページだけを抽出し直し、差分を出力する")
+        self.incremental_checkbox.setChecked(True)
+        layout.addWidget(self.incremental_checkbox)
+        
         # 進捗バー
         self.progress_bar = QProgressBar()
         layout.addWidget(self.progress_bar)
@@ -211,7 +138,9 @@ class MainWindow(QMainWindow):
         self.progress_bar.setValue(0)
         self.log_text.clear()
         
-        self.scraper_thread = FaxScraperThread(self.output_path.text())
+        self.scraper_thread = FaxScraperThread(
+            self.output_path.text(), incremental=self.incremental_checkbox.isChecked()
+        )
         self.scraper_thread.progress_updated.connect(self.update_progress)
         self.scraper_thread.log_updated.connect(self.update_log)
         self.scraper_thread.finished.connect(self.scraping_finished)